@@ -1,92 +1,96 @@
-from amadeus import Client, ResponseError
+from functools import partial
+from urllib.request import urlopen
+from amadeus import Client, NetworkError, ResponseError, ServerError
 import azure_config
-
-# Mapeamento de cidades para códigos IATA (com variações ortográficas)
-CITY_TO_IATA = {
-    'lisboa': 'LIS', 'lisbon': 'LIS',
-    'madrid': 'MAD', 'madri': 'MAD',
-    'paris': 'CDG', 'pariz': 'CDG',
-    'londres': 'LHR', 'london': 'LHR',
-    'roma': 'FCO', 'rome': 'FCO',
-    'barcelona': 'BCN', 'barça': 'BCN',
-    'berlim': 'BER', 'berlin': 'BER',
-    'amsterda': 'AMS', 'amsterdam': 'AMS',
-    'dublin': 'DUB', 'dublim': 'DUB',
-    'irlanda': 'DUB', 'ireland': 'DUB',
-    'praga': 'PRG', 'prague': 'PRG',
-    'viena': 'VIE', 'vienna': 'VIE',
-    'budapeste': 'BUD',
-    'varsovia': 'WAW',
-    'atenas': 'ATH',
-    'istambul': 'IST',
-    'italia': 'FCO',
-    'milao': 'MXP',
-    'veneza': 'VCE',
-    'florenca': 'FLR',
-    'napoles': 'NAP',
-    'sao paulo': 'GRU',
-    'rio de janeiro': 'GIG',
-    'rio': 'GIG',
-    'brasilia': 'BSB',
-    'salvador': 'SSA',
-    'fortaleza': 'FOR',
-    'recife': 'REC',
-    'manaus': 'MAO',
-    'curitiba': 'CWB',
-    'porto alegre': 'POA',
-    'belo horizonte': 'CNF',
-    'miami': 'MIA',
-    'nova york': 'JFK',
-    'nova iorque': 'JFK',
-    'new york': 'JFK',
-    'los angeles': 'LAX',
-    'chicago': 'ORD',
-    'toronto': 'YYZ',
-    'cidade do mexico': 'MEX',
-    'mexico': 'MEX',
-    'buenos aires': 'EZE',
-    'lima': 'LIM',
-    'santiago': 'SCL',
-    'chile': 'SCL',
-    'bogota': 'BOG',
-    'toquio': 'NRT',
-    'tokyo': 'NRT',
-    'seul': 'ICN',
-    'pequim': 'PEK',
-    'xangai': 'PVG',
-    'singapura': 'SIN',
-    'dubai': 'DXB',
-    'sidney': 'SYD',
-    'sydney': 'SYD',
-    'melbourne': 'MEL',
-}
+import gazetteer
+import metrics
+import resilience
+from cache import TTLCache
+from hedging import Hedger
+from hotel_index import HotelIdIndex
 
 def normalize_city_name(city_name):
     """Remove acentos e normaliza nome da cidade"""
-    import unicodedata
-    nfkd = unicodedata.normalize('NFKD', city_name)
-    return ''.join([c for c in nfkd if not unicodedata.combining(c)]).lower().strip()
+    return gazetteer.normalize(city_name)
+
+def unknown_code(city_name):
+    """
+    Código IATA bem formado fora do gazetteer (ex.: entidade 'NAT' do CLU):
+    segue como veio, em maiúsculas, para a Amadeus validar
+    """
+    code = city_name.strip()
+    return code.upper() if len(code) == 3 and code.isascii() and code.isalpha() else None
 
 def get_iata_code(city_name):
-    """Converte nome de cidade para código IATA (tolerante a erros)"""
-    if not city_name:
-        return None
-    city_lower = city_name.lower().strip()
-    city_normalized = normalize_city_name(city_name)
-    
-    # Se já é um código IATA (3 letras maiúsculas)
-    if len(city_lower) == 3:
-        return city_lower.upper()
-    
-    # Buscar no dicionário (original e normalizado)
-    return CITY_TO_IATA.get(city_lower) or CITY_TO_IATA.get(city_normalized)
+    """Converte nome de cidade para código IATA do aeroporto (tolerante a erros)"""
+    city = gazetteer.default.resolve(city_name) if city_name else None
+    if city:
+        return city.airport_code
+    return unknown_code(city_name) if city_name else None
+
+def get_city_name(city_name):
+    """Nome da cidade que será buscada ('lisbao' -> 'Lisboa'), ou None se não resolvida"""
+    city = gazetteer.default.resolve(city_name) if city_name else None
+    return city.name if city else None
+
+def is_amadeus_failure(error):
+    """Erros que contam para o circuit breaker (4xx, como data inválida, não contam)"""
+    return isinstance(error, (ServerError, NetworkError)) or not isinstance(error, ResponseError)
+
+def get_city_code(city_name):
+    """Converte nome de cidade para código IATA da cidade (usado na busca de hotéis)"""
+    city = gazetteer.default.resolve(city_name) if city_name else None
+    if city:
+        return city.city_code
+    return unknown_code(city_name) if city_name else None
 
 class AmadeusClient:
     def __init__(self):
         if not azure_config.AMADEUS_CLIENT_ID or not azure_config.AMADEUS_CLIENT_SECRET:
             self.client = None
         else:
-            self.client = Client(client_id=azure_config.AMADEUS_CLIENT_ID, client_secret=azure_config.AMADEUS_CLIENT_SECRET)
+            self.client = Client(client_id=azure_config.AMADEUS_CLIENT_ID, client_secret=azure_config.AMADEUS_CLIENT_SECRET,
+                                 http=partial(urlopen, timeout=azure_config.AMADEUS_TIMEOUT))
+
+        # Amadeus fora do ar: voos respondem "serviço ocupado", hotéis caem nos simulados
+        self.guard = resilience.guard('amadeus', azure_config.BULKHEAD_AMADEUS, is_failure=is_amadeus_failure)
+
+        # Hedge da busca de voos: cópia da chamada se passar do p95 recente
+        self.flight_hedger = None
+        if azure_config.AMADEUS_HEDGE_ENABLED:
+            self.flight_hedger = Hedger(
+                'amadeus_flights',
+                percentile=azure_config.AMADEUS_HEDGE_PERCENTILE,
+                max_extra=azure_config.AMADEUS_HEDGE_MAX_EXTRA,
+                min_delay=azure_config.AMADEUS_HEDGE_MIN_DELAY_MS / 1000,
+                min_samples=azure_config.AMADEUS_HEDGE_MIN_SAMPLES,
+                # Mais threads que vagas no bulkhead só gerariam cópias recusadas
+                workers=self.guard.bulkhead.max_concurrent
+            )
+
+        # Cache de buscas de voos: (origem, destino, data, adultos) -> ofertas
+        self.flight_cache = TTLCache(
+            maxsize=azure_config.AMADEUS_FLIGHT_CACHE_SIZE,
+            ttl=azure_config.AMADEUS_FLIGHT_CACHE_TTL,
+            name='amadeus_flights'
+        )
+
+        # Cache de buscas de hotéis: (cidade, check-in, check-out, quartos) -> ofertas.
+        # Também é o destino da pré-busca feita enquanto o usuário escolhe o voo
+        self.hotel_cache = TTLCache(
+            maxsize=azure_config.AMADEUS_HOTEL_CACHE_SIZE,
+            ttl=azure_config.AMADEUS_HOTEL_CACHE_TTL,
+            name='amadeus_hotels'
+        )
+
+        # Índice cityCode -> hotelIds (aquecido em background e salvo em disco)
+        self.hotel_index = HotelIdIndex(
+            fetcher=self._fetch_hotel_ids,
+            snapshot_path=azure_config.AMADEUS_HOTEL_INDEX_PATH or None,
+            refresh_interval=azure_config.AMADEUS_HOTEL_INDEX_REFRESH_HOURS * 3600
+        )
+        if self.client:
+            self.hotel_index.start(warm_cities=azure_config.AMADEUS_HOTEL_INDEX_WARM)
 
     def search_flights(self, origin, destination, departureDate, returnDate=None, adults=1):
         if not self.client:
@@ -99,52 +103,96 @@ class AmadeusClient:
         if not dest_code:
             return {'error': f'Cidade {destination} não encontrada'}
         
+        # Buscas idênticas simultâneas compartilham uma única chamada à API
+        key = (origin_code, dest_code, departureDate, adults)
+        return self.flight_cache.get_or_load(
+            key,
+            lambda: self._fetch_flights(origin_code, dest_code, departureDate, adults),
+            should_cache=lambda result: isinstance(result, list)
+        )
+
+    def _fetch_flights(self, origin_code, dest_code, departureDate, adults):
+        request = partial(self._flight_offers, origin_code, dest_code, departureDate, adults)
         try:
-            response = self.client.shopping.flight_offers_search.get(
+            if self.flight_hedger:
+                # A cópia não espera vaga no bulkhead: não disputa com as chamadas principais
+                response = self.flight_hedger.call(request, hedge=partial(request, hedge=True))
+            else:
+                response = request()
+            return response.data
+        except resilience.DependencyUnavailable as e:
+            # Recusada sem chamar a API (circuito aberto/bulkhead cheio): não é "sem voos"
+            return {'error': str(e), 'unavailable': True}
+        except (ResponseError, TimeoutError) as e:
+            metrics.inc('amadeus_errors', {'api': 'flights'})
+            return {'error': str(e)}
+
+    def _flight_offers(self, origin_code, dest_code, departureDate, adults, hedge=False):
+        # Cada tentativa (inclusive o hedge) entra na etapa amadeus_flights
+        with metrics.timed('amadeus_flights'):
+            return (self.guard.try_call if hedge else self.guard.call)(
+                self.client.shopping.flight_offers_search.get,
                 originLocationCode=origin_code,
                 destinationLocationCode=dest_code,
                 departureDate=departureDate,
                 adults=adults
             )
-            return response.data
-        except ResponseError as e:
-            return {'error': str(e)}
 
     def search_hotels(self, cityCode, checkInDate, checkOutDate, roomQuantity=1):
         if not self.client:
             return {'error': 'Amadeus credentials not set'}
         
         try:
-            # Primeiro, buscar hotéis por cidade usando hotel-list
-            # Nota: cityCode precisa ser código IATA da cidade, não do aeroporto
-            response = self.client.reference_data.locations.hotels.by_city.get(cityCode=cityCode)
-            
-            if not response.data:
-                return {'error': f'Nenhum hotel encontrado para {cityCode}'}
-            
-            # Pegar IDs dos primeiros 10 hotéis
-            hotel_ids = [hotel.get('hotelId') for hotel in response.data[:10] if hotel.get('hotelId')]
+            # Buscas idênticas simultâneas (inclusive uma pré-busca em andamento)
+            # compartilham uma única chamada; hotéis simulados não entram no cache
+            return self.hotel_cache.get_or_load(
+                self.hotel_cache_key(cityCode, checkInDate, checkOutDate, roomQuantity),
+                lambda: self._fetch_hotels(cityCode, checkInDate, checkOutDate, roomQuantity),
+                should_cache=lambda result: isinstance(result, list)
+            )
             
-            if not hotel_ids:
-                return {'error': 'Nenhum hotel disponível'}
+        except resilience.DependencyUnavailable as e:
+            print(f"[WARN] {e}", flush=True)
+            return self._get_simulated_hotels(cityCode, checkInDate, checkOutDate)
+        except (ResponseError, TimeoutError) as e:
+            error_detail = str(e)
+            metrics.inc('amadeus_errors', {'api': 'hotels'})
+            print(f"[ERROR] Amadeus hotel API error: {error_detail}", flush=True)
             
-            # Buscar ofertas para esses hotéis
-            offers_response = self.client.shopping.hotel_offers_search.get(
+            # Se falhar, retornar hotéis simulados como fallback
+            return self._get_simulated_hotels(cityCode, checkInDate, checkOutDate)
+    
+    @staticmethod
+    def hotel_cache_key(cityCode, checkInDate, checkOutDate, roomQuantity=1):
+        return (cityCode.upper(), checkInDate, checkOutDate, roomQuantity)
+
+    def _fetch_hotels(self, cityCode, checkInDate, checkOutDate, roomQuantity):
+        # IDs dos hotéis vêm do índice local; a API de referência só é
+        # consultada na primeira busca da cidade (ou na atualização periódica)
+        # Nota: cityCode precisa ser código IATA da cidade, não do aeroporto
+        hotel_ids = self.hotel_index.get(cityCode)
+        
+        if not hotel_ids:
+            return {'error': f'Nenhum hotel encontrado para {cityCode}'}
+        
+        # Buscar ofertas para esses hotéis
+        with metrics.timed('amadeus_hotels'):
+            offers_response = self.guard.call(
+                self.client.shopping.hotel_offers_search.get,
                 hotelIds=','.join(hotel_ids[:5]),  # Limitar a 5 para não sobrecarregar
                 checkInDate=checkInDate,
                 checkOutDate=checkOutDate,
                 adults=1,
                 roomQuantity=roomQuantity
             )
-            
-            return offers_response.data if offers_response.data else []
-            
-        except ResponseError as e:
-            error_detail = str(e)
-            print(f"[ERROR] Amadeus hotel API error: {error_detail}", flush=True)
-            
-            # Se falhar, retornar hotéis simulados como fallback
-            return self._get_simulated_hotels(cityCode, checkInDate, checkOutDate)
+        
+        return offers_response.data if offers_response.data else []
+    
+    def _fetch_hotel_ids(self, cityCode):
+        """Consulta a lista de hotéis da cidade (hotel-list) e retorna os IDs"""
+        with metrics.timed('amadeus_hotel_ids'):
+            response = self.guard.call(self.client.reference_data.locations.hotels.by_city.get, cityCode=cityCode)
+        return [hotel.get('hotelId') for hotel in (response.data or []) if hotel.get('hotelId')]
     
     def _get_simulated_hotels(self, cityCode, checkInDate, checkOutDate):
         """Fallback: dados simulados quando API falha"""
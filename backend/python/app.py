@@ -2,10 +2,13 @@
 Flask API - Flight & Hotel Chatbot
 Integrado com Azure CLU, Text Analytics, Cosmos DB e Amadeus
 """
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import bot
+import json
+import metrics
 import os
+import resilience
 import sys
 
 # Detectar diretório do frontend automaticamente
@@ -27,20 +30,52 @@ if os.path.exists(frontend_path):
 app = Flask(__name__, static_folder=frontend_path, static_url_path='')
 CORS(app)
 
+# Compartilhado com asgi_app.py
+API_INFO = {
+    'service': 'Flight & Hotel Chatbot API',
+    'version': '1.0',
+    'status': 'running',
+    'endpoints': {
+        'GET /': 'Interface do chatbot',
+        'GET /api': 'Informações da API',
+        'POST /api/chat': 'Enviar mensagem ao chatbot',
+        'POST /api/chat/stream': 'Enviar mensagem, resposta em streaming (SSE: ack, chunk, done)',
+        'GET /health': 'Status do serviço',
+        'GET /api/timings': 'Latência por etapa do pipeline',
+        'GET /metrics': 'Métricas no formato Prometheus'
+    }
+}
+
+HEALTH = {'status': 'ok', 'service': 'flight-hotel-chatbot', 'version': '1.0'}
+
+def health_payload():
+    """HEALTH + estado do circuit breaker de cada dependência ('degraded' se algum não está fechado)"""
+    return dict(HEALTH, status='degraded' if resilience.degraded() else 'ok', dependencies=resilience.snapshot())
+
+def validate_chat_request(data):
+    """Corpo de erro (400) se a requisição de chat for inválida, senão None"""
+    if not isinstance(data, dict) or 'message' not in data:
+        return {'response': 'Mensagem inválida. Envie {"userId": "id", "message": "texto"}', 'error': True}
+    if not str(data.get('message', '')).strip():
+        return {'response': 'Mensagem vazia', 'error': True}
+    return None
+
+def sse_event(event, data):
+    """Formata um evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Endpoint principal do chatbot"""
     try:
         data = request.json
-        if not data or 'message' not in data:
-            return jsonify({'response': 'Mensagem inválida. Envie {"userId": "id", "message": "texto"}', 'error': True}), 400
+        error = validate_chat_request(data)
+        if error:
+            return jsonify(error), 400
         
         user_id = data.get('userId', 'anonymous')
         message = data.get('message', '').strip()
         
-        if not message:
-            return jsonify({'response': 'Mensagem vazia', 'error': True}), 400
-        
         print(f"[INFO] User {user_id}: {message[:50]}...", flush=True)
         
         resp = bot.rest_handle(data)
@@ -51,10 +86,88 @@ def chat():
         print(f"[ERROR] {error_msg}", flush=True)
         return jsonify({'response': f'Erro: {error_msg[:100]}', 'error': True}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Mesmo contrato do /api/chat, com a resposta enviada em trechos (SSE)"""
+    data = request.get_json(silent=True)
+    error = validate_chat_request(data)
+    if error:
+        return jsonify(error), 400
+    
+    print(f"[INFO] User {data.get('userId', 'anonymous')} (stream): {str(data['message']).strip()[:50]}...", flush=True)
+    
+    events = (sse_event(event, payload) for event, payload in bot.rest_handle_stream(data))
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'ok', 'service': 'flight-hotel-chatbot', 'version': '1.0'})
+    return jsonify(health_payload())
+
+@app.route('/api/timings', methods=['GET'])
+def timings():
+    """Latência por etapa do pipeline (janela das últimas requisições)"""
+    return jsonify(timings_payload())
+
+def timings_payload():
+    return {
+        'concurrent_pipeline': bot.pipeline_executor is not None,
+        'stages': metrics.snapshot(),
+        'cosmos_writer': bot.store.writer_stats(),
+        'cosmos_history': bot.store.history_stats(),
+        'sentiment_batches': bot.text_analytics.stats(),
+        'flight_cache': bot.amadeus.flight_cache.stats(),
+        'flight_hedging': bot.amadeus.flight_hedger.stats() if bot.amadeus.flight_hedger else None,
+        'hotel_cache': bot.amadeus.hotel_cache.stats(),
+        'hotel_index': bot.amadeus.hotel_index.stats(),
+        'prefetch': bot.prefetcher.stats() if bot.prefetcher else None,
+        'sessions': bot.sessions.stats(),
+        'clu_http': bot.clu.connection_stats(),
+        'clu_cache': bot.clu.cache_stats(),
+        'intent': bot.local_intents.stats() if bot.local_intents else None,
+        'counters': metrics.counters()
+    }
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métricas no formato Prometheus"""
+    if not metrics.ENABLED:
+        return jsonify({'error': 'Métricas desativadas (METRICS_ENABLED=false)'}), 404
+    return Response(metrics.render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def _session_count():
+    # len() evita percorrer todos os contextos (stats() do backend em memória calcula o tamanho)
+    if hasattr(bot.sessions, '__len__'):
+        return len(bot.sessions)
+    return bot.sessions.stats()['sessions']
+
+def _cache_hit_rate(cache):
+    return cache.stats()['hit_rate'] if cache is not None else None
+
+def register_metric_callbacks():
+    """Valores dos componentes lidos a cada coleta do /metrics"""
+    metrics.register_callback('cosmos_queue_pending', bot.store.pending, 'Mensagens aguardando gravação no Cosmos')
+    for key in ('written', 'failed', 'dropped'):
+        metrics.register_callback(f'cosmos_items_{key}', lambda key=key: bot.store.stats[key],
+                                  f'Itens do Cosmos ({key})', kind='counter')
+    metrics.register_callback('sessions_active', _session_count, 'Conversas ativas')
+    metrics.register_callback('dependencies_degraded', lambda: len(resilience.degraded()),
+                              'Dependências com o circuito aberto ou em teste')
+    metrics.register_callback('flight_cache_hit_rate', lambda: _cache_hit_rate(bot.amadeus.flight_cache))
+    metrics.register_callback('hotel_cache_hit_rate', lambda: _cache_hit_rate(bot.amadeus.hotel_cache))
+    metrics.register_callback('clu_cache_hit_rate', lambda: _cache_hit_rate(bot.clu.cache))
+    metrics.register_callback('hotel_index_cities', lambda: bot.amadeus.hotel_index.stats()['cities'])
+    metrics.register_callback('clu_connection_reuse_rate', lambda: bot.clu.connection_stats()['connection_reuse_rate'])
+    metrics.register_callback('sentiment_documents_per_call',
+                              lambda: (bot.text_analytics.stats() or {}).get('avg_documents_per_call'))
+    if bot.local_intents:
+        metrics.register_callback('intent_clu_avoidance_rate', lambda: bot.local_intents.stats()['clu_avoidance_rate'],
+                                  'Fração dos turnos resolvidos sem chamar o CLU')
+
+register_metric_callbacks()
 
 @app.route('/', methods=['GET'])
 def index():
@@ -83,17 +196,7 @@ def index():
 @app.route('/api', methods=['GET'])
 def api_info():
     """API info endpoint"""
-    return jsonify({
-        'service': 'Flight & Hotel Chatbot API',
-        'version': '1.0',
-        'status': 'running',
-        'endpoints': {
-            'GET /': 'Interface do chatbot',
-            'GET /api': 'Informações da API',
-            'POST /api/chat': 'Enviar mensagem ao chatbot',
-            'GET /health': 'Status do serviço'
-        }
-    })
+    return jsonify(API_INFO)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))
@@ -0,0 +1,198 @@
+"""
+Modo de serviço ASGI (asyncio) - mesmos endpoints do app.py
+O turno aguarda o CLU sem ocupar uma thread; apenas o handler do estado
+(SDK da Amadeus é síncrono) roda no executor do event loop. Um único
+processo mantém centenas de conversas em andamento.
+
+Uso: uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import json
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+import azure_config
+import bot
+import metrics
+from app import (API_INFO, PROMETHEUS_CONTENT_TYPE, frontend_path, health_payload, sse_event, timings_payload,
+                 validate_chat_request)
+
+# Corpo máximo aceito em POST /api/chat
+MAX_BODY_BYTES = 64 * 1024
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type'),
+]
+
+
+async def send_response(send, status, body, content_type='application/json'):
+    if not isinstance(body, bytes):
+        body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        content_type = 'application/json'
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('latin-1')),
+            (b'content-length', str(len(body)).encode('latin-1')),
+        ] + CORS_HEADERS,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive):
+    """Lê o corpo da requisição; None se passar de MAX_BODY_BYTES"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return b''
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def read_chat_request(receive, send):
+    """Corpo JSON validado, ou None depois de responder com o erro"""
+    body = await read_body(receive)
+    if body is None:
+        await send_response(send, 413, {'response': 'Mensagem muito grande', 'error': True})
+        return None
+    try:
+        data = json.loads(body or b'null')
+    except ValueError:
+        data = None
+    error = validate_chat_request(data)
+    if error:
+        await send_response(send, 400, error)
+        return None
+    return data
+
+
+async def chat(scope, receive, send):
+    """Endpoint principal do chatbot"""
+    try:
+        data = await read_chat_request(receive, send)
+        if data is None:
+            return
+
+        user_id = data.get('userId', 'anonymous')
+        message = str(data.get('message', '')).strip()
+
+        print(f"[INFO] User {user_id}: {message[:50]}...", flush=True)
+
+        resp = await bot.rest_handle_async(data)
+        await send_response(send, 200, resp)
+
+    except Exception as e:
+        error_msg = str(e)
+        print(f"[ERROR] {error_msg}", flush=True)
+        await send_response(send, 500, {'response': f'Erro: {error_msg[:100]}', 'error': True})
+
+
+async def chat_stream(scope, receive, send):
+    """Mesmo contrato do /api/chat, com a resposta enviada em trechos (SSE)"""
+    data = await read_chat_request(receive, send)
+    if data is None:
+        return
+
+    print(f"[INFO] User {data.get('userId', 'anonymous')} (stream): {str(data['message']).strip()[:50]}...", flush=True)
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ] + CORS_HEADERS,
+    })
+    async for event, payload in bot.rest_handle_stream_async(data):
+        await send({'type': 'http.response.body', 'body': sse_event(event, payload).encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def health(scope, receive, send):
+    await send_response(send, 200, health_payload())
+
+
+async def api_info(scope, receive, send):
+    await send_response(send, 200, API_INFO)
+
+
+async def timings(scope, receive, send):
+    # Coleta envolve SQLite/locks: fora do event loop
+    await send_response(send, 200, await asyncio.to_thread(timings_payload))
+
+
+async def prometheus_metrics(scope, receive, send):
+    if not metrics.ENABLED:
+        return await send_response(send, 404, {'error': 'Métricas desativadas (METRICS_ENABLED=false)'})
+    body = await asyncio.to_thread(metrics.render_prometheus)
+    await send_response(send, 200, body.encode('utf-8'), PROMETHEUS_CONTENT_TYPE)
+
+
+async def static_file(scope, receive, send):
+    """Serve o frontend (index.html em /) como o static_folder do Flask"""
+    relative = scope['path'].lstrip('/') or 'index.html'
+    root = os.path.realpath(frontend_path)
+    path = os.path.realpath(os.path.join(root, relative))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return await send_response(send, 404, {'error': 'Não encontrado', 'path': scope['path']})
+    with open(path, 'rb') as f:
+        content = f.read()
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    await send_response(send, 200, content, content_type)
+
+
+ROUTES = {
+    ('POST', '/api/chat'): chat,
+    ('POST', '/api/chat/stream'): chat_stream,
+    ('GET', '/health'): health,
+    ('GET', '/api'): api_info,
+    ('GET', '/api/timings'): timings,
+    ('GET', '/metrics'): prometheus_metrics,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Threads para as chamadas bloqueantes (Amadeus) de todos os turnos
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(
+                max_workers=azure_config.ASGI_BLOCKING_WORKERS,
+                thread_name_prefix='asgi-blocking'
+            ))
+            print(f'[STARTUP] ASGI pronto (executor={azure_config.ASGI_BLOCKING_WORKERS} threads)', flush=True)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await bot.clu.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    method = scope['method']
+    if method == 'OPTIONS':
+        return await send_response(send, 204, b'', 'text/plain')
+
+    handler = ROUTES.get((method, scope['path']))
+    if handler is None:
+        if method == 'GET' and not scope['path'].startswith('/api'):
+            handler = static_file
+        else:
+            return await send_response(send, 404, {'error': 'Endpoint não encontrado', 'path': scope['path']})
+    await handler(scope, receive, send)
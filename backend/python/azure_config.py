@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -11,20 +12,117 @@ CLU_PROJECT_NAME = os.getenv('CLU_PROJECT_NAME')
 CLU_DEPLOYMENT_NAME = os.getenv('CLU_DEPLOYMENT_NAME', 'production')
 CLU_ENDPOINT = os.getenv('CLU_ENDPOINT')
 CLU_KEY = os.getenv('CLU_KEY')
+CLU_POOL_SIZE = int(os.getenv('CLU_POOL_SIZE', 10))
+CLU_CONNECT_TIMEOUT = float(os.getenv('CLU_CONNECT_TIMEOUT', 3.05))
+CLU_READ_TIMEOUT = float(os.getenv('CLU_READ_TIMEOUT', 8))
+CLU_MAX_RETRIES = int(os.getenv('CLU_MAX_RETRIES', 2))
+CLU_BACKOFF_BASE_MS = int(os.getenv('CLU_BACKOFF_BASE_MS', 100))
+CLU_BACKOFF_MAX_MS = int(os.getenv('CLU_BACKOFF_MAX_MS', 2000))
+# Cache de predições por texto normalizado (0 desativa); CLU_CACHE_PATH opcional persiste em disco
+CLU_CACHE_SIZE = int(os.getenv('CLU_CACHE_SIZE', 5000))
+CLU_CACHE_TTL = int(os.getenv('CLU_CACHE_TTL', 86400))
+CLU_CACHE_PATH = os.getenv('CLU_CACHE_PATH')
+
+# Classificador local de intents (evita o CLU em mensagens inequívocas)
+LOCAL_INTENT_ENABLED = os.getenv('LOCAL_INTENT_ENABLED', 'true').lower() == 'true'
+LOCAL_INTENT_THRESHOLD = float(os.getenv('LOCAL_INTENT_THRESHOLD', 0.9))
+LOCAL_INTENT_FALLBACK_THRESHOLD = float(os.getenv('LOCAL_INTENT_FALLBACK_THRESHOLD', 0.5))
 
 # Text Analytics
 TEXT_ANALYTICS_ENDPOINT = os.getenv('TEXT_ANALYTICS_ENDPOINT')
 TEXT_ANALYTICS_KEY = os.getenv('TEXT_ANALYTICS_KEY')
+# Sentimento em lote: até N documentos (máx. 10 por chamada) ou janela em ms; 1 desativa
+SENTIMENT_BATCH_SIZE = int(os.getenv('SENTIMENT_BATCH_SIZE', 10))
+SENTIMENT_BATCH_WINDOW_MS = int(os.getenv('SENTIMENT_BATCH_WINDOW_MS', 20))
+
+# Métricas (/metrics no formato Prometheus); false elimina o custo da instrumentação
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Modo ASGI (asgi_app.py): threads para chamadas bloqueantes (SDK da Amadeus)
+ASGI_BLOCKING_WORKERS = int(os.getenv('ASGI_BLOCKING_WORKERS', 64))
 
 # Amadeus
 AMADEUS_CLIENT_ID = os.getenv('AMADEUS_CLIENT_ID')
 AMADEUS_CLIENT_SECRET = os.getenv('AMADEUS_CLIENT_SECRET')
+AMADEUS_TIMEOUT = float(os.getenv('AMADEUS_TIMEOUT', 10))
+AMADEUS_FLIGHT_CACHE_TTL = int(os.getenv('AMADEUS_FLIGHT_CACHE_TTL', 300))
+AMADEUS_FLIGHT_CACHE_SIZE = int(os.getenv('AMADEUS_FLIGHT_CACHE_SIZE', 512))
+
+# Hedge da busca de voos: segunda chamada idêntica se a primeira passar do percentil
+AMADEUS_HEDGE_ENABLED = os.getenv('AMADEUS_HEDGE_ENABLED', 'false').lower() == 'true'
+AMADEUS_HEDGE_PERCENTILE = float(os.getenv('AMADEUS_HEDGE_PERCENTILE', 95))
+AMADEUS_HEDGE_MAX_EXTRA = float(os.getenv('AMADEUS_HEDGE_MAX_EXTRA', 0.05))
+AMADEUS_HEDGE_MIN_DELAY_MS = int(os.getenv('AMADEUS_HEDGE_MIN_DELAY_MS', 100))
+AMADEUS_HEDGE_MIN_SAMPLES = int(os.getenv('AMADEUS_HEDGE_MIN_SAMPLES', 20))
+AMADEUS_HOTEL_INDEX_PATH = os.getenv('AMADEUS_HOTEL_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'chatbot_hotel_index.json'))
+AMADEUS_HOTEL_INDEX_REFRESH_HOURS = float(os.getenv('AMADEUS_HOTEL_INDEX_REFRESH_HOURS', 24))
+AMADEUS_HOTEL_INDEX_WARM = [c.strip() for c in os.getenv('AMADEUS_HOTEL_INDEX_WARM', 'LIS,PAR,LON,ROM,MAD,RIO,SAO').split(',') if c.strip()]
+AMADEUS_HOTEL_CACHE_TTL = int(os.getenv('AMADEUS_HOTEL_CACHE_TTL', 300))
+AMADEUS_HOTEL_CACHE_SIZE = int(os.getenv('AMADEUS_HOTEL_CACHE_SIZE', 256))
+
+# Pré-busca de hotéis (cidade + datas do voo) enquanto o usuário escolhe o voo
+AMADEUS_PREFETCH_ENABLED = os.getenv('AMADEUS_PREFETCH_ENABLED', 'true').lower() == 'true'
+AMADEUS_PREFETCH_WORKERS = int(os.getenv('AMADEUS_PREFETCH_WORKERS', 2))
+AMADEUS_PREFETCH_PER_MINUTE = int(os.getenv('AMADEUS_PREFETCH_PER_MINUTE', 60))
+AMADEUS_PREFETCH_MAX_PENDING = int(os.getenv('AMADEUS_PREFETCH_MAX_PENDING', 16))
+
+# Gazetteer de cidades (CSV com aliases e códigos IATA; vazio = data/cities.csv)
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH')
 
 # Cosmos DB
 COSMOS_ENDPOINT = os.getenv('COSMOS_ENDPOINT')
 COSMOS_KEY = os.getenv('COSMOS_KEY')
 COSMOS_DATABASE = os.getenv('COSMOS_DATABASE', 'chatbotdb')
 COSMOS_CONTAINER = os.getenv('COSMOS_CONTAINER', 'conversations')
+COSMOS_REQUEST_TIMEOUT = int(os.getenv('COSMOS_REQUEST_TIMEOUT', 5))
+
+# Cosmos DB write-behind (gravação assíncrona em lote)
+COSMOS_WRITE_BEHIND = os.getenv('COSMOS_WRITE_BEHIND', 'true').lower() == 'true'
+COSMOS_BATCH_SIZE = int(os.getenv('COSMOS_BATCH_SIZE', 50))
+COSMOS_FLUSH_INTERVAL_MS = int(os.getenv('COSMOS_FLUSH_INTERVAL_MS', 200))
+COSMOS_QUEUE_MAXSIZE = int(os.getenv('COSMOS_QUEUE_MAXSIZE', 5000))
+COSMOS_ENQUEUE_TIMEOUT_MS = int(os.getenv('COSMOS_ENQUEUE_TIMEOUT_MS', 50))
+COSMOS_DRAIN_TIMEOUT_MS = int(os.getenv('COSMOS_DRAIN_TIMEOUT_MS', 5000))
+# Espera máxima pelo sentimento pendente antes de gravar o item sem ele
+COSMOS_SENTIMENT_WAIT_MS = int(os.getenv('COSMOS_SENTIMENT_WAIT_MS', 2000))
+
+# Leitura do histórico: últimas mensagens por usuário em memória (0 desativa)
+COSMOS_HISTORY_CACHE_USERS = int(os.getenv('COSMOS_HISTORY_CACHE_USERS', 1000))
+COSMOS_HISTORY_CACHE_TURNS = int(os.getenv('COSMOS_HISTORY_CACHE_TURNS', 20))
+COSMOS_HISTORY_CACHE_TTL = int(os.getenv('COSMOS_HISTORY_CACHE_TTL', 900))
+# Consultas mais lentas que isto vão para o log com o custo em RU (0 = todas)
+COSMOS_SLOW_QUERY_MS = int(os.getenv('COSMOS_SLOW_QUERY_MS', 100))
+# Aplica a política de indexação num container que já existe (reindexa em segundo plano)
+COSMOS_APPLY_INDEXING_POLICY = os.getenv('COSMOS_APPLY_INDEXING_POLICY', 'false').lower() == 'true'
+
+# Snapshot do estado da conversa a cada transição (e a cada mudança dos dados
+# coletados), lido quando a sessão não está no worker (restart/expirada);
+# snapshots mais velhos que MAX_AGE são ignorados. Não substitui uma sessão
+# local antiga: com vários workers e SESSION_BACKEND=memory, use afinidade
+COSMOS_STATE_SNAPSHOTS = os.getenv('COSMOS_STATE_SNAPSHOTS', 'true').lower() == 'true'
+COSMOS_STATE_MAX_AGE = int(os.getenv('COSMOS_STATE_MAX_AGE', 1800))
+
+# Circuit breaker e bulkhead por dependência (CLU, Text Analytics, Cosmos, Amadeus)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv('BREAKER_HALF_OPEN_PROBES', 1))
+BULKHEAD_MAX_WAIT_MS = int(os.getenv('BULKHEAD_MAX_WAIT_MS', 100))
+BULKHEAD_CLU = int(os.getenv('BULKHEAD_CLU', 16))
+BULKHEAD_TEXT_ANALYTICS = int(os.getenv('BULKHEAD_TEXT_ANALYTICS', 4))
+BULKHEAD_COSMOS = int(os.getenv('BULKHEAD_COSMOS', 16))
+# Amadeus: uma vaga por thread que pode chamar a API (requisições + pré-busca),
+# para que as buscas principais não sejam recusadas só por falta de vaga
+BULKHEAD_AMADEUS = int(os.getenv('BULKHEAD_AMADEUS', ASGI_BLOCKING_WORKERS + AMADEUS_PREFETCH_WORKERS))
 
 # App
 PORT = int(os.getenv('PORT', 5000))
+
+# Pipeline do bot: sentimento e persistência em paralelo com o CLU
+BOT_CONCURRENT_PIPELINE = os.getenv('BOT_CONCURRENT_PIPELINE', 'true').lower() == 'true'
+BOT_PIPELINE_WORKERS = int(os.getenv('BOT_PIPELINE_WORKERS', 8))
+
+# Sessões (contexto da conversa por usuário): 'memory' ou 'sqlite' (compartilhado entre workers)
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory').lower()
+SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'chatbot_sessions.db'))
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', 10000))
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', 1800))
@@ -0,0 +1,6 @@
+"""
+Benchmark offline do bot
+Serviços externos simulados (bench.fakes), conversas roteirizadas
+(bench.workloads), o driver de carga (python -m bench.run) e os
+microbenchmarks da extração de texto (python -m bench.micro)
+"""
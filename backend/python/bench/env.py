@@ -0,0 +1,23 @@
+"""
+Variáveis de ambiente do benchmark - importar antes de qualquer módulo do bot
+(azure_config lê a configuração no import)
+"""
+import os
+
+
+def configure():
+    """
+    Credenciais fictícias para CLU e Text Analytics (nenhuma rede no construtor),
+    assim o cache do CLU e o batcher de sentimento são criados como em produção
+    """
+    os.environ.setdefault('CLU_PROJECT_NAME', 'bench')
+    os.environ.setdefault('CLU_ENDPOINT', 'https://clu.bench.invalid')
+    os.environ.setdefault('CLU_KEY', 'bench')
+    os.environ.setdefault('TEXT_ANALYTICS_ENDPOINT', 'https://sentiment.bench.invalid')
+    os.environ.setdefault('TEXT_ANALYTICS_KEY', 'bench')
+    # Não ler/gravar caches e índices persistidos de execuções reais
+    os.environ['CLU_CACHE_PATH'] = ''
+    os.environ['AMADEUS_HOTEL_INDEX_PATH'] = ''
+
+
+configure()
@@ -0,0 +1,302 @@
+"""
+Substitutos locais dos serviços externos (CLU, Text Analytics, Cosmos e Amadeus)
+Cada fake tem latência configurável (média + jitter) e taxa de erros, e é
+injetado nos clientes já criados pelo bot no lugar do transporte real
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+import requests
+from amadeus.client.errors import ServerError
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+import gazetteer
+import intent_classifier
+
+
+class Latency:
+    """
+    Latência simulada (ms) com jitter uniforme e injeção de erros; uma fração
+    tail_rate das chamadas demora tail_factor vezes mais (cauda longa)
+    """
+
+    def __init__(self, mean_ms=0.0, jitter=0.25, error_rate=0.0, seed=None, tail_rate=0.0, tail_factor=5.0):
+        self.mean = mean_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_factor = tail_factor
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def delay(self):
+        with self._lock:
+            self.calls += 1
+            spread = self._random.uniform(-self.jitter, self.jitter)
+            slow = self.tail_rate and self._random.random() < self.tail_rate
+        return max(0.0, self.mean * (1 + spread) * (self.tail_factor if slow else 1))
+
+    def wait(self):
+        seconds = self.delay()
+        if seconds:
+            time.sleep(seconds)
+
+    def fails(self):
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return failed
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors}
+
+
+def clu_prediction(text):
+    """
+    Resposta no formato do CLU: intent pelas regras locais (sem regra, uma
+    cidade citada vale como consulta de voos), cidades como Destino
+    """
+    normalized = gazetteer.normalize(text)
+    entities = [{'category': 'Destino', 'text': match.group(1)}
+                for match, _ in gazetteer.default.find_all(normalized)]
+    intent = intent_classifier.rule_intent(normalized) or ('ConsultarVoos' if entities else 'None')
+    return {'result': {'prediction': {'topIntent': intent, 'entities': entities[-1:]}}}
+
+
+class _CluResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.headers = {}
+        self._body = body
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code} Server Error', response=self)
+
+
+class FakeCluSession:
+    """Substitui o requests.Session do CluClient"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.headers = {}
+
+    def post(self, url, json=None, timeout=None):
+        self.latency.wait()
+        if self.latency.fails():
+            return _CluResponse(503)
+        return _CluResponse(200, clu_prediction(json['analysisInput']['conversationItem']['text']))
+
+
+def fake_clu_async_transport(latency):
+    """Transporte httpx para CluClient.recognize_async (modo ASGI)"""
+    import httpx
+
+    async def handler(request):
+        await asyncio.sleep(latency.delay())
+        if latency.fails():
+            return httpx.Response(503)
+        text = json.loads(request.content)['analysisInput']['conversationItem']['text']
+        return httpx.Response(200, json=clu_prediction(text))
+
+    return httpx.MockTransport(handler)
+
+
+class FakeTextAnalyticsClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def analyze_sentiment(self, documents):
+        self.latency.wait()
+        if self.latency.fails():
+            raise RuntimeError('Text Analytics indisponível (simulado)')
+        scores = SimpleNamespace(positive=0.6, neutral=0.3, negative=0.1)
+        return [SimpleNamespace(is_error=False, sentiment='positive', confidence_scores=scores)
+                for _ in documents]
+
+
+def _charge(hook, units, result):
+    """Custo simulado em RU, entregue como o SDK faz (response_hook)"""
+    if hook is not None:
+        hook({'x-ms-request-charge': f'{units:.2f}'}, result)
+
+
+class FakeCosmosContainer:
+    """
+    Container em memória com create_item, upsert_item, read_item,
+    execute_item_batch e query_items (TOP @limit e IS_DEFINED(c.role)
+    respeitados; custo em RU aproximado pelo número de itens)
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.items = {}  # userId -> lista de itens
+
+    def create_item(self, body, response_hook=None, **kwargs):
+        self.latency.wait()
+        if self.latency.fails():
+            raise RuntimeError('Cosmos indisponível (simulado)')
+        with self._lock:
+            self.items.setdefault(body['userId'], []).append(body)
+        _charge(response_hook, 6.0, body)
+        return body
+
+    def upsert_item(self, body, response_hook=None, **kwargs):
+        self.latency.wait()
+        if self.latency.fails():
+            raise RuntimeError('Cosmos indisponível (simulado)')
+        with self._lock:
+            self._upsert(body['userId'], body)
+        _charge(response_hook, 8.0, body)
+        return body
+
+    def _upsert(self, partition_key, body):
+        items = self.items.setdefault(partition_key, [])
+        items[:] = [item for item in items if item['id'] != body['id']]
+        items.append(body)
+
+    def read_item(self, item, partition_key, response_hook=None, **kwargs):
+        self.latency.wait()
+        with self._lock:
+            found = next((doc for doc in self.items.get(partition_key, []) if doc['id'] == item), None)
+        if found is None:
+            raise CosmosResourceNotFoundError(status_code=404, message=f'{item} não encontrado (simulado)')
+        _charge(response_hook, 1.0, found)
+        return dict(found)
+
+    def execute_item_batch(self, batch_operations, partition_key, response_hook=None, **kwargs):
+        self.latency.wait()
+        if self.latency.fails():
+            raise RuntimeError('Cosmos batch rejeitado (simulado)')
+        with self._lock:
+            for operation, (item,) in batch_operations:
+                if operation == 'upsert':
+                    self._upsert(partition_key, item)
+                else:
+                    self.items.setdefault(partition_key, []).append(item)
+        results = [{'statusCode': 201}] * len(batch_operations)
+        _charge(response_hook, 6.0 * len(batch_operations), results)
+        return results
+
+    def query_items(self, query, parameters=None, partition_key=None, response_hook=None, **kwargs):
+        self.latency.wait()
+        values = {p['name']: p['value'] for p in parameters or []}
+        user_id = partition_key or values.get('@userId')
+        with self._lock:
+            items = list(self.items.get(user_id, []))
+        if 'IS_DEFINED(c.role)' in query:
+            items = [item for item in items if 'role' in item]
+        items.sort(key=lambda item: item.get('timestamp', ''), reverse=True)
+        if '@limit' in values:
+            items = items[:values['@limit']]
+        _charge(response_hook, 2.8 + 0.1 * len(items), {'Documents': items})
+        return iter(items)
+
+    def count(self):
+        with self._lock:
+            return sum(len(items) for items in self.items.values())
+
+
+class _AmadeusEndpoint:
+    def __init__(self, latency, build):
+        self.latency = latency
+        self.build = build
+
+    def get(self, **params):
+        self.latency.wait()
+        if self.latency.fails():
+            raise ServerError(SimpleNamespace(status_code=500, result=None, parsed=False))
+        return SimpleNamespace(data=self.build(**params))
+
+
+def _flight_offers(originLocationCode, destinationLocationCode, departureDate, adults=1, offers=20):
+    return [{
+        'price': {'total': f'{180 + 17 * i:.2f}', 'currency': 'EUR'},
+        'itineraries': [{
+            'duration': f'PT{9 + i % 5}H{(i * 7) % 60}M',
+            'segments': [{
+                'carrierCode': ('TP', 'LA', 'AF', 'IB', 'AZ')[i % 5],
+                'departure': {'iataCode': originLocationCode, 'at': f'{departureDate}T{8 + i % 12:02d}:30:00'},
+            }],
+        }],
+    } for i in range(offers)]
+
+
+def _hotel_list(cityCode):
+    return [{'hotelId': f'{cityCode}{i:05d}'} for i in range(25)]
+
+
+def _hotel_offers(hotelIds, checkInDate, checkOutDate, adults=1, roomQuantity=1):
+    return [{
+        'hotel': {'hotelId': hotel_id, 'name': f'Hotel {hotel_id}'},
+        'offers': [{'price': {'total': f'{90 + 23 * i:.2f}', 'currency': 'EUR'}}],
+    } for i, hotel_id in enumerate(hotelIds.split(','))]
+
+
+class FakeAmadeusClient:
+    """Mesmos caminhos do SDK usados pelo AmadeusClient"""
+
+    def __init__(self, flight_latency, hotel_latency):
+        self.shopping = SimpleNamespace(
+            flight_offers_search=_AmadeusEndpoint(flight_latency, _flight_offers),
+            hotel_offers_search=_AmadeusEndpoint(hotel_latency, _hotel_offers),
+        )
+        self.reference_data = SimpleNamespace(locations=SimpleNamespace(hotels=SimpleNamespace(
+            by_city=_AmadeusEndpoint(hotel_latency, _hotel_list)
+        )))
+
+
+class Profile:
+    """Latência/erros de cada serviço simulado"""
+
+    def __init__(self, clu_ms=60, sentiment_ms=40, cosmos_ms=8, flights_ms=900, hotels_ms=700,
+                 error_rate=0.0, jitter=0.25, seed=7, tail_rate=0.0, tail_factor=5.0):
+        self.clu = Latency(clu_ms, jitter, error_rate, seed)
+        self.sentiment = Latency(sentiment_ms, jitter, error_rate, seed)
+        self.cosmos = Latency(cosmos_ms, jitter, error_rate, seed)
+        # Cauda longa só na Amadeus (alvo do hedge de voos)
+        self.flights = Latency(flights_ms, jitter, error_rate, seed, tail_rate, tail_factor)
+        self.hotels = Latency(hotels_ms, jitter, error_rate, seed, tail_rate, tail_factor)
+
+    def stats(self):
+        return {name: getattr(self, name).stats() for name in ('clu', 'sentiment', 'cosmos', 'flights', 'hotels')}
+
+
+def install(bot, profile):
+    """
+    Injeta os fakes nos clientes do módulo bot (já importado). Retorna o
+    container do Cosmos para inspeção
+    """
+    # CLU: mesma lógica de cache/retry, só o transporte é trocado
+    bot.clu.session = FakeCluSession(profile.clu)
+    try:
+        import httpx
+        bot.clu._async_client = httpx.AsyncClient(transport=fake_clu_async_transport(profile.clu))
+    except ImportError:
+        pass
+
+    # Text Analytics: cliente fake atrás do batcher
+    bot.text_analytics.client = FakeTextAnalyticsClient(profile.sentiment)
+    if bot.text_analytics.batcher is not None:
+        bot.text_analytics.batcher.client = bot.text_analytics.client
+
+    # Cosmos: container em memória + thread de gravação (write-behind)
+    container = FakeCosmosContainer(profile.cosmos)
+    bot.store.client = True
+    bot.store.container = container
+    if bot.azure_config.COSMOS_WRITE_BEHIND and bot.store._queue is None:
+        bot.store._start_writer()
+
+    # Amadeus: o índice de hotéis busca IDs sob demanda pelo cliente fake
+    bot.amadeus.client = FakeAmadeusClient(profile.flights, profile.hotels)
+    return container
@@ -0,0 +1,308 @@
+"""
+Microbenchmarks do caminho de extração de texto (sem serviços externos)
+
+Mede normalize_text, extract_detailed_info (todos os slots), get_iata_code,
+extract_intent_entities e a leitura sob demanda dos slots de um turno
+(bot.turn_slots) sobre um corpus de mensagens em português
+(bench/data), e como extract_detailed_info/get_iata_code escalam com o
+tamanho da mensagem e com a quantidade de aliases do gazetteer.
+
+Exemplos (a partir de backend/python):
+    python -m bench.micro
+    python -m bench.micro --save bench/baseline.json
+    python -m bench.micro --compare bench/baseline.json --threshold 0.25
+
+Com --compare, o código de saída é 1 se algum caso ficou mais lento que
+o baseline além do limite. Cada rodada curta de um caso é pareada com uma
+rodada de controle (trabalho fixo só da biblioteca padrão) e a comparação usa
+a mediana das razões caso/controle: a variação de velocidade da máquina
+durante e entre as execuções se cancela (os µs absolutos só são comparáveis
+na mesma máquina)
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+from bench import env  # antes dos módulos do bot
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Tamanhos (em caracteres) das mensagens do teste de escala
+MESSAGE_LENGTHS = (50, 200, 800, 3200)
+
+# Quantidade de cidades sintéticas somadas ao gazetteer (3 aliases cada)
+EXTRA_CITIES = (0, 300, 3000)
+
+SYLLABLES = ('ba', 'be', 'ca', 'co', 'da', 'di', 'fa', 'go', 'ja', 'lu', 'ma', 'mi',
+             'na', 'no', 'pa', 'pe', 'ra', 'ri', 'sa', 'so', 'ta', 'tu', 'va', 'xi', 'za')
+
+
+def load_lines(filename):
+    path = os.path.join(DATA_DIR, filename)
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def scaled_messages(corpus, length, count=20, seed=7):
+    """Mensagens de ~length caracteres formadas por frases do corpus"""
+    rng = random.Random(seed + length)
+    messages = []
+    for _ in range(count):
+        parts = []
+        size = 0
+        while size < length:
+            sentence = rng.choice(corpus)
+            parts.append(sentence)
+            size += len(sentence) + 1
+        messages.append(' '.join(parts)[:length])
+    return messages
+
+
+def synthetic_gazetteer(extra_cities, seed=7):
+    """
+    Gazetteer com as cidades reais mais extra_cities sintéticas, lido de um
+    CSV temporário (mesmo caminho de carga do gazetteer padrão)
+    """
+    import gazetteer
+
+    with open(gazetteer.DEFAULT_PATH, encoding='utf-8') as f:
+        lines = [line for line in f if line.strip() and not line.startswith('#')]
+
+    rng = random.Random(seed)
+    seen = set()
+    rows = []
+    while len(rows) < extra_cities:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 5)))
+        if name in seen:
+            continue
+        seen.add(name)
+        code = f'Q{len(rows) // 676 % 26 + 65:c}{len(rows) % 26 + 65:c}'
+        aliases = f'{name}s|sao {name}|{name} do sul'
+        rows.append(f'{name.title()},XX,{code},{code},{aliases}\n')
+
+    fd, path = tempfile.mkstemp(suffix='.csv', prefix='gazetteer-bench-')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.writelines(lines + rows)
+    instance = gazetteer.Gazetteer(path)
+    # Carrega o CSV e monta o matcher e o índice de trigramas fora da medição
+    list(instance.find_all('bench'))
+    instance.resolve('benchmark')
+    os.unlink(path)
+    return instance
+
+
+# Duração aproximada de cada rodada (caso ou controle): rodadas curtas e
+# pareadas veem a mesma máquina; rodadas longas misturam picos de carga
+ROUND_SECONDS = 0.01
+
+
+def control(text):
+    """Trabalho de referência que não depende do código do bot"""
+    return ' '.join(sorted(text.lower().split()))
+
+
+def _timer(fn, inputs):
+    def run():
+        for value in inputs:
+            fn(value)
+
+    timer = timeit.Timer(run)
+    number, elapsed = timer.autorange()
+    return timer, max(1, int(number * ROUND_SECONDS / elapsed))
+
+
+def measure(fn, inputs, control_inputs, repeat):
+    """
+    (µs por chamada, razão caso/controle) em `repeat` rodadas pareadas:
+    o tempo é o da melhor rodada e a razão, a mediana das razões de cada par
+    """
+    timer, number = _timer(fn, inputs)
+    control_timer, control_number = _timer(control, control_inputs)
+    best = float('inf')
+    ratios = []
+    for _ in range(repeat):
+        control_time = control_timer.timeit(control_number) / control_number
+        case_time = timer.timeit(number) / number
+        best = min(best, case_time)
+        ratios.append(case_time / control_time)
+    return best / len(inputs) * 1e6, statistics.median(ratios)
+
+
+def build_cases():
+    """Lista de (nome, função, entradas, gazetteer ou None para o padrão)"""
+    import amadeus_client
+    import bot
+    from bench import fakes
+
+    corpus = load_lines('corpus.txt')
+    cities = load_lines('cities.txt')
+    clu_responses = [fakes.clu_prediction(message) for message in corpus]
+
+    cases = [
+        ('normalize_text', bot.normalize_text, corpus, None),
+        ('extract_detailed_info', bot.extract_detailed_info, corpus, None),
+        ('get_iata_code', amadeus_client.get_iata_code, cities, None),
+        ('extract_intent_entities', bot.extract_intent_entities, clu_responses, None),
+        # Caminho do turno: só os slots lidos são extraídos
+        ('turn_slots/travel', lambda text: list(map(bot.turn_slots(text).get, bot.TRAVEL_SLOTS)), corpus, None),
+        ('turn_slots/selecao', lambda text: bot.turn_slots(text).get('selecao'), corpus, None),
+    ]
+    for length in MESSAGE_LENGTHS:
+        messages = scaled_messages(corpus, length)
+        cases.append((f'normalize_text/len={length}', bot.normalize_text, messages, None))
+        cases.append((f'extract_detailed_info/len={length}', bot.extract_detailed_info, messages, None))
+    for extra in EXTRA_CITIES:
+        instance = synthetic_gazetteer(extra)
+        aliases = len(instance.aliases())
+        cases.append((f'extract_detailed_info/aliases={aliases}', bot.extract_detailed_info, corpus, instance))
+        cases.append((f'get_iata_code/aliases={aliases}', amadeus_client.get_iata_code, cities, instance))
+    return cases
+
+
+def city_name(text):
+    import gazetteer
+    city = gazetteer.default.resolve(text)
+    return city.name if city else None
+
+
+def result_checks():
+    """(descrição, função, entrada, resultado esperado): resposta errada reprova mesmo se rápida"""
+    import amadeus_client
+    return [
+        # Cidades reais fora da base não viram uma cidade parecida
+        ('munique fora da base', city_name, 'munique', None),
+        ('basileia fora da base', city_name, 'basileia', None),
+        ('braga fora da base', city_name, 'braga', None),
+        ('praia fora da base', city_name, 'praia', None),
+        # Erros de digitação ainda são corrigidos
+        ('lisbao -> Lisboa', city_name, 'lisbao', 'Lisboa'),
+        ('barcelnoa -> Barcelona', city_name, 'barcelnoa', 'Barcelona'),
+        # Código IATA fora da base segue para a Amadeus
+        ('código NAT', amadeus_client.get_iata_code, 'NAT', 'NAT'),
+    ]
+
+
+def check_results():
+    """Confere os resultados esperados; retorna as descrições que falharam"""
+    failures = []
+    for description, fn, value, expected in result_checks():
+        actual = fn(value)
+        if actual != expected:
+            failures.append(description)
+            print(f'  [FALHA] {description}: {value!r} -> {actual!r} (esperado {expected!r})', flush=True)
+    return failures
+
+
+def run_cases(repeat=60, only=None):
+    import gazetteer
+    import metrics
+
+    results = {}
+    original = gazetteer.default
+    control_inputs = load_lines('corpus.txt')
+    try:
+        for name, fn, inputs, instance in build_cases():
+            if only and not any(part in name for part in only):
+                continue
+            gazetteer.default = instance or original
+            us_per_call, relative = measure(fn, inputs, control_inputs, repeat)
+            results[name] = {'us_per_call': round(us_per_call, 3), 'relative': round(relative, 4),
+                             'inputs': len(inputs)}
+            print(f"  {name:<42} {results[name]['us_per_call']:>10.2f} µs/chamada", flush=True)
+    finally:
+        gazetteer.default = original
+        # As medições passam por metrics.timed('normalize'): não poluir outras execuções
+        metrics.reset()
+    return results
+
+
+def environment():
+    import metrics
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or platform.machine(),
+        'metrics_enabled': metrics.ENABLED,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Imprime a variação por caso e retorna os nomes que regrediram"""
+    regressions = []
+    print(f"\n{'caso':<42} {'baseline':>10} {'atual':>10} {'variação':>9}")
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            print(f"{name:<42} {'-':>10} {current['us_per_call']:>10.2f} {'novo':>9}")
+            continue
+        if 'relative' in previous:
+            change = current['relative'] / previous['relative'] - 1
+        else:
+            # Baseline antigo, sem controle: só o tempo absoluto
+            change = current['us_per_call'] / previous['us_per_call'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  << REGRESSÃO'
+        print(f"{name:<42} {previous['us_per_call']:>10.2f} {current['us_per_call']:>10.2f} {change:>+8.1%}{flag}")
+
+    saved = baseline.get('environment', {})
+    current_env = environment()
+    if any(saved.get(key) != current_env[key] for key in ('python', 'implementation', 'machine', 'metrics_enabled')):
+        print(f"\n[WARN] Baseline gerado em outro ambiente ({saved.get('python')}/{saved.get('machine')}, "
+              f"métricas={saved.get('metrics_enabled')}): compare com cautela", flush=True)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Microbenchmarks da extração de texto do bot')
+    parser.add_argument('--repeat', type=int, default=60,
+                        help='rodadas pareadas caso/controle por caso (vale a mediana das razões)')
+    parser.add_argument('--only', action='append', help='roda só os casos que contêm este trecho (repetível)')
+    parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, help='grava os resultados como baseline')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, help='compara com um baseline salvo')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='aumento relativo tolerado antes de acusar regressão (0.25 = 25%%)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    failures = check_results()
+    if failures:
+        print(f'{len(failures)} conferência(s) de resultado falharam', flush=True)
+        return 1
+    print('Microbenchmarks (%d rodadas pareadas com o controle):' % args.repeat, flush=True)
+    start = time.perf_counter()
+    results = run_cases(repeat=args.repeat, only=args.only)
+    print(f'Concluído em {time.perf_counter() - start:.1f}s', flush=True)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f'Baseline gravado em {args.save}', flush=True)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} caso(s) acima do limite de {args.threshold:.0%}: {", ".join(regressions)}')
+            return 1
+        print(f'\nNenhuma regressão acima de {args.threshold:.0%}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,234 @@
+"""
+Driver de carga do benchmark offline
+
+Exemplos (a partir de backend/python):
+    python -m bench.run --conversations 300 --concurrency 32
+    python -m bench.run --mode async --concurrency 200 --clu-ms 80
+    python -m bench.run --workers 4 --error-rate 0.02 --json resultado.json
+
+Cada worker é um processo com o próprio módulo bot e os serviços simulados;
+o relatório traz req/s, p50/p95/p99 por turno e memória (RSS pico) por worker
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench import env  # antes dos módulos do bot
+from bench import fakes, workloads
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _run_conversation(bot, user_id, turns, think):
+    """Executa os turnos em ordem; retorna (latências, turnos com resposta inesperada)"""
+    latencies = []
+    mismatches = 0
+    for message, expected in turns:
+        start = time.perf_counter()
+        response = bot.rest_handle({'userId': user_id, 'message': message})
+        latencies.append(time.perf_counter() - start)
+        if response.get('error') or (expected and expected not in response.get('response', '')):
+            mismatches += 1
+        if think:
+            time.sleep(think)
+    return latencies, mismatches
+
+
+async def _run_conversation_async(bot, user_id, turns, think):
+    latencies = []
+    mismatches = 0
+    for message, expected in turns:
+        start = time.perf_counter()
+        response = await bot.rest_handle_async({'userId': user_id, 'message': message})
+        latencies.append(time.perf_counter() - start)
+        if response.get('error') or (expected and expected not in response.get('response', '')):
+            mismatches += 1
+        if think:
+            await asyncio.sleep(think)
+    return latencies, mismatches
+
+
+def _drive_threads(bot, workload, options, worker):
+    with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+        futures = [
+            executor.submit(_run_conversation, bot, f'bench-{worker}-{i}', turns, options['think_ms'] / 1000)
+            for i, (_, turns) in enumerate(workload)
+        ]
+        return [future.result() for future in futures]
+
+
+async def _drive_async(bot, workload, options, worker):
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=bot.azure_config.ASGI_BLOCKING_WORKERS))
+    semaphore = asyncio.Semaphore(options['concurrency'])
+
+    async def one(i, turns):
+        async with semaphore:
+            return await _run_conversation_async(bot, f'bench-{worker}-{i}', turns, options['think_ms'] / 1000)
+
+    results = await asyncio.gather(*(one(i, turns) for i, (_, turns) in enumerate(workload)))
+    await bot.clu.aclose()
+    return results
+
+
+def run_worker(options, worker=0):
+    """Roda a fatia de conversas de um worker (no processo atual)"""
+    import bot
+    import metrics
+
+    if options['no_local_intent']:
+        # Todo turno fora dos estados sem intent passa pelo CLU
+        bot.local_intents = None
+    profile = fakes.Profile(
+        clu_ms=options['clu_ms'], sentiment_ms=options['sentiment_ms'], cosmos_ms=options['cosmos_ms'],
+        flights_ms=options['flights_ms'], hotels_ms=options['hotels_ms'],
+        error_rate=options['error_rate'], seed=options['seed'] + worker,
+        tail_rate=options['tail_rate'], tail_factor=options['tail_factor']
+    )
+    container = fakes.install(bot, profile)
+    workload = workloads.build(options['conversations'], options['mix'], seed=options['seed'] + worker)
+
+    start = time.perf_counter()
+    if options['mode'] == 'async':
+        results = asyncio.run(_drive_async(bot, workload, options, worker))
+    else:
+        results = _drive_threads(bot, workload, options, worker)
+    elapsed = time.perf_counter() - start
+
+    # Esvaziar a fila do Cosmos (sem o limite de drenagem de produção) para contar as gravações
+    bot.store.close(timeout=120)
+
+    latencies = [latency for turn_latencies, _ in results for latency in turn_latencies]
+    return {
+        'worker': worker,
+        'elapsed': elapsed,
+        'latencies': latencies,
+        'conversations': len(results),
+        'failed_conversations': sum(1 for _, mismatches in results if mismatches),
+        'mismatched_turns': sum(mismatches for _, mismatches in results),
+        'rss_peak_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'upstream_calls': profile.stats(),
+        'cosmos_items': container.count(),
+        'cosmos_writer': bot.store.writer_stats(),
+        'flight_hedging': bot.amadeus.flight_hedger.stats() if bot.amadeus.flight_hedger else None,
+        'stages': metrics.snapshot(),
+    }
+
+
+def _spawned_worker(args):
+    options, worker = args
+    return run_worker(options, worker)
+
+
+def summarize(results):
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    wall = max(result['elapsed'] for result in results)
+    upstream = {}
+    for result in results:
+        for service, counts in result['upstream_calls'].items():
+            total = upstream.setdefault(service, {'calls': 0, 'errors': 0})
+            total['calls'] += counts['calls']
+            total['errors'] += counts['errors']
+    return {
+        'workers': len(results),
+        'conversations': sum(result['conversations'] for result in results),
+        'failed_conversations': sum(result['failed_conversations'] for result in results),
+        'turns': len(latencies),
+        'mismatched_turns': sum(result['mismatched_turns'] for result in results),
+        'wall_s': round(wall, 3),
+        'req_per_s': round(len(latencies) / wall, 1) if wall else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 1),
+            'p95': round(percentile(latencies, 95) * 1000, 1),
+            'p99': round(percentile(latencies, 99) * 1000, 1),
+            'max': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        },
+        'rss_peak_mb_per_worker': [result['rss_peak_mb'] for result in results],
+        'upstream_calls': upstream,
+        'cosmos_items': sum(result['cosmos_items'] for result in results),
+        'cosmos_batches': sum(result['cosmos_writer'].get('batches', 0) for result in results),
+        'cosmos_dropped': sum(result['cosmos_writer'].get('dropped', 0) for result in results),
+        'flight_hedging_worker0': results[0]['flight_hedging'],
+        'stages_worker0': results[0]['stages'],
+    }
+
+
+def print_report(summary):
+    latency = summary['latency_ms']
+    print(f"\nWorkers: {summary['workers']}  Conversas: {summary['conversations']} "
+          f"(com falha: {summary['failed_conversations']})  Turnos: {summary['turns']} "
+          f"(inesperados: {summary['mismatched_turns']})")
+    print(f"Vazão: {summary['req_per_s']} req/s em {summary['wall_s']}s")
+    print(f"Latência por turno (ms): p50 {latency['p50']}  p95 {latency['p95']}  "
+          f"p99 {latency['p99']}  max {latency['max']}")
+    print(f"Memória RSS pico por worker (MB): {summary['rss_peak_mb_per_worker']}")
+    calls = '  '.join(f"{service} {c['calls']} ({c['errors']} erros)" for service, c in summary['upstream_calls'].items())
+    print(f"Chamadas simuladas: {calls}")
+    print(f"Itens gravados no Cosmos: {summary['cosmos_items']} em {summary['cosmos_batches']} lotes "
+          f"(descartados: {summary['cosmos_dropped']})")
+    hedging = summary['flight_hedging_worker0']
+    if hedging:
+        print(f"Hedge de voos (worker 0): {hedging['hedged']} extras em {hedging['calls']} buscas "
+              f"({hedging['extra_call_ratio']:.1%}), {hedging['hedge_won']} vitórias; p99 sem/com hedge "
+              f"{hedging['p99_primary_ms']} / {hedging['p99_response_ms']} ms")
+    print('Etapas (worker 0, p95 ms): ' + '  '.join(
+        f"{stage} {values['p95_ms']}" for stage, values in sorted(summary['stages_worker0'].items())))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark offline do bot com serviços simulados')
+    parser.add_argument('--conversations', type=int, default=200, help='conversas por worker')
+    parser.add_argument('--concurrency', type=int, default=32, help='conversas simultâneas por worker')
+    parser.add_argument('--workers', type=int, default=1, help='processos (cada um com o próprio bot)')
+    parser.add_argument('--mode', choices=('thread', 'async'), default='thread',
+                        help='thread = rest_handle (Flask/Gunicorn), async = rest_handle_async (ASGI)')
+    parser.add_argument('--mix', type=workloads.parse_mix, default=None,
+                        help='pesos dos roteiros, ex.: flight_purchase=0.5,hotel_booking=0.5')
+    parser.add_argument('--think-ms', type=float, default=0, help='pausa entre turnos de uma conversa')
+    parser.add_argument('--no-local-intent', action='store_true',
+                        help='desliga o classificador local de intents (mede o caminho do CLU)')
+    parser.add_argument('--clu-ms', type=float, default=60)
+    parser.add_argument('--sentiment-ms', type=float, default=40)
+    parser.add_argument('--cosmos-ms', type=float, default=8)
+    parser.add_argument('--flights-ms', type=float, default=900)
+    parser.add_argument('--hotels-ms', type=float, default=700)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fração de chamadas simuladas com erro')
+    parser.add_argument('--tail-rate', type=float, default=0.0,
+                        help='fração de chamadas à Amadeus na cauda longa (tail-factor vezes mais lentas)')
+    parser.add_argument('--tail-factor', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', help='grava o resumo neste arquivo')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = vars(args).copy()
+    options.pop('json')
+
+    if args.workers == 1:
+        results = [run_worker(options)]
+    else:
+        # spawn: cada worker importa o bot do zero, como um worker do Gunicorn
+        with multiprocessing.get_context('spawn').Pool(args.workers) as pool:
+            results = pool.map(_spawned_worker, [(options, worker) for worker in range(args.workers)])
+
+    summary = summarize(results)
+    print_report(summary)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'options': options, 'summary': summary}, f, indent=2, ensure_ascii=False)
+    return summary
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
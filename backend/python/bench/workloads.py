@@ -0,0 +1,110 @@
+"""
+Conversas roteirizadas do benchmark
+Cada roteiro é uma lista de turnos (mensagem, trecho esperado na resposta ou None)
+"""
+import random
+
+CITIES = ['Lisboa', 'Paris', 'Roma', 'Madri', 'Londres', 'Dublin', 'Rio de Janeiro',
+          'Nova York', 'Barcelona', 'Buenos Aires', 'Salvador', 'Recife']
+NAMES = ['Maria Silva', 'Joao Souza', 'Ana Costa', 'Pedro Almeida', 'Carla Mendes']
+PAYMENTS = ['pix', 'cartão de crédito', 'débito', 'boleto']
+
+
+def _cpf(rng):
+    digits = ''.join(str(rng.randint(0, 9)) for _ in range(11))
+    return f'{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}'
+
+
+def flight_purchase(rng):
+    """Busca -> seleção -> pagamento"""
+    city = rng.choice(CITIES)
+    return [
+        (f'Quero comprar passagem para {city}', 'Encontrei'),
+        (str(rng.randint(1, 5)), 'Ótima escolha'),
+        (f'{rng.choice(NAMES)}, CPF {_cpf(rng)}, pagamento no {rng.choice(PAYMENTS)}', 'Reserva confirmada'),
+    ]
+
+
+def hotel_booking(rng):
+    """Busca com datas -> seleção -> pagamento"""
+    city = rng.choice(CITIES)
+    day = rng.randint(1, 20)
+    return [
+        (f'Quero reservar hotel em {city} de {day:02d}/12/2026 a {day + 5:02d}/12/2026 para 2 pessoas', 'Encontrei'),
+        (str(rng.randint(1, 3)), None),
+        (f'{rng.choice(NAMES)}, CPF {_cpf(rng)}, {rng.choice(PAYMENTS)}', 'Reserva confirmada'),
+    ]
+
+
+def trip(rng):
+    """Voo com ida e volta -> seleção -> pagamento -> hotel no destino nas mesmas datas"""
+    city = rng.choice(CITIES)
+    day = rng.randint(1, 20)
+    dates = f'{day:02d}/12/2026 a {day + 5:02d}/12/2026'
+    name, cpf, payment = rng.choice(NAMES), _cpf(rng), rng.choice(PAYMENTS)
+    return [
+        (f'Quero comprar passagem para {city} de {dates}', 'Encontrei'),
+        (str(rng.randint(1, 5)), 'Ótima escolha'),
+        (f'{name}, CPF {cpf}, pagamento no {payment}', 'Reserva confirmada'),
+        (f'Agora quero reservar hotel em {city} de {dates} para 1 pessoa', 'Encontrei'),
+    ]
+
+
+def flight_consult(rng):
+    return [(f'Quais voos para {rng.choice(CITIES)}?', 'Encontrei')]
+
+
+# Pedidos sem palavra-chave de voo/hotel: abaixo do LOCAL_INTENT_THRESHOLD, vão ao CLU
+OPEN_REQUESTS = [
+    'Preciso estar em {city} dia {day:02d}/12/2026',
+    'Me leva pra {city}',
+    'Tem como ir a {city} amanhã?',
+    'Gostaria de conhecer {city}',
+    'Partiu {city}!',
+]
+
+
+def clu_flight(rng):
+    """Pedido aberto de viagem, resolvido pelo CLU (cache, retries e fallback)"""
+    request = rng.choice(OPEN_REQUESTS).format(city=rng.choice(CITIES), day=rng.randint(1, 28))
+    return [(request, 'Encontrei')]
+
+
+def greeting(rng):
+    return [(rng.choice(['Olá', 'oi', 'bom dia']), 'assistente')]
+
+
+SCRIPTS = {
+    'flight_purchase': flight_purchase,
+    'hotel_booking': hotel_booking,
+    'trip': trip,
+    'flight_consult': flight_consult,
+    'clu_flight': clu_flight,
+    'greeting': greeting,
+}
+
+DEFAULT_MIX = {'flight_purchase': 0.35, 'hotel_booking': 0.3, 'flight_consult': 0.15, 'clu_flight': 0.1, 'greeting': 0.1}
+
+
+def build(conversations, mix=None, seed=7):
+    """Lista reprodutível de (nome do roteiro, turnos)"""
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    workload = []
+    for _ in range(conversations):
+        name = rng.choices(names, weights)[0]
+        workload.append((name, SCRIPTS[name](rng)))
+    return workload
+
+
+def parse_mix(text):
+    """'flight_purchase=0.5,greeting=0.5' -> dict"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCRIPTS:
+            raise ValueError(f'Roteiro desconhecido: {name.strip()} (opções: {", ".join(SCRIPTS)})')
+        mix[name.strip()] = float(weight or 1)
+    return mix
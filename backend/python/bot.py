@@ -6,12 +6,43 @@ import luis_client
 import text_analytics_client
 import cosmos_client
 import amadeus_client
+import azure_config
+import gazetteer
+import intent_classifier
+import metrics
+import prefetch
+import session_store
+import slots
+from offers import FlightOffer, HotelOffer
+import asyncio
+import contextvars
+import functools
+import queue
 import re
+import threading
+import time
+import unicodedata
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+# Blocos Unicode de diacríticos combinantes (os acentos separados pela NFKD)
+COMBINING_MARKS = re.compile('[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]')
+
+
+def normalize_text(text):
+    """Normaliza texto removendo acentos e convertendo para minúsculas"""
+    if text.isascii():
+        return text.lower().strip()
+    # Remove acentos
+    text_without_accents = COMBINING_MARKS.sub('', unicodedata.normalize('NFKD', text))
+    return text_without_accents.lower().strip()
+
+
 # Inicializar clientes com tratamento de erros
 try:
-    clu = luis_client.CluClient()
+    # Predições do CLU são memorizadas pelo texto normalizado
+    clu = luis_client.CluClient(normalize=normalize_text)
     text_analytics = text_analytics_client.TextAnalytics()
     store = cosmos_client.ConversationStore()
     amadeus = amadeus_client.AmadeusClient()
@@ -20,6 +51,23 @@ except Exception as e:
     print(f'[ERROR] Falha ao inicializar clientes: {str(e)}', flush=True)
     raise
 
+# Executor para tarefas fora do caminho crítico (persistência da mensagem)
+pipeline_executor = None
+if azure_config.BOT_CONCURRENT_PIPELINE:
+    pipeline_executor = ThreadPoolExecutor(
+        max_workers=azure_config.BOT_PIPELINE_WORKERS,
+        thread_name_prefix='bot-pipeline'
+    )
+
+# Pré-busca de hotéis no destino do voo enquanto o usuário escolhe/paga o voo
+prefetcher = None
+if azure_config.AMADEUS_PREFETCH_ENABLED:
+    prefetcher = prefetch.PrefetchScheduler(
+        workers=azure_config.AMADEUS_PREFETCH_WORKERS,
+        per_minute=azure_config.AMADEUS_PREFETCH_PER_MINUTE,
+        max_pending=azure_config.AMADEUS_PREFETCH_MAX_PENDING
+    )
+
 # Intents suportados
 FLIGHT_INTENTS = ['ComprarVoos', 'ConsultarVoos', 'CancelarVoos']
 HOTEL_INTENTS = ['ReservarHotel', 'ConsultarHotel', 'CancelarHotel']
@@ -35,252 +83,593 @@ CONVERSATION_STATES = {
     'WAITING_CANCELLATION_INFO': 'waiting_cancellation_info'
 }
 
-# Contexto global por usuário (em produção, usar Redis ou Cosmos DB)
-user_contexts = {}
+# Estados em que a intent é ignorada pela máquina de estados (não precisam do CLU).
+# As entidades do CLU também não fazem falta: a cidade de WAITING_HOTEL_DETAILS
+# vem do gazetteer (TRAVEL_SLOTS) e nos demais a mensagem é seleção/pagamento
+STATES_WITHOUT_INTENT = {
+    CONVERSATION_STATES['WAITING_FLIGHT_SELECTION'],
+    CONVERSATION_STATES['WAITING_PAYMENT'],
+    CONVERSATION_STATES['WAITING_HOTEL_DETAILS'],
+    CONVERSATION_STATES['WAITING_HOTEL_PAYMENT'],
+}
+
+# Contexto por usuário com expiração por inatividade e limite de sessões.
+# Com SESSION_BACKEND=sqlite o estado é compartilhado entre os workers do Gunicorn.
+sessions = session_store.create_session_store(
+    azure_config.SESSION_BACKEND,
+    max_entries=azure_config.SESSION_MAX_ENTRIES,
+    idle_ttl=azure_config.SESSION_IDLE_TTL,
+    sqlite_path=azure_config.SESSION_SQLITE_PATH
+)
+
+
+def new_user_context():
+    """Contexto inicial de uma conversa"""
+    return {
+        'state': CONVERSATION_STATES['IDLE'],
+        'data': {},
+        'last_intent': None,
+        'flight_offers': [],
+        'hotel_offers': []
+    }
+
+
+def snapshots_enabled():
+    return azure_config.COSMOS_STATE_SNAPSHOTS and store is not None and store.client is not None
+
+
+def data_fingerprint(context):
+    """Checksum dos dados coletados (nome, CPF, voo escolhido...) do contexto"""
+    return zlib.crc32(session_store.to_json(context['data']).encode('utf-8'))
+
+
+def save_state_snapshot(user_id, context):
+    """Snapshot do contexto no Cosmos (gravado em segundo plano pela fila do store)"""
+    if not snapshots_enabled():
+        return
+    try:
+        # Chaves com '_' são controle local (versão da sessão, checksum do snapshot)
+        snapshot = {key: value for key, value in context.items() if not key.startswith('_')}
+        store.save_state(user_id, context['state'], session_store.to_json(snapshot))
+        context['_snapshot_data'] = data_fingerprint(context)
+    except Exception as e:
+        print(f'[ERROR] save_state_snapshot failed: {str(e)}', flush=True)
+
+
+def snapshot_outdated(context):
+    """
+    Os dados mudaram dentro do mesmo estado desde o último snapshot (ex.: nome
+    e CPF informados em WAITING_PAYMENT). Conversas em IDLE não são retomadas
+    """
+    return (snapshots_enabled() and context['state'] != CONVERSATION_STATES['IDLE']
+            and context.get('_snapshot_data') != data_fingerprint(context))
+
+
+def restore_user_context(user_id):
+    """
+    Contexto do último snapshot do usuário, se a conversa estava em andamento
+    e a sessão não está neste worker (perdida num restart ou expirada).
+    Com SESSION_BACKEND=memory uma sessão local antiga não é comparada com o
+    snapshot: se o usuário alternar entre workers, a sessão local vence;
+    para isso use afinidade de sessão ou um backend compartilhado (sqlite)
+    """
+    if not snapshots_enabled():
+        return None
+    snapshot = store.load_state(user_id)
+    if snapshot is None or snapshot.get('state') == CONVERSATION_STATES['IDLE']:
+        return None
+    try:
+        age = (datetime.utcnow() - datetime.fromisoformat(snapshot['timestamp'])).total_seconds()
+        if age > azure_config.COSMOS_STATE_MAX_AGE:
+            return None
+        context = session_store.from_json(snapshot['context'])
+        context['_snapshot_data'] = data_fingerprint(context)
+    except Exception as e:
+        print(f'[ERROR] restore_user_context failed: {str(e)}', flush=True)
+        return None
+    metrics.inc('sessions_restored', {'state': context['state']})
+    print(f"[INFO] Contexto de {user_id} restaurado do Cosmos (estado {context['state']})", flush=True)
+    return context
 
 
 def get_user_context(user_id):
-    """Recupera ou cria contexto do usuário"""
-    if user_id not in user_contexts:
-        user_contexts[user_id] = {
-            'state': CONVERSATION_STATES['IDLE'],
-            'data': {},
-            'last_intent': None,
-            'flight_offers': [],
-            'hotel_offers': []
-        }
-    return user_contexts[user_id]
+    """Recupera o contexto do usuário; sem sessão, tenta o snapshot do Cosmos ou cria um novo"""
+    context = sessions.get(user_id)
+    if context is None:
+        context = restore_user_context(user_id) or new_user_context()
+        try:
+            sessions.put(user_id, context)
+        except session_store.SessionConflict:
+            # Outro worker criou a sessão ao mesmo tempo: usar a dele
+            context = sessions.get(user_id) or context
+    return context
+
+
+def save_user_context(user_id, context):
+    """Grava o contexto ao fim do turno (necessário para backends compartilhados)"""
+    try:
+        sessions.put(user_id, context)
+    except session_store.SessionConflict:
+        # Concorrência otimista: a gravação mais antiga vence, esta é descartada
+        print(f'[WARN] Conflito de sessão para {user_id}, estado deste turno descartado', flush=True)
 
 
 def update_user_context(user_id, updates):
     """Atualiza contexto do usuário"""
     context = get_user_context(user_id)
     context.update(updates)
+    save_user_context(user_id, context)
     return context
 
 
-def normalize_text(text):
-    """Normaliza texto removendo acentos e convertendo para minúsculas"""
-    import unicodedata
-    # Remove acentos
-    nfkd = unicodedata.normalize('NFKD', text)
-    text_without_accents = ''.join([c for c in nfkd if not unicodedata.combining(c)])
-    return text_without_accents.lower().strip()
+# Classificador local de intents (regras + Naive Bayes) que evita chamadas ao CLU
+local_intents = None
+if azure_config.LOCAL_INTENT_ENABLED:
+    local_intents = intent_classifier.LocalIntentClassifier(
+        normalize_text,
+        threshold=azure_config.LOCAL_INTENT_THRESHOLD
+    )
 
+# O que vem logo antes da cidade, numa única busca por cidade citada:
+# - origin: partida explícita ("saindo de Lisboa")
+# - destination: preposição de destino ("para Lisboa", "em Paris")
+# - from: "de" solto, que só indica a origem quando a mensagem também traz o
+#   destino ("de Lisboa para Paris")
+# "saindo de" começa antes do "de" solto: a busca (match mais à esquerda) prefere origin
+CITY_PREFIX = re.compile(
+    r'(?:^|\s)(?:'
+    r'(?P<origin>(?:saindo|partindo|sair|partir|embarcando)\s+(?:de|do|da)|desde|origem)'
+    r'|(?P<destination>(?:para|pra|em|ate|destino|a)(?:\s+(?:o|a|os|as))?)'
+    r'|(?P<from>de|do|da)'
+    r')\s+$'
+)
 
-def extract_detailed_info(text):
-    """Extrai informações detalhadas da mensagem usando regex e NLP"""
-    info = {}
-    text_lower = text.lower()
-    text_normalized = normalize_text(text)
-    
-    # Extrair cidade/destino expandido (com variações ortográficas)
-    cities = {
-        'zurique': 'Zurique', 'zurich': 'Zurique', 'lisboa': 'Lisboa', 'lisbon': 'Lisboa',
-        'paris': 'Paris', 'pariz': 'Paris', 'dublin': 'Dublin', 'dublim': 'Dublin',
-        'londres': 'Londres', 'london': 'Londres', 'roma': 'Roma', 'rome': 'Roma',
-        'madrid': 'Madrid', 'madri': 'Madrid', 'barcelona': 'Barcelona', 'barça': 'Barcelona',
-        'berlim': 'Berlim', 'berlin': 'Berlim', 'amsterdam': 'Amsterdam', 'amsterda': 'Amsterdam',
-        'praga': 'Praga', 'prague': 'Praga', 'viena': 'Viena', 'vienna': 'Viena',
-        'nova york': 'Nova York', 'new york': 'Nova York', 'ny': 'Nova York', 'miami': 'Miami',
-        'tokyo': 'Tokyo', 'toquio': 'Tokyo', 'dubai': 'Dubai', 'dubay': 'Dubai',
-        'sao paulo': 'São Paulo', 'são paulo': 'São Paulo', 'sampa': 'São Paulo',
-        'rio': 'Rio de Janeiro', 'rio de janeiro': 'Rio de Janeiro', 'rj': 'Rio de Janeiro',
-        'italia': 'Roma', 'italy': 'Roma', 'irlanda': 'Dublin', 'ireland': 'Dublin',
-        'milano': 'Milano', 'milan': 'Milano', 'veneza': 'Veneza', 'venice': 'Veneza',
-        'florenca': 'Florenca', 'florence': 'Florenca', 'janeiro': 'Rio de Janeiro',
-        'chile': 'Santiago', 'santiago': 'Santiago', 'buenos aires': 'Buenos Aires',
-        'buenosaires': 'Buenos Aires', 'lima': 'Lima', 'bogota': 'Bogota', 'bogotá': 'Bogota',
-        'mexico': 'Cidade do Mexico', 'méxico': 'Cidade do Mexico', 'cancun': 'Cancun',
-        'brasilia': 'Brasília', 'brasília': 'Brasília', 'salvador': 'Salvador',
-        'fortaleza': 'Fortaleza', 'recife': 'Recife', 'manaus': 'Manaus'
-    }
-    
-    # Buscar cidade usando texto normalizado (sem acentos, case-insensitive)
-    for city_key, city_name in cities.items():
-        city_key_normalized = normalize_text(city_key)
-        if city_key_normalized in text_normalized:
-            info['cidade'] = city_name
-            break
-    
-    # Extrair datas
-    date_patterns = [
-        r'(\d{1,2})/(\d{1,2})/(\d{4})',
-        r'(\d{1,2})-(\d{1,2})-(\d{4})',
-        r'(\d{4})-(\d{1,2})-(\d{1,2})',
-    ]
-    
-    dates_found = []
-    for pattern in date_patterns:
-        matches = re.findall(pattern, text)
-        for match in matches:
-            try:
-                if len(match[0]) == 4:
-                    date_str = f"{match[0]}-{match[1].zfill(2)}-{match[2].zfill(2)}"
-                else:
-                    date_str = f"{match[2]}-{match[1].zfill(2)}-{match[0].zfill(2)}"
-                dates_found.append(date_str)
-            except:
-                pass
-    
-    if len(dates_found) >= 2:
-        info['data_ida'] = dates_found[0]
-        info['data_volta'] = dates_found[1]
-        info['checkin'] = dates_found[0]
-        info['checkout'] = dates_found[1]
-    elif len(dates_found) == 1:
-        info['data_ida'] = dates_found[0]
-        info['checkin'] = dates_found[0]
-    
-    # Extrair número de pessoas
-    num_patterns = [
-        r'(\d+)\s*(?:pessoa|pessoas|adulto|adultos|passageiro|passageiros)',
-        r'(?:para|sao|são)\s+(\d+)',
-    ]
-    for pattern in num_patterns:
-        match = re.search(pattern, text_lower)
-        if match:
-            info['pessoas'] = int(match.group(1))
-            break
-    
-    # Extrair número de voo selecionado
-    select_patterns = [
-        r'(?:voo|opcao|opção|numero|número)?\s*(\d+)',
-        r'^(\d+)$'
-    ]
-    for pattern in select_patterns:
-        match = re.search(pattern, text_lower.strip())
-        if match and 1 <= int(match.group(1)) <= 10:
-            info['selecao'] = int(match.group(1))
+
+def find_cities(text_normalized):
+    """
+    Retorna (destino, origem) mencionados no texto já normalizado.
+    Destino: a cidade precedida de preposição de destino; senão, a primeira
+    que não seja a origem. Origem: cidade após "saindo de", ou após "de"
+    quando há destino
+    """
+    destination = origin = from_city = first = None
+    for match, city in gazetteer.default.find_all(text_normalized):
+        prefix = CITY_PREFIX.search(text_normalized, max(0, match.start() - 16), match.start())
+        kind = prefix.lastgroup if prefix else None
+        if kind == 'origin':
+            origin = origin or city.name
+        elif kind == 'destination':
+            destination = destination or city.name
+        else:
+            if kind == 'from':
+                from_city = from_city or city.name
+            elif first is None:
+                first = city.name
+            continue
+        if destination and origin:
+            # Destino e origem explícitos: o resto do texto não muda a resposta
             break
+    if destination and origin is None and from_city != destination:
+        origin = from_city
+    elif destination is None:
+        destination = first or (from_city if from_city != origin else None)
+    return destination, origin if origin != destination else None
+
+
+def find_city(text_normalized):
+    """Retorna a cidade de destino mencionada no texto já normalizado"""
+    return find_cities(text_normalized)[0]
+
+
+# Palavras que nunca fazem parte de um nome (sem acento, minúsculas)
+NAME_STOPWORDS = frozenset('''
+    quero queria gostaria preciso comprar compra reservar reserva cancelar viajar viagem ir voar
+    pagar pago vou pode ser sou tenho tem ter fazer ficar seguir confirmar confirmo escolho
+    voo voos passagem passagens aerea aereo hotel hoteis pousada quarto ida volta localizador
+    para pra pro em no na nos nas com por pelo pela ate ou o a os as um uma uns umas ao aos
+    meu minha nome chamo eu cpf rg pagamento forma cartao credito debito pix boleto dinheiro vezes parcelado
+    pessoa pessoas adulto adultos passageiro passageiros opcao numero sim nao ok obrigado obrigada
+    ola oi bom boa dia tarde noite hoje amanha depois proxima proximo semana que vem cedo
+    qual quais quanto quando onde como mais menos barato barata tudo bem aqui esse essa este esta isso
+    se saber voce voces algum alguma lugar perto longe talvez estou agora direto saindo custa status
+    diaria abaixo acima incluso familia pacote pacotes euros reais
+    segunda terca quarta quinta sexta sabado domingo feira
+    janeiro fevereiro marco abril maio junho julho agosto setembro outubro novembro dezembro
+'''.split())
+
+# Partículas aceitas no meio de um nome ("Ana de Souza")
+NAME_PARTICLES = frozenset(('da', 'das', 'de', 'do', 'dos', 'e'))
+
+NAME_WORD = re.compile(r'[A-Za-zÀ-ÖØ-öø-ÿ]{2,}')
+
+
+@functools.lru_cache(maxsize=4096)
+def _is_name_stopword(lower):
+    return (lower if lower.isascii() else normalize_text(lower)) in NAME_STOPWORDS
+
+
+def _name_runs(text):
+    """
+    Gera, em ordem, as sequências de palavras vizinhas que podem formar um
+    nome (sob demanda: quem acha o nome para de percorrer o texto)
+    """
+    current = []
+    last_end = None
+    for match in NAME_WORD.finditer(text):
+        word = match.group()
+        lower = word.lower()
+        # Apenas espaço entre palavras do mesmo nome (vírgula, número etc. separam)
+        if current and text[last_end:match.start()].strip():
+            yield from _name_candidate(current)
+            current = []
+        last_end = match.end()
+        if lower in NAME_PARTICLES:
+            if current:
+                current.append(word)
+        elif _is_name_stopword(lower):
+            if current:
+                yield from _name_candidate(current)
+            current = []
+        else:
+            current.append(word)
+    if current:
+        yield from _name_candidate(current)
+
+
+def _name_candidate(run):
+    """A sequência (sem partículas no fim, até 6 palavras) se puder ser um nome"""
+    while run[-1].lower() in NAME_PARTICLES:
+        run.pop()
+    words = sum(1 for word in run if word.lower() not in NAME_PARTICLES)
+    # Sobrenomes podem coincidir com cidades (Lima, Natal): só a sequência inteira é checada
+    if words >= 2 and not gazetteer.default.lookup(' '.join(run)):
+        yield run[:6]
+
+
+def extract_name(text):
+    """
+    Nome completo (2+ palavras). Prefere uma sequência capitalizada; senão
+    aceita minúsculas ("ana paula costa"). Cidades e palavras comuns da
+    conversa ("Quero Voo", "Cartão Crédito") não contam como nome
+    """
+    first = None
+    for run in _name_runs(text):
+        if all(word[0].isupper() or word in NAME_PARTICLES for word in run):
+            return ' '.join(run)
+        if first is None:
+            first = run
+    if first:
+        return ' '.join(word if word in NAME_PARTICLES else word.capitalize() for word in first)
+    return None
+
+
+def _normalize_turn(text):
+    with metrics.timed('normalize'):
+        return normalize_text(text)
+
+
+def extract_city_slot(turn):
+    """Destino e origem: uma única passada do matcher pré-compilado"""
+    destination, origin = find_cities(turn.normalized)
+    found = {}
+    if destination:
+        found['cidade'] = destination
+    if origin:
+        found['origem'] = origin
+    return found
+
+
+def extract_scanned_slots(turn):
+    """Datas (absolutas e relativas), pessoas, seleção, CPF e pagamento"""
+    return slots.extract(turn.normalized)
+
+
+def extract_name_slot(turn):
+    name = extract_name(turn.text)
+    return {'nome': name} if name else {}
+
+
+# Slot -> extração que o calcula (slots da mesma função saem juntos)
+SLOT_EXTRACTORS = {'cidade': extract_city_slot, 'origem': extract_city_slot, 'nome': extract_name_slot}
+SLOT_EXTRACTORS.update(dict.fromkeys(slots.SCANNED_SLOTS, extract_scanned_slots))
+
+# Slots da viagem copiados para context['data'] ao receber a mensagem
+TRAVEL_SLOTS = ('cidade', 'origem', 'data_ida', 'data_volta', 'checkin', 'checkout', 'pessoas')
+
+# Slots copiados em cada estado; seleção, nome, CPF e pagamento são lidos
+# pelos próprios handlers, sob demanda. Estado ausente = TRAVEL_SLOTS
+STATE_SLOTS = {
+    CONVERSATION_STATES['WAITING_FLIGHT_SELECTION']: (),
+    CONVERSATION_STATES['WAITING_PAYMENT']: (),
+    CONVERSATION_STATES['WAITING_HOTEL_PAYMENT']: (),
+}
+
+
+def turn_slots(text):
+    """Slots da mensagem, extraídos só quando pedidos (memoizados no turno)"""
+    return slots.TurnSlots(text, SLOT_EXTRACTORS, _normalize_turn)
+
+
+def extract_detailed_info(text):
+    """Extrai todas as informações da mensagem (dict com os slots encontrados)"""
+    return turn_slots(text).to_dict()
+
+
+# Destino dos trechos da resposta no modo streaming (None = resposta só no final)
+reply_sink = contextvars.ContextVar('reply_sink', default=None)
+
+
+def emit_chunk(text):
+    """Envia um trecho da resposta assim que formatado (se houver cliente em streaming)"""
+    sink = reply_sink.get()
+    if sink is not None:
+        sink(text)
+
+
+def persist_user_message(user_id, text, timestamp):
+    """Salva a mensagem do usuário; o sentimento chega depois, calculado em lote"""
+    try:
+        if store and store.client:
+            sentiment = None
+            if text_analytics and text_analytics.client:
+                sentiment = text_analytics.submit(text)
+            with metrics.timed('cosmos_save_user'):
+                store.save_message(user_id, text, 'user', sentiment=sentiment, timestamp=timestamp)
+    except Exception as e:
+        print(f'[ERROR] persist_user_message failed: {str(e)}', flush=True)
+
+
+def handle_message(user_id, text):
+    """Processa mensagem com contexto e máquina de estados"""
+    turn_start = time.perf_counter()
+    try:
+        context, current_state, detailed_info = begin_turn(user_id, text)
+        
+        # Reconhecer intent (classificador local ou CLU, o único serviço no caminho crítico)
+        intent, entities, error = recognize_intent(text, current_state)
+        return finish_turn(user_id, text, context, current_state, detailed_info, intent, entities, error)
     
-    # Extrair CPF
-    cpf_patterns = [
-        r'\b(\d{3}\.?\d{3}\.?\d{3}-?\d{2})\b',
-        r'\b(\d{11})\b',
-    ]
-    for pattern in cpf_patterns:
-        match = re.search(pattern, text)
-        if match:
-            cpf = match.group(1)
-            cpf_digits = re.sub(r'\D', '', cpf)
-            if len(cpf_digits) == 11:
-                info['cpf'] = f"{cpf_digits[:3]}.{cpf_digits[3:6]}.{cpf_digits[6:9]}-{cpf_digits[9:]}"
-                break
+    except Exception as e:
+        print(f'[ERROR] handle_message failed: {str(e)}', flush=True)
+        return {'text': f'Erro: {str(e)[:100]}. Por favor, tente novamente.'}
+    finally:
+        metrics.record('turn_total', time.perf_counter() - turn_start)
+
+
+async def handle_message_async(user_id, text):
+    """
+    Versão para o modo ASGI: o CLU é aguardado sem ocupar thread. O início do
+    turno (sessão, snapshot e gravação da mensagem no Cosmos) e o handler do
+    estado (que pode chamar a Amadeus, cujo SDK é síncrono) bloqueiam e rodam
+    no executor padrão do event loop
+    """
+    turn_start = time.perf_counter()
+    try:
+        context, current_state, detailed_info = await asyncio.to_thread(begin_turn, user_id, text)
+        intent, entities, error = await recognize_intent_async(text, current_state)
+        return await asyncio.to_thread(
+            finish_turn, user_id, text, context, current_state, detailed_info, intent, entities, error
+        )
     
-    # Extrair nome completo (aceita 2 ou mais palavras, maiúsculas ou minúsculas)
-    # Primeiro tenta padrão capitalizado
-    name_pattern = r'\b([A-ZÀÁÂÃÉÊÍÓÔÕÚÇ][a-zàáâãéêíóôõúç]+(?:\s+[A-ZÀÁÂÃÉÊÍÓÔÕÚÇ][a-zàáâãéêíóôõúç]+)+)\b'
-    name_matches = re.findall(name_pattern, text)
-    for potential_name in name_matches:
-        words = potential_name.split()
-        city_lower = potential_name.lower()
-        # Verificar que não é cidade e tem 2+ palavras
-        if len(words) >= 2 and city_lower not in cities.keys() and not any(city in city_lower for city in ['paris', 'roma', 'lisboa', 'dublin', 'londres', 'janeiro']):
-            info['nome'] = potential_name
-            break
+    except Exception as e:
+        print(f'[ERROR] handle_message failed: {str(e)}', flush=True)
+        return {'text': f'Erro: {str(e)[:100]}. Por favor, tente novamente.'}
+    finally:
+        metrics.record('turn_total', time.perf_counter() - turn_start)
+
+
+def begin_turn(user_id, text):
+    """
+    Persiste a mensagem, carrega o contexto e copia para ele os slots da
+    viagem; retorna (contexto, estado, TurnSlots da mensagem)
+    """
+    # Salvar mensagem do usuário (em paralelo com o CLU quando habilitado).
+    # O timestamp é fixado aqui para manter a ordem em relação à resposta do bot.
+    timestamp = datetime.utcnow().isoformat()
+    if pipeline_executor:
+        pipeline_executor.submit(persist_user_message, user_id, text, timestamp)
+    else:
+        persist_user_message(user_id, text, timestamp)
+
+    # Obter contexto do usuário
+    context = get_user_context(user_id)
+    current_state = context['state']
     
-    # Se não encontrou, tenta padrão mais flexível (qualquer caso, 2+ palavras)
-    if 'nome' not in info:
-        # Remove números e símbolos comuns, pega sequências de 2+ palavras
-        words_in_text = re.findall(r'\b[A-Za-zÀ-ÿ]{2,}\b', text)
-        if len(words_in_text) >= 2:
-            # Verifica se as primeiras 2-3 palavras podem ser um nome
-            for i in range(len(words_in_text) - 1):
-                candidate = ' '.join(words_in_text[i:i+2])
-                candidate_lower = candidate.lower()
-                # Ignora se é palavra comum ou cidade
-                if candidate_lower not in cities.keys() and candidate_lower not in ['voo', 'para', 'hotel', 'quero', 'preciso', 'pessoas', 'pessoa', 'adulto', 'adultos']:
-                    info['nome'] = candidate.title()  # Capitaliza o nome
-                    break
+    # Slots da mensagem: o estado define os que vão para o contexto agora;
+    # os handlers pedem os demais ao TurnSlots, que só extrai o que for lido
+    detailed_info = turn_slots(text)
+    with metrics.timed('extract'):
+        for slot in STATE_SLOTS.get(current_state, TRAVEL_SLOTS):
+            value = detailed_info.get(slot)
+            if value:
+                context['data'][slot] = value
+    return context, current_state, detailed_info
+
+
+def finish_turn(user_id, text, context, current_state, detailed_info, intent, entities, error):
+    """Aplica a intent reconhecida, executa o handler do estado e salva o contexto"""
+    metrics.inc('turns', {'state': current_state})
+    if error:
+        metrics.inc('clu_errors')
+        print(f'[WARN] CLU error: {error}', flush=True)
+        reply = {'text': 'Desculpe, estou com problemas técnicos. Tente novamente em instantes.'}
+        if store and store.client:
+            store.save_message(user_id, reply['text'], 'bot')
+        save_user_context(user_id, context)
+        return reply
     
-    # Extrair forma de pagamento
-    payment_keywords = {
-        'crédito': 'Cartão de Crédito', 'credito': 'Cartão de Crédito',
-        'débito': 'Cartão de Débito', 'debito': 'Cartão de Débito',
-        'pix': 'PIX', 'boleto': 'Boleto', 'dinheiro': 'Dinheiro'
-    }
-    for keyword, payment_type in payment_keywords.items():
-        if keyword in text_lower:
-            info['pagamento'] = payment_type
-            break
+    # Adicionar entidades ao contexto
+    if entities.get('Cidade'):
+        context['data']['cidade'] = entities['Cidade']
+    if entities.get('Destino'):
+        context['data']['cidade'] = entities['Destino']
+    if entities.get('Origem'):
+        context['data']['origem'] = entities['Origem']
     
-    return info
+    with metrics.timed('handler'):
+        reply = dispatch_state(user_id, text, context, current_state, intent, detailed_info)
+    if context['state'] != current_state:
+        metrics.inc('state_transitions', {'from': current_state, 'to': context['state']})
+        save_state_snapshot(user_id, context)
+    elif snapshot_outdated(context):
+        save_state_snapshot(user_id, context)
+    update_prefetch(user_id, context)
+    save_user_context(user_id, context)
+    return reply
 
 
-def handle_message(user_id, text):
-    """Processa mensagem com contexto e máquina de estados"""
+# Estados em que o usuário decide o voo; o passo seguinte costuma ser o hotel
+PREFETCH_STATES = {
+    CONVERSATION_STATES['WAITING_FLIGHT_SELECTION'],
+    CONVERSATION_STATES['WAITING_PAYMENT'],
+}
+
+
+def predicted_hotel_search(context):
+    """Chave do cache de hotéis para a cidade e as datas do voo em escolha, ou None"""
+    if context['state'] not in PREFETCH_STATES:
+        return None
+    data = context['data']
+    cidade, checkin, checkout = data.get('cidade'), data.get('data_ida'), data.get('data_volta')
+    if not (cidade and checkin and checkout):
+        return None  # sem a volta não há como adivinhar o check-out
+    city_code = amadeus_client.get_city_code(cidade)
+    return amadeus.hotel_cache_key(city_code, checkin, checkout) if city_code else None
+
+
+def prediction_diverged(context, key):
+    """A conversa saiu do caminho previsto (outro destino, outras datas, nova busca ou cancelamento)"""
+    if context['state'] in (CONVERSATION_STATES['WAITING_FLIGHT_DETAILS'],
+                            CONVERSATION_STATES['WAITING_CANCELLATION_INFO']):
+        return True
+    data = context['data']
+    cidade = data.get('cidade')
+    if cidade and amadeus_client.get_city_code(cidade) != key[0]:
+        return True
+    return bool(data.get('checkin')) and data['checkin'] != key[1]
+
+
+def update_prefetch(user_id, context):
+    """Agenda a pré-busca do hotel provável ou cancela a pendente se a conversa mudou"""
+    if prefetcher is None or not amadeus.client:
+        return
     try:
-        # Salvar mensagem do usuário
-        sentiment = None
-        if text_analytics and text_analytics.client:
-            sentiment = text_analytics.analyze_sentiment(text)
-        
-        if store and store.client:
-            store.save_message(user_id, text, 'user', sentiment=sentiment)
+        key = predicted_hotel_search(context)
+        if key is not None:
+            prefetcher.schedule(
+                user_id, key,
+                lambda: amadeus.search_hotels(key[0], key[1], key[2], roomQuantity=key[3]),
+                is_cached=lambda: amadeus.hotel_cache.peek(key) is not None
+            )
+            return
+        pending = prefetcher.pending_key(user_id)
+        if pending is not None and prediction_diverged(context, pending):
+            prefetcher.cancel(user_id)
+    except Exception as e:
+        print(f'[ERROR] update_prefetch failed: {str(e)}', flush=True)
 
-        # Obter contexto do usuário
-        context = get_user_context(user_id)
-        current_state = context['state']
-        
-        # Extrair informações da mensagem
-        detailed_info = extract_detailed_info(text)
-        
-        # Atualizar dados do contexto com novas informações
-        context['data'].update({k: v for k, v in detailed_info.items() if v})
-        
-        # Reconhecer intent via CLU
+
+def recognize_intent(text, current_state):
+    """
+    Retorna (intent, entidades, erro). Estados que não usam a intent e mensagens
+    classificadas com confiança pelo classificador local não chamam o CLU
+    """
+    decided, guess = recognize_locally(text, current_state)
+    if decided:
+        return decided
+    return resolve_clu_result(call_clu(text), guess)
+
+
+async def recognize_intent_async(text, current_state):
+    decided, guess = recognize_locally(text, current_state)
+    if decided:
+        return decided
+    return resolve_clu_result(await call_clu_async(text), guess)
+
+
+def recognize_locally(text, current_state):
+    """
+    (resultado final, None) quando o CLU é dispensável, senão
+    (None, palpite local (intent, confiança)) para usar se o CLU falhar
+    """
+    if local_intents is None:
+        return None, None
+
+    if current_state in STATES_WITHOUT_INTENT:
+        local_intents.record('state')
+        return (None, {}, None), None
+
+    with metrics.timed('local_intent'):
+        local_intent, confidence, source = local_intents.predict(normalize_text(text))
+    if local_intent and confidence >= local_intents.threshold:
+        local_intents.record(source)
+        return (local_intent, {}, None), None
+    return None, (local_intent, confidence)
+
+
+def resolve_clu_result(clu_result, guess):
+    intent, entities, error = clu_result
+    if guess is None:
+        return clu_result
+    local_intent, confidence = guess
+    if error and local_intent and confidence >= azure_config.LOCAL_INTENT_FALLBACK_THRESHOLD:
+        # CLU indisponível: usar o palpite local em vez de falhar o turno
+        local_intents.record('fallback')
+        return local_intent, {}, None
+    local_intents.record('clu_error' if error else 'clu')
+    return intent, entities, error
+
+
+def call_clu(text):
+    with metrics.timed('clu'):
         clu_res = clu.recognize(text)
-        if 'error' in clu_res:
-            print(f'[WARN] CLU error: {clu_res["error"]}', flush=True)
-            reply = {'text': 'Desculpe, estou com problemas técnicos. Tente novamente em instantes.'}
+    return parse_clu_response(clu_res)
+
+
+async def call_clu_async(text):
+    with metrics.timed('clu'):
+        clu_res = await clu.recognize_async(text)
+    return parse_clu_response(clu_res)
+
+
+def parse_clu_response(clu_res):
+    if 'error' in clu_res:
+        return None, {}, clu_res['error']
+    intent, entities = extract_intent_entities(clu_res)
+    return intent, entities, None
+
+
+def dispatch_state(user_id, text, context, current_state, intent, detailed_info):
+    """Encaminha a mensagem para o handler do estado atual"""
+    # Máquina de estados conversacional
+    if current_state == CONVERSATION_STATES['IDLE']:
+        # Estado inicial - processar novo intent
+        if intent in FLIGHT_INTENTS:
+            return handle_flight_conversation(user_id, intent, context, text)
+        elif intent in HOTEL_INTENTS:
+            return handle_hotel_conversation(user_id, intent, context, text)
+        else:
+            reply = {'text': "Olá! 👋 Sou seu assistente de viagens.\n\nPosso ajudar com:\n\n✈️ Voos - Consultar, comprar ou cancelar\n🏨 Hotéis - Reservar, consultar ou cancelar\n\nO que você precisa hoje?"}
             if store and store.client:
                 store.save_message(user_id, reply['text'], 'bot')
             return reply
-
-        intent, entities = extract_intent_entities(clu_res)
-        
-        # Adicionar entidades ao contexto
-        if entities.get('Cidade'):
-            context['data']['cidade'] = entities['Cidade']
-        if entities.get('Destino'):
-            context['data']['cidade'] = entities['Destino']
-        if entities.get('Origem'):
-            context['data']['origem'] = entities['Origem']
-        
-        # Máquina de estados conversacional
-        if current_state == CONVERSATION_STATES['IDLE']:
-            # Estado inicial - processar novo intent
-            if intent in FLIGHT_INTENTS:
-                return handle_flight_conversation(user_id, intent, context, text)
-            elif intent in HOTEL_INTENTS:
-                return handle_hotel_conversation(user_id, intent, context, text)
-            else:
-                reply = {'text': "Olá! 👋 Sou seu assistente de viagens.\n\nPosso ajudar com:\n\n✈️ Voos - Consultar, comprar ou cancelar\n🏨 Hotéis - Reservar, consultar ou cancelar\n\nO que você precisa hoje?"}
-                if store and store.client:
-                    store.save_message(user_id, reply['text'], 'bot')
-                return reply
-        
-        elif current_state == CONVERSATION_STATES['WAITING_FLIGHT_SELECTION']:
-            return handle_flight_selection(user_id, context, detailed_info, text)
-        
-        elif current_state == CONVERSATION_STATES['WAITING_PAYMENT']:
-            return handle_payment_info(user_id, context, detailed_info)
-        
-        elif current_state == CONVERSATION_STATES['WAITING_HOTEL_DETAILS']:
-            return handle_hotel_conversation(user_id, 'ReservarHotel', context, text)
-        
-        elif current_state == CONVERSATION_STATES['WAITING_HOTEL_PAYMENT']:
-            return handle_hotel_payment(user_id, context, detailed_info)
-        
-        else:
-            # Estado desconhecido, resetar
-            context['state'] = CONVERSATION_STATES['IDLE']
-            return handle_message(user_id, text)
     
-    except Exception as e:
-        print(f'[ERROR] handle_message failed: {str(e)}', flush=True)
-        return {'text': f'Erro: {str(e)[:100]}. Por favor, tente novamente.'}
+    elif current_state == CONVERSATION_STATES['WAITING_FLIGHT_SELECTION']:
+        return handle_flight_selection(user_id, context, detailed_info, text)
+    
+    elif current_state == CONVERSATION_STATES['WAITING_PAYMENT']:
+        return handle_payment_info(user_id, context, detailed_info)
+    
+    elif current_state == CONVERSATION_STATES['WAITING_HOTEL_DETAILS']:
+        return handle_hotel_conversation(user_id, 'ReservarHotel', context, text)
+    
+    elif current_state == CONVERSATION_STATES['WAITING_HOTEL_PAYMENT']:
+        return handle_hotel_payment(user_id, context, detailed_info)
+    
+    else:
+        # Estado desconhecido, resetar e reprocessar como IDLE
+        context['state'] = CONVERSATION_STATES['IDLE']
+        return dispatch_state(user_id, text, context, context['state'], intent, detailed_info)
 
 
 def handle_flight_conversation(user_id, intent, context, text):
@@ -314,6 +703,14 @@ def handle_flight_conversation(user_id, intent, context, text):
                 store.save_message(user_id, reply['text'], 'bot')
             return reply
         
+        # Mostrar as cidades que serão de fato buscadas ('lisbao' -> Lisboa);
+        # origem não reconhecida cai em São Paulo (GRU), como na busca
+        cidade_destino = data['cidade'] = amadeus_client.get_city_name(cidade_destino) or cidade_destino
+        if amadeus_client.get_iata_code(origem):
+            origem = amadeus_client.get_city_name(origem) or origem
+        else:
+            origem = 'São Paulo'
+        
         # Buscar voos reais
         data_ida = data.get('data_ida', (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d'))
         pessoas = data.get('pessoas', 1)
@@ -321,50 +718,52 @@ def handle_flight_conversation(user_id, intent, context, text):
         result = amadeus.search_flights(origem, cidade_destino.lower(), data_ida, adults=pessoas)
         
         if result and isinstance(result, list) and len(result) > 0:
-            # Salvar ofertas no contexto
-            context['flight_offers'] = result[:5]
+            # Salvar no contexto apenas os campos usados (registros compactos)
+            render_start = time.perf_counter()
+            context['flight_offers'] = [FlightOffer.from_amadeus(offer) for offer in result[:5]]
             
             response_text = f"✈️ Encontrei {len(result)} voos de {origem} para {cidade_destino}!\n\n"
             response_text += f"🗓️ Data: {data_ida}\n👥 Passageiros: {pessoas}\n\n"
             response_text += "📋 Melhores opções:\n\n"
+            emit_chunk(response_text)
             
             for i, flight in enumerate(context['flight_offers'], 1):
-                price = flight.get('price', {})
-                price_total = price.get('total', 'N/A')
-                currency = price.get('currency', 'EUR')
-                
-                if currency == 'EUR':
-                    price_brl = float(price_total) * 6.0
-                    price_display = f"€{price_total} ≈ R$ {price_brl:,.0f}".replace(',', '.')
+                if flight.currency == 'EUR':
+                    price_brl = float(flight.price_total) * 6.0
+                    price_display = f"€{flight.price_total} ≈ R$ {price_brl:,.0f}".replace(',', '.')
                 else:
-                    price_display = f"{currency} {price_total}"
+                    price_display = f"{flight.currency} {flight.price_total}"
                 
-                itineraries = flight.get('itineraries', [])
-                if itineraries:
-                    segments = itineraries[0].get('segments', [])
-                    if segments:
-                        carrier = segments[0].get('carrierCode', '??')
-                        departure = segments[0].get('departure', {}).get('at', '')
-                        time = departure[11:16] if len(departure) > 11 else '??:??'
-                        duration = itineraries[0].get('duration', '').replace('PT', '').replace('H', 'h').replace('M', 'm')
-                        
-                        response_text += f"{i}. {carrier} - Partida {time} - {price_display}"
-                        if duration:
-                            response_text += f" - {duration.lower()}"
-                        response_text += "\n"
+                if flight.carrier:
+                    line = f"{i}. {flight.carrier} - Partida {flight.departure_time} - {price_display}"
+                    if flight.duration:
+                        line += f" - {flight.duration}"
+                    line += "\n"
+                    response_text += line
+                    emit_chunk(line)
             
             # Mudar estado para aguardar seleção
             if intent == 'ComprarVoos':
                 context['state'] = CONVERSATION_STATES['WAITING_FLIGHT_SELECTION']
-                response_text += "\n\n💳 Para comprar: Digite o número do voo desejado (ex: 1, 2, 3...)"
+                prompt = "\n\n💳 Para comprar: Digite o número do voo desejado (ex: 1, 2, 3...)"
             else:
-                response_text += "\n\n📞 Gostou? Diga 'comprar voo [número]' para prosseguir!"
+                prompt = "\n\n📞 Gostou? Diga 'comprar voo [número]' para prosseguir!"
+            response_text += prompt
+            emit_chunk(prompt)
+            metrics.record('render', time.perf_counter() - render_start)
             
             reply = {'text': response_text}
             if store and store.client:
                 store.save_message(user_id, reply['text'], 'bot')
             return reply
         
+        elif isinstance(result, dict) and result.get('unavailable'):
+            metrics.inc('flight_search_unavailable')
+            reply = {'text': "⏳ O serviço de busca de voos está ocupado no momento. Tente novamente em instantes."}
+            if store and store.client:
+                store.save_message(user_id, reply['text'], 'bot')
+            return reply
+        
         else:
             reply = {'text': f"😔 Não encontrei voos disponíveis para {cidade_destino} nesta data.\n\nPosso ajudar com:\n• Outra cidade\n• Outra data\n\nO que prefere?"}
             if store and store.client:
@@ -393,15 +792,11 @@ def handle_flight_selection(user_id, context, detailed_info, text):
         context['data']['numero_voo'] = selecao
         
         # Extrair informações do voo
-        price = selected_flight.get('price', {})
-        price_total = price.get('total', 'N/A')
-        currency = price.get('currency', 'EUR')
-        
-        if currency == 'EUR':
-            price_brl = float(price_total) * 6.0
-            price_display = f"€{price_total} (R$ {price_brl:,.0f})".replace(',', '.')
+        if selected_flight.currency == 'EUR':
+            price_brl = float(selected_flight.price_total) * 6.0
+            price_display = f"€{selected_flight.price_total} (R$ {price_brl:,.0f})".replace(',', '.')
         else:
-            price_display = f"{currency} {price_total}"
+            price_display = f"{selected_flight.currency} {selected_flight.price_total}"
         
         # Solicitar dados de pagamento
         context['state'] = CONVERSATION_STATES['WAITING_PAYMENT']
@@ -435,13 +830,12 @@ def handle_payment_info(user_id, context, detailed_info):
         if context['data'].get('nome') and context['data'].get('cpf') and context['data'].get('pagamento'):
             # Confirmar reserva
             voo = context['data']['voo_selecionado']
-            price = voo.get('price', {})
             
-            if price.get('currency') == 'EUR':
-                price_brl = float(price.get('total')) * 6.0
+            if voo.currency == 'EUR':
+                price_brl = float(voo.price_total) * 6.0
                 price_display = f"R$ {price_brl:,.0f}".replace(',', '.')
             else:
-                price_display = f"{price.get('currency')} {price.get('total')}"
+                price_display = f"{voo.currency} {voo.price_total}"
             
             # Gerar número de reserva
             reserva_num = f"VOO{context['data']['cpf'][-4:]}{datetime.now().strftime('%d%m%H%M')}"
@@ -533,13 +927,14 @@ def handle_hotel_conversation(user_id, intent, context, text):
             data['pessoas'] = 1
         
         # Buscar hotéis via Amadeus
-        city_code = amadeus_client.get_iata_code(cidade.lower())
+        city_code = amadeus_client.get_city_code(cidade)
         
         if not city_code:
             reply = {'text': f"🔍 Não encontrei '{cidade}' no sistema.\n\nTente: Lisboa, Paris, Dublin, Nova York, Rio de Janeiro..."}
             if store and store.client:
                 store.save_message(user_id, reply['text'], 'bot')
             return reply
+        cidade = data['cidade'] = amadeus_client.get_city_name(cidade) or cidade
         
         result = amadeus.search_hotels(city_code, checkin, checkout, roomQuantity=1)
         
@@ -552,33 +947,34 @@ def handle_hotel_conversation(user_id, intent, context, text):
             return reply
         
         if result and isinstance(result, list) and len(result) > 0:
-            context['hotel_offers'] = result[:5]
+            render_start = time.perf_counter()
+            context['hotel_offers'] = [HotelOffer.from_amadeus(hotel) for hotel in result[:5]]
             
             response_text = f"🏨 Encontrei {len(result)} hotéis em {cidade}!\n\n"
             response_text += f"📅 {checkin} até {checkout}\n👥 {pessoas} pessoa(s)\n\n"
             response_text += "🏆 Melhores opções:\n\n"
+            emit_chunk(response_text)
             
             for i, hotel in enumerate(context['hotel_offers'], 1):
-                name = hotel.get('hotel', {}).get('name', 'Hotel')
-                offers = hotel.get('offers', [])
-                if offers:
-                    price = offers[0].get('price', {})
-                    total = price.get('total', 'N/A')
-                    currency = price.get('currency', 'EUR')
-                    
-                    if currency == 'EUR':
-                        price_brl = float(total) * 6.0
-                        price_display = f"€{total} ≈ R$ {price_brl:.0f}/noite"
+                if hotel.price_total is not None:
+                    if hotel.currency == 'EUR':
+                        price_brl = float(hotel.price_total) * 6.0
+                        price_display = f"€{hotel.price_total} ≈ R$ {price_brl:.0f}/noite"
                     else:
-                        price_display = f"{currency} {total}/noite"
+                        price_display = f"{hotel.currency} {hotel.price_total}/noite"
                     
-                    response_text += f"{i}. {name}\n   {price_display}\n\n"
+                    line = f"{i}. {hotel.name}\n   {price_display}\n\n"
+                    response_text += line
+                    emit_chunk(line)
             
             if intent == 'ReservarHotel':
                 context['state'] = CONVERSATION_STATES['WAITING_HOTEL_PAYMENT']
-                response_text += "💳 Para reservar: Digite o número do hotel\n\nDepois precisarei de: nome, CPF e forma de pagamento"
+                prompt = "💳 Para reservar: Digite o número do hotel\n\nDepois precisarei de: nome, CPF e forma de pagamento"
             else:
-                response_text += "📞 Gostou? Diga 'reservar hotel [número]'"
+                prompt = "📞 Gostou? Diga 'reservar hotel [número]'"
+            response_text += prompt
+            emit_chunk(prompt)
+            metrics.record('render', time.perf_counter() - render_start)
             
             reply = {'text': response_text}
             if store and store.client:
@@ -621,19 +1017,16 @@ def handle_hotel_payment(user_id, context, detailed_info):
             context['data'].get('pagamento')):
             
             hotel = context['data']['hotel_selecionado']
-            hotel_name = hotel.get('hotel', {}).get('name', 'Hotel')
+            hotel_name = hotel.name
             
-            offers = hotel.get('offers', [])
-            if offers:
-                price = offers[0].get('price', {})
-                total = float(price.get('total', 0))
-                currency = price.get('currency', 'EUR')
+            if hotel.price_total is not None:
+                total = float(hotel.price_total)
                 
-                if currency == 'EUR':
+                if hotel.currency == 'EUR':
                     price_brl = total * 6.0
                     price_display = f"R$ {price_brl:.0f}"
                 else:
-                    price_display = f"{currency} {total}"
+                    price_display = f"{hotel.currency} {total}"
             else:
                 price_display = "N/A"
             
@@ -691,6 +1084,65 @@ def rest_handle(req_json):
         return {'response': f'Erro interno: {str(e)[:100]}', 'error': True}
 
 
+async def rest_handle_async(req_json):
+    """Handler para requisições REST no modo ASGI (asgi_app.py)"""
+    try:
+        user_id = req_json.get('userId', 'anonymous')
+        text = req_json.get('message', '').strip()
+        
+        if not text:
+            return {'response': 'Mensagem vazia', 'error': True}
+        
+        result = await handle_message_async(user_id, text)
+        return {'response': result.get('text', 'Erro desconhecido')}
+    
+    except Exception as e:
+        print(f'[ERROR] rest_handle: {str(e)}', flush=True)
+        return {'response': f'Erro interno: {str(e)[:100]}', 'error': True}
+
+
+def rest_handle_stream(req_json):
+    """
+    Versão em streaming de rest_handle: gera eventos (tipo, dados) - 'ack'
+    imediato, um 'chunk' por trecho formatado e 'done' com a resposta completa
+    (o mesmo JSON de rest_handle)
+    """
+    events = queue.Queue()
+
+    def run():
+        reply_sink.set(lambda text: events.put(('chunk', {'text': text})))
+        events.put(('done', rest_handle(req_json)))
+
+    yield 'ack', {'status': 'received'}
+    # O turno termina mesmo se o cliente desconectar no meio do streaming
+    threading.Thread(target=run, name='bot-stream', daemon=True).start()
+    while True:
+        event = events.get()
+        yield event
+        if event[0] == 'done':
+            return
+
+
+async def rest_handle_stream_async(req_json):
+    """Mesmos eventos de rest_handle_stream, no modo ASGI"""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    # Os trechos são emitidos na thread do handler: entregar via event loop
+    token = reply_sink.set(lambda text: loop.call_soon_threadsafe(events.put_nowait, ('chunk', {'text': text})))
+    try:
+        task = asyncio.ensure_future(rest_handle_async(req_json))
+    finally:
+        reply_sink.reset(token)
+    task.add_done_callback(lambda t: events.put_nowait(('done', t.result())))
+
+    yield 'ack', {'status': 'received'}
+    while True:
+        event = await events.get()
+        yield event
+        if event[0] == 'done':
+            return
+
+
 if __name__ == '__main__':
     # Manual test
     print('[TEST] Testando bot...')
@@ -0,0 +1,171 @@
+"""
+Cache em memória com expiração (TTL), limite de tamanho (LRU)
+e deduplicação de chamadas concorrentes (single-flight)
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=256, ttl=300, name='cache'):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()  # chave -> (expira_em, valor)
+        self._inflight = {}  # chave -> Future da carga em andamento
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # chamadas que aguardaram uma carga já em andamento
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Retorna o valor se presente e não expirado (conta hit/miss)"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Como get(), sem contar hit/miss nem renovar a posição no LRU"""
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(self, key, loader, should_cache=None):
+        """
+        Retorna o valor em cache ou executa loader().
+        Chamadas concorrentes para a mesma chave compartilham uma única execução.
+        should_cache(valor) decide se o resultado deve ser armazenado (ex.: ignorar erros).
+        """
+        value, future, leader = self._claim(key)
+        if future is None:
+            return value
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._complete(key, future, value, should_cache)
+        return value
+
+    async def get_or_load_async(self, key, loader, should_cache=None):
+        """
+        get_or_load() para o event loop: loader() é uma corrotina e quem chega
+        durante a carga aguarda o mesmo resultado sem ocupar thread
+        (inclusive cargas iniciadas por get_or_load em outra thread)
+        """
+        value, future, leader = self._claim(key)
+        if future is None:
+            return value
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            value = await loader()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._complete(key, future, value, should_cache)
+        return value
+
+    def _claim(self, key):
+        """(valor, None, _) se em cache; senão (None, Future da carga, True se esta chamada carrega)"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value, None, False
+            self.misses += 1
+
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.shared += 1
+        return None, future, leader
+
+    def _fail(self, key, future, error):
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_exception(error)
+
+    def _complete(self, key, future, value, should_cache):
+        with self._lock:
+            if should_cache is None or should_cache(value):
+                self._store(key, value, None)
+            self._inflight.pop(key, None)
+        future.set_result(value)
+
+    def dump(self):
+        """Lista (chave, valor, ttl restante) das entradas válidas, da menos para a mais recente"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value, expires_at - now)
+                    for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    # Métodos internos (chamados com o lock adquirido)
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _store(self, key, value, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
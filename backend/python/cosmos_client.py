@@ -1,60 +1,465 @@
 from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
 import azure_config
+import metrics
+import resilience
+import atexit
+import concurrent.futures
+import queue
+import threading
+import time
 import uuid
+from collections import deque
 from datetime import datetime
+from cache import TTLCache
+
+# Limite de operações por transactional batch do Cosmos DB
+MAX_BATCH_OPERATIONS = 100
+
+# Snapshot do estado da conversa: um documento por usuário (id fixo), na
+# mesma partição das mensagens e sobrescrito (upsert) a cada transição
+SNAPSHOT_TYPE = 'state'
+
+# Campos devolvidos pela leitura do histórico (metadata fica de fora);
+# IS_DEFINED(c.role) deixa os snapshots de fora
+HISTORY_FIELDS = ('id', 'role', 'message', 'sentiment', 'timestamp')
+HISTORY_QUERY = (f"SELECT TOP @limit {', '.join('c.' + field for field in HISTORY_FIELDS)} "
+                 "FROM c WHERE c.userId = @userId AND IS_DEFINED(c.role) ORDER BY c.timestamp DESC")
+
+# Índice composto para o filtro por usuário + ordenação por data do histórico;
+# metadata, o texto da mensagem e o contexto dos snapshots nunca são filtrados:
+# fora do índice (menos RU por gravação)
+INDEXING_POLICY = {
+    'indexingMode': 'consistent',
+    'automatic': True,
+    'includedPaths': [{'path': '/*'}],
+    'excludedPaths': [
+        {'path': '/metadata/*'},
+        {'path': '/message/?'},
+        {'path': '/context/?'},
+        {'path': '/"_etag"/?'},
+    ],
+    'compositeIndexes': [[
+        {'path': '/userId', 'order': 'ascending'},
+        {'path': '/timestamp', 'order': 'descending'},
+    ]],
+}
+
+
+def is_cosmos_failure(error):
+    """Erros que contam para o circuit breaker: rede, timeout, 429 e 5xx (404/409 não)"""
+    status = getattr(error, 'status_code', None)
+    return status is None or status == 429 or status >= 500
+
+
+def snapshot_id(userId):
+    return f'state-{userId}'
+
+
+def is_snapshot(item):
+    return item.get('type') == SNAPSHOT_TYPE
+
+
+def missing_index_settings(current):
+    """Partes de INDEXING_POLICY ausentes na política atual do container"""
+    excluded = {entry['path'] for entry in current.get('excludedPaths', [])}
+    composites = [[(entry['path'], entry.get('order', 'ascending')) for entry in index]
+                  for index in current.get('compositeIndexes', [])]
+    missing = [entry['path'] for entry in INDEXING_POLICY['excludedPaths'] if entry['path'] not in excluded]
+    for index in INDEXING_POLICY['compositeIndexes']:
+        if [(entry['path'], entry['order']) for entry in index] not in composites:
+            missing.append('(' + ', '.join(f"{entry['path']} {entry['order']}" for entry in index) + ')')
+    return missing
+
+
+class RequestCharge:
+    """response_hook do SDK que soma o custo (x-ms-request-charge) das respostas"""
+
+    def __init__(self):
+        self.units = 0.0
+
+    def __call__(self, headers, result):
+        # query_items também chama o hook ao criar o iterador, com os headers
+        # da requisição anterior: só contam as páginas (dict) e lotes (list)
+        if isinstance(result, (dict, list)):
+            try:
+                self.units += float(headers.get('x-ms-request-charge', 0))
+            except (TypeError, ValueError):
+                pass
+
+
+class _HistoryTail:
+    """
+    Últimas mensagens de um usuário, da mais antiga para a mais recente.
+    complete = a conversa inteira está aqui (o Cosmos devolveu menos que o pedido)
+    """
+    __slots__ = ('items', 'complete')
+
+    def __init__(self, items, complete):
+        self.items = deque(items, maxlen=azure_config.COSMOS_HISTORY_CACHE_TURNS)
+        self.complete = complete
+
+    def append(self, item):
+        if len(self.items) == self.items.maxlen:
+            self.complete = False
+        self.items.append(item)
+
+
+def _history_view(item):
+    """Projeção do item em HISTORY_FIELDS; sentimento pendente vira None"""
+    view = {field: item.get(field) for field in HISTORY_FIELDS}
+    sentiment = view['sentiment']
+    if isinstance(sentiment, concurrent.futures.Future):
+        view['sentiment'] = sentiment.result() if sentiment.done() and not sentiment.exception() else None
+    return view
+
 
 class ConversationStore:
     def __init__(self):
+        self._queue = None
+        self._writer = None
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {'enqueued': 0, 'written': 0, 'failed': 0, 'dropped': 0, 'batches': 0,
+                      'sentiment_missing': 0, 'superseded': 0}
+        self.guard = resilience.guard('cosmos', azure_config.BULKHEAD_COSMOS, is_failure=is_cosmos_failure)
+        self.history = {'queries': 0, 'cache_hits': 0, 'errors': 0, 'request_units': 0.0, 'last_query': None}
+        # Cache das últimas mensagens por usuário ativo. É por worker: mensagens
+        # gravadas por outro processo só aparecem depois que a entrada expira
+        self.history_cache = None
+        if azure_config.COSMOS_HISTORY_CACHE_USERS > 0 and azure_config.COSMOS_HISTORY_CACHE_TURNS > 0:
+            self.history_cache = TTLCache(azure_config.COSMOS_HISTORY_CACHE_USERS,
+                                          azure_config.COSMOS_HISTORY_CACHE_TTL, name='history')
         try:
             if not azure_config.COSMOS_ENDPOINT or not azure_config.COSMOS_KEY:
                 self.client = None
                 print('[WARN] Cosmos DB não configurado', flush=True)
                 return
             
-            self.client = CosmosClient(azure_config.COSMOS_ENDPOINT, credential=azure_config.COSMOS_KEY)
+            self.client = CosmosClient(azure_config.COSMOS_ENDPOINT, credential=azure_config.COSMOS_KEY,
+                                       connection_timeout=azure_config.COSMOS_REQUEST_TIMEOUT)
             self.db = self.client.create_database_if_not_exists(id=azure_config.COSMOS_DATABASE)
             self.container = self.db.create_container_if_not_exists(
                 id=azure_config.COSMOS_CONTAINER, 
-                partition_key=PartitionKey(path="/userId")
+                partition_key=PartitionKey(path="/userId"),
+                indexing_policy=INDEXING_POLICY
             )
+            self._check_indexing_policy()
             print('[INFO] Cosmos DB conectado', flush=True)
         except Exception as e:
             print(f'[ERROR] Cosmos DB init failed: {str(e)}', flush=True)
             self.client = None
+            return
 
-    def save_message(self, userId, message, role, sentiment=None, metadata=None):
+        if azure_config.COSMOS_WRITE_BEHIND:
+            self._start_writer()
+
+    def _check_indexing_policy(self):
+        """Container criado antes desta política: avisa ou, se configurado, atualiza o índice"""
+        missing = missing_index_settings(self.container.read().get('indexingPolicy', {}))
+        if not missing:
+            return
+        if not azure_config.COSMOS_APPLY_INDEXING_POLICY:
+            print(f'[WARN] Política de indexação do Cosmos desatualizada (faltam: {", ".join(missing)}); '
+                  f'use COSMOS_APPLY_INDEXING_POLICY=true para atualizar', flush=True)
+            return
+        self.container = self.db.replace_container(
+            self.container,
+            partition_key=PartitionKey(path="/userId"),
+            indexing_policy=INDEXING_POLICY
+        )
+        print(f'[INFO] Política de indexação do Cosmos atualizada ({", ".join(missing)})', flush=True)
+
+    def _start_writer(self):
+        """Inicia a thread de gravação em lote (write-behind)"""
+        self._queue = queue.Queue(maxsize=azure_config.COSMOS_QUEUE_MAXSIZE)
+        self._writer = threading.Thread(target=self._writer_loop, name='cosmos-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+        print(f'[INFO] Cosmos write-behind ativo (lote={azure_config.COSMOS_BATCH_SIZE}, '
+              f'intervalo={azure_config.COSMOS_FLUSH_INTERVAL_MS}ms)', flush=True)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def save_message(self, userId, message, role, sentiment=None, metadata=None, timestamp=None):
+        """
+        sentiment pode ser um Future (lote do Text Analytics); ele é resolvido
+        pela thread de gravação pouco antes do flush
+        """
         if not self.client:
             return None
         
+        item = {
+            'id': str(uuid.uuid4()),
+            'userId': userId,
+            'role': role,
+            'message': message[:500],  # Limitar tamanho
+            'sentiment': sentiment,
+            'metadata': metadata,
+            'timestamp': timestamp or datetime.utcnow().isoformat()
+        }
+
+        if self._queue is not None:
+            saved = self._enqueue(item)
+        else:
+            saved = self._create(item)
+        if saved is not None:
+            self._append_history(userId, item)
+        return saved
+
+    def _create(self, item):
+        charge = RequestCharge()
         try:
-            item = {
-                'id': str(uuid.uuid4()),
-                'userId': userId,
-                'role': role,
-                'message': message[:500],  # Limitar tamanho
-                'sentiment': sentiment,
-                'metadata': metadata,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            return self.container.create_item(body=item)
+            self._resolve_sentiments([item])
+            with metrics.timed('cosmos_write'):
+                return self._write_one(item, response_hook=charge)
         except Exception as e:
             print(f'[ERROR] Cosmos save failed: {str(e)[:100]}', flush=True)
             return None
+        finally:
+            metrics.inc('cosmos_request_units', {'op': 'upsert' if is_snapshot(item) else 'create'},
+                        amount=charge.units)
+
+    def _write_one(self, item, **kwargs):
+        if is_snapshot(item):
+            return self.guard.call(self.container.upsert_item, body=item, **kwargs)
+        return self.guard.call(self.container.create_item, body=item, **kwargs)
+
+    def save_state(self, userId, state, payload):
+        """
+        Grava o snapshot do estado da conversa (payload: contexto em JSON),
+        pela mesma fila das mensagens; load_state() o lê após um restart
+        """
+        if not self.client:
+            return None
+
+        item = {
+            'id': snapshot_id(userId),
+            'userId': userId,
+            'type': SNAPSHOT_TYPE,
+            'state': state,
+            'context': payload,
+            'timestamp': datetime.utcnow().isoformat()
+        }
+        if self._queue is not None:
+            return self._enqueue(item)
+        return self._create(item)
+
+    def load_state(self, userId):
+        """Último snapshot do usuário (leitura pontual na partição) ou None"""
+        if not self.client:
+            return None
+
+        charge = RequestCharge()
+        try:
+            with metrics.timed('cosmos_state_read'):
+                return self.guard.call(self.container.read_item, item=snapshot_id(userId), partition_key=userId,
+                                       response_hook=charge)
+        except CosmosResourceNotFoundError:
+            return None
+        except Exception as e:
+            print(f'[ERROR] Cosmos state read failed: {str(e)[:100]}', flush=True)
+            return None
+        finally:
+            metrics.inc('cosmos_request_units', {'op': 'state'}, amount=charge.units)
+
+    def _append_history(self, userId, item):
+        """Mantém a cauda em cache (se o usuário tiver uma) em dia com a mensagem nova"""
+        tail = self.history_cache.peek(userId) if self.history_cache is not None else None
+        if tail is not None:
+            tail.append(item)
+
+    def _enqueue(self, item):
+        """Enfileira o item; se a fila estiver cheia, bloqueia até o timeout (backpressure)"""
+        try:
+            self._queue.put(item, timeout=azure_config.COSMOS_ENQUEUE_TIMEOUT_MS / 1000)
+            self._count('enqueued')
+            return item
+        except queue.Full:
+            self._count('dropped')
+            print(f'[WARN] Fila do Cosmos cheia, mensagem descartada (userId={item["userId"]})', flush=True)
+            return None
+
+    def _writer_loop(self):
+        """Agrupa itens da fila por tamanho/tempo e grava em lote"""
+        batch_size = azure_config.COSMOS_BATCH_SIZE
+        interval = azure_config.COSMOS_FLUSH_INTERVAL_MS / 1000
+
+        while True:
+            try:
+                first = self._queue.get(timeout=interval)
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._flush(batch)
+            except Exception as e:
+                self._count('failed', len(batch))
+                print(f'[ERROR] Cosmos flush failed: {str(e)[:100]}', flush=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _resolve_sentiments(self, batch):
+        """Troca Futures de sentimento pelo resultado (None se não chegar a tempo)"""
+        deadline = time.monotonic() + azure_config.COSMOS_SENTIMENT_WAIT_MS / 1000
+        for item in batch:
+            sentiment = item.get('sentiment')
+            if isinstance(sentiment, concurrent.futures.Future):
+                try:
+                    item['sentiment'] = sentiment.result(timeout=max(0, deadline - time.monotonic()))
+                except Exception:
+                    item['sentiment'] = None
+                    self._count('sentiment_missing')
+
+    def _flush(self, batch):
+        """Grava um lote usando transactional batch por partição (userId)"""
+        self._resolve_sentiments(batch)
+        by_user = {}
+        snapshots = {}
+        for item in batch:
+            if is_snapshot(item):
+                if item['userId'] in snapshots:
+                    self._count('superseded')
+                snapshots[item['userId']] = item  # só o mais recente de cada usuário
+            else:
+                by_user.setdefault(item['userId'], []).append(item)
+        for user_id, item in snapshots.items():
+            by_user.setdefault(user_id, []).append(item)
+
+        with metrics.timed('cosmos_flush'):
+            for user_id, items in by_user.items():
+                for start in range(0, len(items), MAX_BATCH_OPERATIONS):
+                    chunk = items[start:start + MAX_BATCH_OPERATIONS]
+                    charge = RequestCharge()
+                    try:
+                        self.guard.call(
+                            self.container.execute_item_batch,
+                            batch_operations=[('upsert' if is_snapshot(item) else 'create', (item,))
+                                              for item in chunk],
+                            partition_key=user_id,
+                            response_hook=charge
+                        )
+                        metrics.inc('cosmos_request_units', {'op': 'batch'}, amount=charge.units)
+                        self._count('batches')
+                        self._count('written', len(chunk))
+                    except resilience.DependencyUnavailable as e:
+                        # Cosmos fora: não adianta tentar item a item
+                        self._count('failed', len(chunk))
+                        print(f'[WARN] Cosmos batch descartado: {e}', flush=True)
+                    except Exception as e:
+                        # Lote rejeitado: tentar item a item para não perder o restante
+                        print(f'[WARN] Cosmos batch failed, gravando individualmente: {str(e)[:100]}', flush=True)
+                        self._write_items(chunk)
+
+    def _write_items(self, items):
+        for item in items:
+            try:
+                self._write_one(item)
+                self._count('written')
+            except Exception as e:
+                self._count('failed')
+                print(f'[ERROR] Cosmos save failed: {str(e)[:100]}', flush=True)
+
+    def pending(self):
+        """Quantidade de itens aguardando gravação"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def writer_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['pending'] = self.pending()
+        stats['write_behind'] = self._queue is not None
+        return stats
+
+    def close(self, timeout=None):
+        """Drena a fila e encerra a thread de gravação"""
+        if self._writer is None or not self._writer.is_alive():
+            return
+        if timeout is None:
+            timeout = azure_config.COSMOS_DRAIN_TIMEOUT_MS / 1000
+        self._stop.set()
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            print(f'[WARN] Cosmos drain incompleto, {self.pending()} mensagens pendentes', flush=True)
+
+    def history_stats(self):
+        with self._stats_lock:
+            stats = dict(self.history)
+        reads = stats['queries'] + stats['cache_hits']
+        stats['request_units'] = round(stats['request_units'], 2)
+        stats['ru_per_query'] = round(stats['request_units'] / stats['queries'], 2) if stats['queries'] else 0.0
+        stats['cache_hit_rate'] = round(stats['cache_hits'] / reads, 3) if reads else 0.0
+        stats['cache'] = self.history_cache.stats() if self.history_cache is not None else None
+        return stats
     
     def get_conversation_context(self, userId, limit=10):
-        """Recupera as últimas mensagens da conversa para contexto"""
+        """
+        Últimas `limit` mensagens da conversa (da mais antiga para a mais
+        recente), com os campos de HISTORY_FIELDS. Servidas pela cauda em
+        cache quando ela cobre o pedido; senão, consulta na partição do usuário
+        """
         if not self.client:
             return []
         
+        tail = self.history_cache.get(userId) if self.history_cache is not None else None
+        if tail is not None and (tail.complete or limit <= len(tail.items)):
+            with self._stats_lock:
+                self.history['cache_hits'] += 1
+            return [_history_view(item) for item in list(tail.items)[-limit:]]
+
+        # Busca a cauda inteira de uma vez para os próximos turnos saírem do cache
+        fetch = max(limit, azure_config.COSMOS_HISTORY_CACHE_TURNS) if self.history_cache is not None else limit
+        items = self._query_history(userId, fetch)
+        if items is None:
+            return []
+        items.reverse()
+        if self.history_cache is not None:
+            self.history_cache.set(userId, _HistoryTail(items, complete=len(items) < fetch))
+        return [_history_view(item) for item in items[-limit:]]
+
+    def _query_history(self, userId, limit):
+        """Consulta restrita à partição do usuário; None em caso de erro"""
+        charge = RequestCharge()
+        start = time.perf_counter()
         try:
-            query = f"SELECT TOP {limit} * FROM c WHERE c.userId = @userId ORDER BY c.timestamp DESC"
-            items = list(self.container.query_items(
-                query=query,
-                parameters=[{"name": "@userId", "value": userId}],
-                enable_cross_partition_query=True
-            ))
-            return list(reversed(items))
+            items = self.guard.call(lambda: list(self.container.query_items(
+                query=HISTORY_QUERY,
+                parameters=[{"name": "@userId", "value": userId}, {"name": "@limit", "value": limit}],
+                partition_key=userId,
+                max_item_count=limit,
+                response_hook=charge
+            )))
         except Exception as e:
+            with self._stats_lock:
+                self.history['errors'] += 1
             print(f'[ERROR] Cosmos query failed: {str(e)[:100]}', flush=True)
-            return []
+            return None
+        elapsed = time.perf_counter() - start
 
+        metrics.record('cosmos_read', elapsed)
+        metrics.inc('cosmos_request_units', {'op': 'history'}, amount=charge.units)
+        last_query = {'items': len(items), 'request_units': round(charge.units, 2), 'ms': round(elapsed * 1000, 1)}
+        with self._stats_lock:
+            self.history['queries'] += 1
+            self.history['request_units'] += charge.units
+            self.history['last_query'] = last_query
+        if elapsed * 1000 >= azure_config.COSMOS_SLOW_QUERY_MS:
+            print(f'[INFO] Cosmos history userId={userId}: {len(items)} itens, '
+                  f'{charge.units:.2f} RU, {elapsed * 1000:.0f}ms', flush=True)
+        return items
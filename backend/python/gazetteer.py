@@ -0,0 +1,267 @@
+"""
+Gazetteer de cidades - fonte única de aliases, nomes e códigos IATA
+Carrega data/cities.csv sob demanda e oferece busca exata, busca aproximada
+(índice de trigramas + distância de edição) e um matcher compilado para
+encontrar cidades dentro de uma mensagem
+"""
+import csv
+import heapq
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from operator import itemgetter
+import azure_config
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cities.csv')
+# Cidades reais que não estão na base: a busca aproximada não as "corrige"
+# para uma cidade parecida ('munique' não vira Zurique)
+UNSERVED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'unserved_cities.txt')
+
+# Busca aproximada: o segundo colocado "empata" se a distância dele, relativa
+# ao tamanho do nome, fica a até NEAR_TIE da melhor (1 edição a mais em 10 letras)
+NEAR_TIE = 0.1
+
+
+def normalize(text):
+    """Remove acentos, converte para minúsculas e colapsa espaços"""
+    nfkd = unicodedata.normalize('NFKD', text)
+    without_accents = ''.join(c for c in nfkd if not unicodedata.combining(c))
+    return ' '.join(without_accents.lower().split())
+
+
+class City:
+    __slots__ = ('name', 'country', 'city_code', 'airports')
+
+    def __init__(self, name, country, city_code, airports):
+        self.name = name
+        self.country = country
+        self.city_code = city_code
+        self.airports = airports
+
+    @property
+    def airport_code(self):
+        """Aeroporto padrão para busca de voos"""
+        return self.airports[0] if self.airports else self.city_code
+
+    def __repr__(self):
+        return f'City({self.name!r}, {self.city_code}, {"/".join(self.airports)})'
+
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a, b, max_distance):
+    """
+    Distância de edição com transposição de letras vizinhas ('lisbao' -> 'lisboa' = 1).
+    Só calcula a faixa |i - j| <= max_distance (fora dela a distância já passa
+    do limite) e retorna max_distance + 1 assim que o limite é ultrapassado
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    over = max_distance + 1
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        ca = a[i - 1]
+        current = [over] * (len(b) + 1)
+        current[0] = row_min = i
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            cb = b[j - 1]
+            cost = previous[j - 1] + (ca != cb)
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb and before_previous[j - 2] + 1 < cost:
+                cost = before_previous[j - 2] + 1
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > max_distance:
+            return over
+        before_previous, previous = previous, current
+    return min(previous[-1], over)
+
+
+def _trie_pattern(words):
+    """
+    Monta uma regex em formato de trie. Os quantificadores gulosos fazem o
+    match mais longo ter prioridade ('rio de janeiro' antes de 'rio')
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        terminal = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if terminal:
+            return '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+
+def _is_transposition(a, b):
+    """b é a com duas letras vizinhas trocadas ('lisbao' -> 'lisboa')"""
+    if len(a) != len(b):
+        return False
+    diff = [i for i in range(len(a)) if a[i] != b[i]]
+    return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+
+
+class Gazetteer:
+    def __init__(self, path=DEFAULT_PATH, unserved_path=UNSERVED_PATH):
+        self.path = path
+        self.unserved_path = unserved_path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._by_alias = {}
+        self._by_code = {}
+        self._unserved = set()
+        self._trigram_index = None
+        self._matcher = None
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            with open(self.path, encoding='utf-8') as f:
+                rows = csv.DictReader(line for line in f if line.strip() and not line.startswith('#'))
+                for row in rows:
+                    self._add(row)
+            if self.unserved_path and os.path.exists(self.unserved_path):
+                with open(self.unserved_path, encoding='utf-8') as f:
+                    names = {normalize(line) for line in f if line.strip() and not line.startswith('#')}
+                self._unserved = names - self._by_alias.keys()
+            self._loaded = True
+
+    def _add(self, row):
+        airports = [code.strip().upper() for code in row['airports'].split('|') if code.strip()]
+        city = City(row['name'].strip(), row['country'].strip(), row['city_code'].strip().upper(), airports)
+        aliases = [city.name] + [alias for alias in (row.get('aliases') or '').split('|') if alias.strip()]
+        for alias in aliases:
+            # Primeira definição vence em caso de alias repetido
+            self._by_alias.setdefault(normalize(alias), city)
+        for code in [city.city_code] + airports:
+            self._by_code.setdefault(code, city)
+
+    def aliases(self):
+        """Dicionário alias normalizado -> City"""
+        self._ensure_loaded()
+        return self._by_alias
+
+    def lookup(self, name):
+        """Busca exata por alias (ignora acentos e maiúsculas)"""
+        self._ensure_loaded()
+        return self._by_alias.get(normalize(name))
+
+    def by_code(self, code):
+        """Busca por código IATA de cidade ou aeroporto"""
+        self._ensure_loaded()
+        return self._by_code.get(code.strip().upper())
+
+    def fuzzy_lookup(self, name, max_distance=1):
+        """
+        Busca tolerante a erros de digitação ('lisbao' -> Lisboa). Nomes com
+        menos de 7 letras só aceitam duas letras vizinhas trocadas; os demais,
+        até max_distance edições. Sem resposta se o texto é uma cidade real fora
+        da base ou se outra cidade fica quase tão perto (NEAR_TIE)
+        """
+        query = normalize(name)
+        if len(query) < 4:
+            return None
+        self._ensure_loaded()
+        if query in self._unserved:
+            return None
+
+        index = self._get_trigram_index()
+        grams = _trigrams(query)
+        scores = defaultdict(int)
+        for gram in sorted(grams):
+            for alias in index.get(gram, ()):
+                scores[alias] += 1
+
+        # Só os 20 candidatos com mais trigramas em comum. Trigramas em ordem e
+        # seleção estável: empates não dependem da ordem de hash do processo
+        candidates = heapq.nlargest(20, scores.items(), key=itemgetter(1))
+        if len(query) < 7 and not any(_is_transposition(query, alias) for alias, _ in candidates):
+            return None  # nome curto: só letras vizinhas trocadas são aceitas
+
+        # Uma edição de folga para enxergar o segundo colocado. Cada edição muda
+        # no máximo 4 trigramas: quem perde mais que isso não está no limite
+        limit = max_distance + 1
+        nearest = {}  # cidade (None = fora da base) -> menor distância
+        transposed = set()  # cidades com um alias a uma troca de letras vizinhas
+        for alias, shared in candidates:
+            if len(grams) - shared > 4 * limit:
+                break
+            distance = _edit_distance(query, alias, limit)
+            if distance > limit:
+                continue
+            city = self._by_alias.get(alias)
+            nearest[city] = min(distance, nearest.get(city, distance))
+            if distance == 1 and _is_transposition(query, alias):
+                transposed.add(city)
+        if not nearest:
+            return None
+
+        ranked = sorted(nearest.items(), key=lambda item: item[1])
+        best, best_distance = ranked[0]
+        if best is None or best_distance > max_distance:
+            return None
+        if len(ranked) > 1 and (ranked[1][1] - best_distance) / len(query) <= NEAR_TIE:
+            return None  # empate ou quase: melhor perguntar do que buscar a cidade errada
+        if len(query) < 7 and best not in transposed:
+            return None
+        return best
+
+    def resolve(self, name):
+        """Alias exato, código IATA conhecido ou busca aproximada, nessa ordem"""
+        if not name or not name.strip():
+            return None
+        city = self.lookup(name)
+        if city:
+            return city
+        if len(name.strip()) == 3:
+            city = self.by_code(name)
+            if city:
+                return city
+        return self.fuzzy_lookup(name)
+
+    def _get_trigram_index(self):
+        """Índice de trigramas, construído apenas na primeira busca aproximada"""
+        if self._trigram_index is None:
+            self._ensure_loaded()
+            index = defaultdict(list)
+            for alias in list(self._by_alias) + sorted(self._unserved):
+                for gram in _trigrams(alias):
+                    index[gram].append(alias)
+            self._trigram_index = dict(index)
+        return self._trigram_index
+
+    def find_all(self, text_normalized):
+        """Itera (match, City) para cada cidade citada no texto já normalizado"""
+        if self._matcher is None:
+            self._ensure_loaded()
+            self._matcher = re.compile(
+                r'(?<![a-z0-9])(' + _trie_pattern(self._by_alias) + r')(?![a-z0-9])'
+            )
+        for match in self._matcher.finditer(text_normalized):
+            yield match, self._by_alias[match.group(1)]
+
+
+# Instância padrão (carregada na primeira consulta)
+default = Gazetteer(azure_config.GAZETTEER_PATH or DEFAULT_PATH)
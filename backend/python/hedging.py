@@ -0,0 +1,165 @@
+"""
+Requisições com hedge (cauda de latência)
+Se a chamada não responde até o percentil observado (p95 por padrão), uma
+segunda chamada idêntica é disparada e vale a primeira resposta com sucesso.
+As chamadas extras são limitadas por um orçamento: cada chamada principal
+rende max_extra fichas e cada hedge gasta uma (max_extra=0.05 = até 5% a mais).
+O pool nunca enfileira: sem thread livre a principal roda na thread de quem
+chamou (sem hedge) e a cópia não é disparada
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import metrics
+
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Hedger:
+    def __init__(self, name, percentile=95, max_extra=0.05, min_delay=0.1, min_samples=20,
+                 window=200, workers=32, max_tokens=10):
+        self.name = name
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_tokens = max_tokens
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'hedge-{name}')
+        self._free = threading.BoundedSemaphore(workers)  # threads livres do pool
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        # Latências da chamada principal (mesmo quando o hedge vence: o que
+        # teria sido sem hedge) e da resposta entregue a quem chamou
+        self._primary = deque(maxlen=window)
+        self._response = deque(maxlen=window)
+        self.counts = {'calls': 0, 'hedged': 0, 'hedge_won': 0, 'hedge_failed': 0,
+                       'skipped_budget': 0, 'skipped_busy': 0}
+        self.saved = 0.0  # segundos economizados nas vitórias do hedge
+
+    def delay(self):
+        """Espera antes do hedge (percentil das chamadas recentes), ou None sem amostras suficientes"""
+        with self._lock:
+            samples = sorted(self._primary)
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, _percentile(samples, self.percentile))
+
+    def call(self, fn, hedge=None):
+        """
+        Executa fn(); dispara hedge() (padrão: fn) se passar do prazo e houver
+        orçamento. Uma cópia que falha não derruba a chamada: vale a principal
+        """
+        start = time.perf_counter()
+        deadline = self.delay()
+        with self._lock:
+            self.counts['calls'] += 1
+            self._tokens = min(self.max_tokens, self._tokens + self.max_extra)
+
+        primary = self._submit(fn, primary=True) if deadline is not None else None
+        if primary is None:
+            # Sem prazo ainda (poucas amostras) ou pool cheio: chamada direta
+            return self._finish(self._run(fn, primary=True), start)
+
+        done, _ = wait([primary], timeout=deadline)
+        if done or not self._take_token():
+            return self._finish(primary.result(), start)
+
+        copy = self._submit(hedge or fn, primary=False)
+        if copy is None:
+            self._refund_token()
+            return self._finish(primary.result(), start)
+        metrics.inc('hedge', {'client': self.name, 'result': 'issued'})
+        wait({primary, copy}, return_when=FIRST_COMPLETED)
+        if primary.done() and primary.exception() is None:
+            return self._finish(primary.result(), start)
+        if primary.done():
+            wait([copy])  # a principal falhou: ainda vale a cópia
+        if copy.exception() is None:
+            self._hedge_won(primary, start)
+            return self._finish(copy.result(), start)
+        self._count_locked('hedge_failed')
+        return self._finish(primary.result(), start)
+
+    def _run(self, fn, primary):
+        # Latência medida do início da execução: a espera por thread não entra no percentil
+        started = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            if primary:
+                # Registrada mesmo depois de perder para o hedge
+                self._record(self._primary, time.perf_counter() - started)
+
+    def _submit(self, fn, primary):
+        """fn numa thread livre do pool, ou None se estiverem todas ocupadas"""
+        if not self._free.acquire(blocking=False):
+            return None
+        try:
+            future = self._executor.submit(self._run, fn, primary)
+        except BaseException:
+            self._free.release()
+            raise
+        future.add_done_callback(lambda _: self._free.release())
+        return future
+
+    def _take_token(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.counts['skipped_budget'] += 1
+                metrics.inc('hedge', {'client': self.name, 'result': 'skipped_budget'})
+                return False
+            self._tokens -= 1
+            self.counts['hedged'] += 1
+            return True
+
+    def _refund_token(self):
+        with self._lock:
+            self._tokens += 1
+            self.counts['hedged'] -= 1
+            self.counts['skipped_busy'] += 1
+        metrics.inc('hedge', {'client': self.name, 'result': 'skipped_busy'})
+
+    def _count_locked(self, key):
+        with self._lock:
+            self.counts[key] += 1
+        metrics.inc('hedge', {'client': self.name, 'result': key})
+
+    def _hedge_won(self, primary, start):
+        self._count_locked('hedge_won')
+        answered = time.perf_counter() - start
+
+        def saved(_):
+            # A principal terminou depois: quanto o hedge economizou
+            with self._lock:
+                self.saved += max(0.0, time.perf_counter() - start - answered)
+        primary.add_done_callback(saved)
+
+    def _finish(self, result, start):
+        elapsed = time.perf_counter() - start
+        self._record(self._response, elapsed)
+        metrics.record(f'{self.name}_response', elapsed)
+        return result
+
+    def _record(self, samples, seconds):
+        with self._lock:
+            samples.append(seconds)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            primary = sorted(self._primary)
+            response = sorted(self._response)
+            saved = self.saved
+        stats = dict(counts)
+        stats['extra_call_ratio'] = round(counts['hedged'] / counts['calls'], 4) if counts['calls'] else 0.0
+        stats['budget'] = self.max_extra
+        stats['delay_ms'] = round(self.delay() * 1000, 1) if len(primary) >= self.min_samples else None
+        stats['saved_ms_total'] = round(saved * 1000, 1)
+        for pct in (95, 99):
+            stats[f'p{pct}_primary_ms'] = round(_percentile(primary, pct) * 1000, 1) if primary else None
+            stats[f'p{pct}_response_ms'] = round(_percentile(response, pct) * 1000, 1) if response else None
+        return stats
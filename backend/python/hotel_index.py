@@ -0,0 +1,135 @@
+"""
+Índice persistente cityCode -> hotelIds
+Evita a chamada reference_data.locations.hotels.by_city a cada busca de hotel:
+o índice é aquecido em background, atualizado periodicamente e salvo em disco
+"""
+import json
+import os
+import threading
+import time
+
+
+class HotelIdIndex:
+    def __init__(self, fetcher, snapshot_path=None, refresh_interval=86400, max_hotels=10):
+        """
+        fetcher(cityCode) -> lista de hotelIds (consulta a API de referência)
+        snapshot_path: arquivo JSON usado para não iniciar frio após restart
+        """
+        self.fetcher = fetcher
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self.max_hotels = max_hotels
+        self._entries = {}  # cityCode -> {'hotel_ids': [...], 'updated_at': epoch}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.load_snapshot()
+
+    def get(self, city_code):
+        """Retorna os hotelIds da cidade, buscando na API apenas se não indexada"""
+        city_code = city_code.upper()
+        with self._lock:
+            entry = self._entries.get(city_code)
+            if entry:
+                self.hits += 1
+                return entry['hotel_ids']
+            self.misses += 1
+
+        hotel_ids = self._refresh_city(city_code)
+        if hotel_ids:
+            self.save_snapshot()
+        return hotel_ids
+
+    def _refresh_city(self, city_code):
+        hotel_ids = self.fetcher(city_code)[:self.max_hotels]
+        if hotel_ids:
+            with self._lock:
+                self._entries[city_code] = {'hotel_ids': hotel_ids, 'updated_at': time.time()}
+                self.refreshes += 1
+        return hotel_ids
+
+    def warm(self, city_codes):
+        """Indexa cidades ainda ausentes (usado no startup)"""
+        for city_code in city_codes:
+            if self._stop.is_set():
+                return
+            city_code = city_code.upper()
+            with self._lock:
+                if city_code in self._entries:
+                    continue
+            try:
+                self._refresh_city(city_code)
+            except Exception as e:
+                print(f'[WARN] Hotel index warm failed for {city_code}: {str(e)[:100]}', flush=True)
+        self.save_snapshot()
+
+    def refresh_stale(self):
+        """Atualiza entradas mais antigas que refresh_interval"""
+        now = time.time()
+        with self._lock:
+            stale = [code for code, entry in self._entries.items()
+                     if now - entry['updated_at'] >= self.refresh_interval]
+        for city_code in stale:
+            if self._stop.is_set():
+                return
+            try:
+                self._refresh_city(city_code)
+            except Exception as e:
+                # Mantém a lista antiga se a API falhar
+                print(f'[WARN] Hotel index refresh failed for {city_code}: {str(e)[:100]}', flush=True)
+        if stale:
+            self.save_snapshot()
+
+    def start(self, warm_cities=(), check_interval=600):
+        """Inicia a thread de aquecimento e atualização periódica"""
+        if self._thread is not None:
+            return
+
+        def loop():
+            self.warm(warm_cities)
+            while not self._stop.wait(check_interval):
+                self.refresh_stale()
+
+        self._thread = threading.Thread(target=loop, name='hotel-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                entries = json.load(f)
+            with self._lock:
+                self._entries.update(entries)
+            print(f'[INFO] Hotel index carregado: {len(entries)} cidades', flush=True)
+        except Exception as e:
+            print(f'[WARN] Hotel index snapshot inválido: {str(e)[:100]}', flush=True)
+
+    def save_snapshot(self):
+        """Grava o índice de forma atômica (arquivo temporário + rename)"""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        tmp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, separators=(',', ':'))
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            print(f'[WARN] Hotel index snapshot failed: {str(e)[:100]}', flush=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cities': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+            }
@@ -0,0 +1,119 @@
+"""
+Classificador local de intents
+Regras por palavra-chave + Naive Bayes treinado com data/intents.csv.
+Mensagens classificadas com confiança dispensam a chamada ao CLU
+"""
+import csv
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'intents.csv')
+
+# Regras sobre o texto normalizado (sem acentos, minúsculo)
+CANCEL = re.compile(r'\b(?:cancel\w*|desist\w*|estorn\w*)\b')
+FLIGHT = re.compile(r'\b(?:voos?|passage(?:m|ns)|aere[ao]s?|aviao|voar)\b')
+HOTEL = re.compile(r'\b(?:hote(?:l|is)|hospedage(?:m|ns)|hosped\w*|pousadas?|quartos?|diarias?)\b')
+CONSULT = re.compile(r'\b(?:consult\w*|quais|qual|quanto|preco|valor|ver|buscar|pesquis\w*|mostr\w*|existe|horarios?)\b')
+BUY = re.compile(r'\b(?:compr\w*|reserv\w*|quero|preciso|emitir)\b')
+GREETING = re.compile(r'^(?:ola|oi|bom dia|boa tarde|boa noite|e ai|hey|menu|ajuda)\W*$')
+
+TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text_normalized):
+    """Palavras + bigramas"""
+    words = TOKEN.findall(text_normalized)
+    return words + [f'{a}_{b}' for a, b in zip(words, words[1:])]
+
+
+def rule_intent(text_normalized):
+    """Intent inequívoca pelas regras, ou None"""
+    if GREETING.match(text_normalized):
+        return 'None'
+    is_flight = bool(FLIGHT.search(text_normalized))
+    is_hotel = bool(HOTEL.search(text_normalized))
+    if is_flight == is_hotel:
+        return None
+    if CANCEL.search(text_normalized):
+        return 'CancelarVoos' if is_flight else 'CancelarHotel'
+    consult = bool(CONSULT.search(text_normalized))
+    buy = bool(BUY.search(text_normalized))
+    if consult and not buy:
+        return 'ConsultarVoos' if is_flight else 'ConsultarHotel'
+    if buy and not consult:
+        return 'ComprarVoos' if is_flight else 'ReservarHotel'
+    return None
+
+
+class NaiveBayes:
+    """Naive Bayes multinomial com suavização de Laplace"""
+
+    def __init__(self, examples):
+        self.class_counts = Counter()
+        self.token_counts = defaultdict(Counter)
+        self.vocabulary = set()
+        for intent, tokens in examples:
+            self.class_counts[intent] += 1
+            self.token_counts[intent].update(tokens)
+            self.vocabulary.update(tokens)
+        total = sum(self.class_counts.values())
+        self.log_prior = {c: math.log(n / total) for c, n in self.class_counts.items()}
+        self.totals = {c: sum(counts.values()) for c, counts in self.token_counts.items()}
+
+    def predict(self, tokens):
+        """(intent, probabilidade) ou (None, 0.0) se nenhum token é conhecido"""
+        known = [t for t in tokens if t in self.vocabulary]
+        if not known:
+            return None, 0.0
+        vocab_size = len(self.vocabulary)
+        scores = {}
+        for intent, log_prior in self.log_prior.items():
+            counts = self.token_counts[intent]
+            denominator = self.totals[intent] + vocab_size
+            scores[intent] = log_prior + sum(math.log((counts[t] + 1) / denominator) for t in known)
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        probability = 1.0 / sum(math.exp(score - top) for score in scores.values())
+        return best, probability
+
+
+class LocalIntentClassifier:
+    def __init__(self, normalize, path=DEFAULT_PATH, threshold=0.9):
+        self.normalize = normalize
+        self.threshold = threshold
+        with open(path, encoding='utf-8') as f:
+            rows = csv.DictReader(line for line in f if line.strip() and not line.startswith('#'))
+            examples = [(row['intent'], tokenize(normalize(row['text']))) for row in rows]
+        self.model = NaiveBayes(examples)
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def predict(self, text_normalized):
+        """(intent, confiança, origem) com origem 'rule' ou 'model'"""
+        intent = rule_intent(text_normalized)
+        if intent:
+            return intent, 1.0, 'rule'
+        intent, probability = self.model.predict(tokenize(text_normalized))
+        return intent, probability, 'model'
+
+    def record(self, source):
+        """
+        Contabiliza quem decidiu o turno: state, rule, model (sem CLU),
+        clu, fallback (CLU falhou, usou o modelo) ou clu_error
+        """
+        with self._lock:
+            self.counts[source] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        turns = sum(counts.values())
+        clu_calls = counts.get('clu', 0) + counts.get('fallback', 0) + counts.get('clu_error', 0)
+        return {
+            'turns': turns,
+            'by_source': counts,
+            'clu_avoidance_rate': round(1 - clu_calls / turns, 3) if turns else 0.0,
+        }
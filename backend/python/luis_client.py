@@ -1,50 +1,298 @@
+import asyncio
+import atexit
+import json
+import os
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 import azure_config
+import resilience
+from cache import TTLCache
+
+# Status HTTP considerados transitórios (vale tentar de novo)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def request_error(message, transient):
+    """
+    Resposta de erro do CLU. transient: falha do serviço (timeout, conexão,
+    429, 5xx), que conta para o circuit breaker; erros do pedido (400, 401,
+    404...) não abrem o circuito
+    """
+    return {'error': message, 'transient': transient}
+
+
+def is_transient_status(status_code):
+    return status_code == 429 or status_code >= 500
 
 class CluClient:
-    def __init__(self):
+    def __init__(self, normalize=None):
         self.project_name = azure_config.CLU_PROJECT_NAME
         self.deployment_name = azure_config.CLU_DEPLOYMENT_NAME
         self.endpoint = azure_config.CLU_ENDPOINT
         self.key = azure_config.CLU_KEY
         self.enabled = bool(self.project_name and self.endpoint and self.key)
+        self.url = f"{self.endpoint}/language/:analyze-conversations?api-version=2022-10-01-preview"
+        self.timeout = (azure_config.CLU_CONNECT_TIMEOUT, azure_config.CLU_READ_TIMEOUT)
+        self.max_retries = azure_config.CLU_MAX_RETRIES
+        self.backoff_base = azure_config.CLU_BACKOFF_BASE_MS / 1000
+        self.backoff_max = azure_config.CLU_BACKOFF_MAX_MS / 1000
+        self.pool_size = azure_config.CLU_POOL_SIZE
+
+        # Sessão HTTP com pool de conexões keep-alive (evita TCP+TLS a cada mensagem)
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self.session.headers.update({
+            'Ocp-Apim-Subscription-Key': self.key or '',
+            'Content-Type': 'application/json'
+        })
+
+        self._stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+        self._async_client = None  # httpx.AsyncClient, criado no modo ASGI
+        # Falhas seguidas abrem o circuito: o turno cai direto no fallback local
+        self.guard = resilience.guard('clu', azure_config.BULKHEAD_CLU, failed_result=lambda result: result.get('transient', False))
+
+        # Cache de predições: (projeto, deployment, idioma, texto normalizado) -> resposta;
+        # trocar o deployment muda a chave e load_cache descarta snapshots de outro deployment
+        self.normalize = normalize or (lambda text: text.strip().lower())
+        self.cache = None
+        self.cache_path = azure_config.CLU_CACHE_PATH
+        if self.enabled and azure_config.CLU_CACHE_SIZE > 0:
+            self.cache = TTLCache(maxsize=azure_config.CLU_CACHE_SIZE, ttl=azure_config.CLU_CACHE_TTL, name='clu')
+            if self.cache_path:
+                self.load_cache()
+                atexit.register(self.save_cache)
 
     def recognize(self, text, language='pt-br'):
         if not self.enabled:
             print('[WARN] CLU não configurado, usando fallback', flush=True)
             return {'error': 'CLU credentials not set'}
-        
-        try:
-            url = f"{self.endpoint}/language/:analyze-conversations?api-version=2022-10-01-preview"
-            
-            payload = {
-                "kind": "Conversation",
-                "analysisInput": {
-                    "conversationItem": {
-                        "id": "1",
-                        "participantId": "user",
-                        "language": language,
-                        "text": text
-                    }
-                },
-                "parameters": {
-                    "projectName": self.project_name,
-                    "deploymentName": self.deployment_name,
-                    "stringIndexType": "TextElement_V8"
+
+        if self.cache is None:
+            return self._guarded_request(text, language)
+
+        return self.cache.get_or_load(
+            self._cache_key(text, language),
+            lambda: self._guarded_request(text, language),
+            should_cache=lambda result: 'error' not in result
+        )
+
+    async def recognize_async(self, text, language='pt-br'):
+        """Mesma lógica de recognize() sem bloquear o event loop (modo ASGI)"""
+        if not self.enabled:
+            print('[WARN] CLU não configurado, usando fallback', flush=True)
+            return {'error': 'CLU credentials not set'}
+
+        if self.cache is None:
+            return await self._guarded_request_async(text, language)
+
+        return await self.cache.get_or_load_async(
+            self._cache_key(text, language),
+            lambda: self._guarded_request_async(text, language),
+            should_cache=lambda result: 'error' not in result
+        )
+
+    def _cache_key(self, text, language):
+        return (self.project_name, self.deployment_name, language, ' '.join(self.normalize(text).split()))
+
+    def _payload(self, text, language):
+        return {
+            "kind": "Conversation",
+            "analysisInput": {
+                "conversationItem": {
+                    "id": "1",
+                    "participantId": "user",
+                    "language": language,
+                    "text": text
                 }
+            },
+            "parameters": {
+                "projectName": self.project_name,
+                "deploymentName": self.deployment_name,
+                "stringIndexType": "TextElement_V8"
             }
-            
-            headers = {
-                'Ocp-Apim-Subscription-Key': self.key,
-                'Content-Type': 'application/json'
-            }
-            
-            r = requests.post(url, json=payload, headers=headers, timeout=10)
-            r.raise_for_status()
-            return r.json()
-            
-        except requests.exceptions.Timeout:
-            return {'error': 'CLU timeout'}
-        except requests.exceptions.RequestException as e:
-            print(f'[ERROR] CLU request failed: {str(e)}', flush=True)
-            return {'error': f'CLU error: {str(e)[:100]}'}
+        }
+
+    def _guarded_request(self, text, language):
+        try:
+            return self.guard.call(self._request, text, language)
+        except resilience.DependencyUnavailable as e:
+            return {'error': str(e)}
+
+    async def _guarded_request_async(self, text, language):
+        try:
+            return await self.guard.call_async(self._request_async, text, language)
+        except resilience.DependencyUnavailable as e:
+            return {'error': str(e)}
+
+    def _request(self, text, language):
+        payload = self._payload(text, language)
+        attempt = 0
+        while True:
+            try:
+                with self._stats_lock:
+                    self.requests_sent += 1
+                r = self.session.post(self.url, json=payload, timeout=self.timeout)
+                if r.status_code in RETRY_STATUS and attempt < self.max_retries:
+                    self._backoff(attempt, r.headers.get('Retry-After'))
+                    attempt += 1
+                    continue
+                r.raise_for_status()
+                return r.json()
+
+            except requests.exceptions.ReadTimeout:
+                # O tempo de leitura já foi gasto: não repetir
+                return request_error('CLU timeout', True)
+            except requests.exceptions.ConnectionError as e:
+                # Inclui ConnectTimeout: falha antes de enviar, seguro repetir
+                if attempt < self.max_retries:
+                    self._backoff(attempt)
+                    attempt += 1
+                    continue
+                if isinstance(e, requests.exceptions.ConnectTimeout):
+                    return request_error('CLU timeout', True)
+                print(f'[ERROR] CLU request failed: {str(e)}', flush=True)
+                return request_error(f'CLU error: {str(e)[:100]}', True)
+            except requests.exceptions.RequestException as e:
+                print(f'[ERROR] CLU request failed: {str(e)}', flush=True)
+                response = getattr(e, 'response', None)
+                if response is not None:
+                    transient = is_transient_status(response.status_code)
+                else:
+                    # Conexão caiu no meio da resposta
+                    transient = isinstance(e, requests.exceptions.ChunkedEncodingError)
+                return request_error(f'CLU error: {str(e)[:100]}', transient)
+
+    def _get_async_client(self):
+        # httpx só é necessário no modo ASGI (asgi_app.py)
+        if self._async_client is None:
+            import httpx
+            self._async_client = httpx.AsyncClient(
+                headers=dict(self.session.headers),
+                timeout=httpx.Timeout(azure_config.CLU_READ_TIMEOUT, connect=azure_config.CLU_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size)
+            )
+        return self._async_client
+
+    async def _request_async(self, text, language):
+        import httpx
+        client = self._get_async_client()
+        payload = self._payload(text, language)
+        attempt = 0
+        while True:
+            try:
+                with self._stats_lock:
+                    self.requests_sent += 1
+                r = await client.post(self.url, json=payload)
+                if r.status_code in RETRY_STATUS and attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff_delay(attempt, r.headers.get('Retry-After')))
+                    attempt += 1
+                    continue
+                r.raise_for_status()
+                return r.json()
+
+            except (httpx.ReadTimeout, httpx.WriteTimeout, httpx.PoolTimeout):
+                return request_error('CLU timeout', True)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                    attempt += 1
+                    continue
+                if isinstance(e, httpx.ConnectTimeout):
+                    return request_error('CLU timeout', True)
+                print(f'[ERROR] CLU request failed: {str(e)}', flush=True)
+                return request_error(f'CLU error: {str(e)[:100]}', True)
+            except httpx.HTTPStatusError as e:
+                print(f'[ERROR] CLU request failed: {str(e)}', flush=True)
+                return request_error(f'CLU error: {str(e)[:100]}', is_transient_status(e.response.status_code))
+            except (httpx.HTTPError, ValueError) as e:
+                print(f'[ERROR] CLU request failed: {str(e)}', flush=True)
+                return request_error(f'CLU error: {str(e)[:100]}', isinstance(e, httpx.TransportError))
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _backoff(self, attempt, retry_after=None):
+        time.sleep(self._backoff_delay(attempt, retry_after))
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        """Espera exponencial com jitter total; respeita Retry-After se informado"""
+        with self._stats_lock:
+            self.retries += 1
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.backoff_max))
+            except ValueError:
+                pass
+        return delay
+
+    def load_cache(self):
+        """Carrega predições salvas, descartando-as se o projeto/deployment mudou"""
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if (snapshot.get('project') != self.project_name
+                    or snapshot.get('deployment') != self.deployment_name):
+                print('[INFO] Cache do CLU descartado (deployment mudou)', flush=True)
+                return
+            # TTL restante descontado do tempo em que o arquivo ficou parado
+            elapsed = time.time() - snapshot['saved_at']
+            for key, value, ttl in snapshot['entries']:
+                ttl -= elapsed
+                if ttl > 0:
+                    self.cache.set(tuple(key), value, ttl=ttl)
+            print(f'[INFO] Cache do CLU carregado: {len(self.cache)} predições', flush=True)
+        except Exception as e:
+            print(f'[WARN] Cache do CLU inválido: {str(e)[:100]}', flush=True)
+
+    def save_cache(self):
+        """Salva as predições válidas em disco (arquivo temporário + rename)"""
+        if self.cache is None or not self.cache_path:
+            return
+        snapshot = {
+            'project': self.project_name,
+            'deployment': self.deployment_name,
+            'saved_at': time.time(),
+            'entries': [[list(key), value, ttl] for key, value, ttl in self.cache.dump()],
+        }
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print(f'[WARN] Falha ao salvar cache do CLU: {str(e)[:100]}', flush=True)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+    def connection_stats(self):
+        """Conexões abertas vs. requisições enviadas (reuso do keep-alive)"""
+        connections = 0
+        pool_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            connections += pool.num_connections
+            pool_requests += pool.num_requests
+        with self._stats_lock:
+            sent, retries = self.requests_sent, self.retries
+        return {
+            'requests': sent,
+            'retries': retries,
+            'connections_opened': connections,
+            'connection_reuse_rate': round(1 - connections / pool_requests, 3) if pool_requests else 0.0,
+            'pool_size': self.pool_size,
+        }
@@ -0,0 +1,198 @@
+"""
+Métricas do pipeline do bot
+- Latência por etapa: janela das últimas amostras (p50/p95 em /api/timings)
+  e histograma cumulativo (Prometheus em /metrics)
+- Contadores com labels (ex.: transições de estado da conversa)
+- Valores lidos no momento da coleta (fila do Cosmos, caches, sessões...)
+
+Com METRICS_ENABLED=false, record/inc/timed não fazem nada
+"""
+import bisect
+import threading
+import time
+from collections import deque
+import azure_config
+
+ENABLED = azure_config.METRICS_ENABLED
+
+# Quantidade de amostras mantidas por etapa
+WINDOW_SIZE = 1024
+
+# Limites (segundos) dos buckets do histograma de latência
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = 'chatbot'
+
+_lock = threading.Lock()
+_samples = {}
+_counts = {}
+_histograms = {}  # etapa -> [contagem por bucket (+Inf no fim), soma]
+_counters = {}    # (nome, labels) -> valor
+_callbacks = {}   # nome -> (função, descrição, tipo)
+
+
+def record(stage, seconds):
+    """Registra a duração (em segundos) de uma etapa"""
+    if not ENABLED:
+        return
+    with _lock:
+        if stage not in _samples:
+            _samples[stage] = deque(maxlen=WINDOW_SIZE)
+            _counts[stage] = 0
+            _histograms[stage] = [[0] * (len(BUCKETS) + 1), 0.0]
+        _samples[stage].append(seconds)
+        _counts[stage] += 1
+        histogram = _histograms[stage]
+        histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+def timed(stage):
+    """Context manager que mede a duração de um bloco"""
+    return _Timer(stage) if ENABLED else _NOOP
+
+
+def inc(name, labels=None, amount=1):
+    """Incrementa um contador (labels: dict opcional, ex.: {'from': 'IDLE'})"""
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())) if labels else ())
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_callback(name, fn, description='', kind='gauge'):
+    """
+    Registra um valor lido de outro componente a cada coleta; fn() retorna um
+    número (ou None para omitir). kind='counter' para totais acumulados
+    """
+    with _lock:
+        _callbacks[name] = (fn, description, kind)
+
+
+def counters():
+    """Contadores atuais: {nome: {labels formatados: valor}}"""
+    with _lock:
+        items = list(_counters.items())
+    result = {}
+    for (name, labels), value in items:
+        result.setdefault(name, {})[_format_labels(labels) or '_'] = value
+    return result
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def snapshot():
+    """Resumo por etapa (ms): total de chamadas, média, p50, p95 e máximo da janela"""
+    with _lock:
+        data = {stage: (list(values), _counts[stage]) for stage, values in _samples.items()}
+
+    summary = {}
+    for stage, (values, count) in data.items():
+        values.sort()
+        summary[stage] = {
+            'count': count,
+            'avg_ms': round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+            'p50_ms': round(_percentile(values, 50) * 1000, 2),
+            'p95_ms': round(_percentile(values, 95) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+        }
+    return summary
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+
+
+def render_prometheus():
+    """Todas as métricas no formato texto do Prometheus (versão 0.0.4)"""
+    with _lock:
+        histograms = {stage: (list(buckets), total) for stage, (buckets, total) in _histograms.items()}
+        counter_items = sorted(_counters.items())
+        callbacks = sorted(_callbacks.items())
+
+    lines = []
+    if histograms:
+        name = f'{PREFIX}_stage_duration_seconds'
+        lines.append(f'# HELP {name} Duração de cada etapa do pipeline')
+        lines.append(f'# TYPE {name} histogram')
+        for stage, (buckets, total) in sorted(histograms.items()):
+            stage_label = f'stage="{_escape(stage)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, buckets):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{stage_label},le="{bound}"}} {cumulative}')
+            cumulative += buckets[-1]
+            lines.append(f'{name}_bucket{{{stage_label},le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{{stage_label}}} {total:.6f}')
+            lines.append(f'{name}_count{{{stage_label}}} {cumulative}')
+
+    declared = set()
+    for (counter, labels), value in counter_items:
+        name = f'{PREFIX}_{counter}_total'
+        if name not in declared:
+            declared.add(name)
+            lines.append(f'# TYPE {name} counter')
+        formatted = _format_labels(labels)
+        lines.append(f'{name}{{{formatted}}} {value}' if formatted else f'{name} {value}')
+
+    for callback, (fn, description, kind) in callbacks:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        if value is None:
+            continue
+        name = f'{PREFIX}_{callback}' + ('_total' if kind == 'counter' else '')
+        if description:
+            lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{name} {float(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Limpa todas as amostras e contadores (callbacks continuam registrados)"""
+    with _lock:
+        _samples.clear()
+        _counts.clear()
+        _histograms.clear()
+        _counters.clear()
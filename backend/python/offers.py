@@ -0,0 +1,67 @@
+"""
+Registros compactos de ofertas de voo e hotel
+Extraídos uma única vez do payload da Amadeus e guardados na sessão no lugar
+do JSON bruto (apenas os campos usados na renderização e na reserva)
+"""
+from dataclasses import dataclass, fields
+
+
+@dataclass(slots=True)
+class FlightOffer:
+    KIND = 'F'
+
+    price_total: str
+    currency: str
+    carrier: str = None
+    departure_time: str = None
+    duration: str = ''
+
+    @classmethod
+    def from_amadeus(cls, offer):
+        price = offer.get('price', {})
+        carrier = departure_time = None
+        duration = ''
+        itineraries = offer.get('itineraries', [])
+        if itineraries:
+            segments = itineraries[0].get('segments', [])
+            if segments:
+                carrier = segments[0].get('carrierCode', '??')
+                departure = segments[0].get('departure', {}).get('at', '')
+                departure_time = departure[11:16] if len(departure) > 11 else '??:??'
+                duration = itineraries[0].get('duration', '').replace('PT', '').replace('H', 'h').replace('M', 'm').lower()
+        return cls(str(price.get('total', 'N/A')), price.get('currency', 'EUR'), carrier, departure_time, duration)
+
+    def to_row(self):
+        return [getattr(self, f.name) for f in fields(self)]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+
+@dataclass(slots=True)
+class HotelOffer:
+    KIND = 'H'
+
+    name: str
+    price_total: str = None  # None quando a Amadeus não retorna ofertas para o hotel
+    currency: str = None
+
+    @classmethod
+    def from_amadeus(cls, hotel):
+        name = hotel.get('hotel', {}).get('name', 'Hotel')
+        offers = hotel.get('offers', [])
+        if not offers:
+            return cls(name)
+        price = offers[0].get('price', {})
+        return cls(name, str(price.get('total', 'N/A')), price.get('currency', 'EUR'))
+
+    def to_row(self):
+        return [getattr(self, f.name) for f in fields(self)]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+
+OFFER_TYPES = {cls.KIND: cls for cls in (FlightOffer, HotelOffer)}
@@ -0,0 +1,102 @@
+"""
+Pré-busca especulativa do provável próximo passo da conversa
+Enquanto o usuário lê a resposta, uma busca que ele provavelmente fará no
+turno seguinte roda em segundo plano e aquece o cache do cliente; quando a
+conversa toma outro rumo a tarefa ainda na fila é cancelada. O total de
+chamadas especulativas é limitado por minuto e pelo tamanho da fila
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+
+class PrefetchScheduler:
+    def __init__(self, workers=2, per_minute=60, max_pending=16):
+        self.per_minute = per_minute
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        # RLock: cancel() executa os callbacks do Future na mesma thread
+        self._lock = threading.RLock()
+        self._pending = {}  # user_id -> (chave, Future) ainda não concluído
+        self._started = deque()  # instantes das chamadas da última janela de 60s
+        self.stats_counts = {'scheduled': 0, 'completed': 0, 'failed': 0, 'cancelled': 0,
+                             'skipped_cached': 0, 'skipped_budget': 0}
+
+    def schedule(self, user_id, key, load, is_cached=None):
+        """
+        Agenda load() para o usuário, substituindo uma pré-busca anterior com
+        outra chave. Não agenda se is_cached() for verdadeiro, se a mesma chave
+        já estiver agendada ou se o orçamento de chamadas estiver esgotado
+        """
+        with self._lock:
+            current = self._pending.get(user_id)
+            if current is not None and current[0] == key:
+                return False
+        if is_cached is not None and is_cached():
+            self._count_locked('skipped_cached')
+            return False
+
+        with self._lock:
+            current = self._pending.pop(user_id, None)
+            if current is not None and current[1].cancel():
+                self._count('cancelled')
+            now = time.monotonic()
+            while self._started and now - self._started[0] > 60:
+                self._started.popleft()
+            if len(self._started) >= self.per_minute or len(self._pending) >= self.max_pending:
+                self._count('skipped_budget')
+                return False
+            self._started.append(now)
+            future = self._executor.submit(self._run, key, load)
+            self._pending[user_id] = (key, future)
+            self._count('scheduled')
+            future.add_done_callback(lambda done: self._forget(user_id, done))
+        return True
+
+    def _forget(self, user_id, future):
+        with self._lock:
+            current = self._pending.get(user_id)
+            if current is not None and current[1] is future:
+                del self._pending[user_id]
+
+    def _run(self, key, load):
+        try:
+            with metrics.timed('prefetch'):
+                load()
+            self._count_locked('completed')
+        except Exception as e:
+            self._count_locked('failed')
+            print(f'[WARN] Prefetch {key} failed: {str(e)[:100]}', flush=True)
+
+    def pending_key(self, user_id):
+        """Chave da pré-busca do usuário ainda na fila ou em andamento, ou None"""
+        with self._lock:
+            current = self._pending.get(user_id)
+        return current[0] if current is not None else None
+
+    def cancel(self, user_id):
+        """Esquece a pré-busca do usuário; cancela se ainda não começou"""
+        with self._lock:
+            current = self._pending.pop(user_id, None)
+            if current is not None and current[1].cancel():
+                self._count('cancelled')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.stats_counts)
+            stats['pending'] = len(self._pending)
+            stats['calls_last_minute'] = len(self._started)
+        stats['per_minute'] = self.per_minute
+        return stats
+
+    # Contadores (_count com o lock adquirido)
+
+    def _count(self, key):
+        self.stats_counts[key] += 1
+        metrics.inc('prefetch', {'result': key})
+
+    def _count_locked(self, key):
+        with self._lock:
+            self._count(key)
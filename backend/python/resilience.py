@@ -0,0 +1,228 @@
+"""
+Isolamento das dependências externas (CLU, Text Analytics, Cosmos, Amadeus)
+- CircuitBreaker: depois de N falhas seguidas recusa as chamadas por um tempo
+  e então deixa passar uma sonda (half-open); sucesso fecha o circuito
+- Bulkhead: limita as chamadas simultâneas à dependência, para que uma
+  dependência lenta não prenda todas as threads do worker
+- Guard: os dois juntos; call() lança DependencyUnavailable sem chamar a
+  dependência, e quem chama cai no fallback que já existia
+"""
+import threading
+import time
+import azure_config
+import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class DependencyUnavailable(Exception):
+    """Chamada recusada sem ser feita (circuito aberto ou bulkhead cheio)"""
+
+    def __init__(self, name, reason):
+        super().__init__(f'{name} indisponível ({reason})')
+        self.name = name
+        self.reason = reason
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, half_open_probes=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0  # falhas seguidas
+        self.opened_at = None
+        self._probes = 0  # sondas em andamento no half-open
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """True se a chamada pode seguir (no half-open, só as sondas)"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.rejected += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self._probes = 0
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._probes = 0
+                self.opened_at = time.monotonic()
+                self.opened += 1
+                self._transition(OPEN)
+
+    def release(self):
+        """Sonda terminou sem resultado conclusivo (ex.: erro do cliente)"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def _transition(self, state):
+        # Chamado com o lock adquirido
+        if state != self.state:
+            print(f'[WARN] Circuito {self.name}: {self.state} -> {state}', flush=True)
+            metrics.inc('circuit_transitions', {'dependency': self.name, 'to': state})
+            self.state = state
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'retry_in_s': retry_in,
+            }
+
+
+class Bulkhead:
+    def __init__(self, name, max_concurrent=16, max_wait=0.1):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def acquire(self, wait=True):
+        """Ocupa uma vaga; espera até max_wait (wait=False: não espera, para o event loop)"""
+        acquired = self._semaphore.acquire(timeout=self.max_wait) if wait else self._semaphore.acquire(blocking=False)
+        with self._lock:
+            if acquired:
+                self.active += 1
+            else:
+                self.rejected += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._semaphore.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {'active': self.active, 'max_concurrent': self.max_concurrent, 'rejected': self.rejected}
+
+
+class Guard:
+    """
+    Circuit breaker + bulkhead de uma dependência.
+    is_failure(exceção) decide se um erro conta para abrir o circuito (erros do
+    cliente, como 400/404, não contam); failed_result(resultado) trata clientes
+    que devolvem o erro em vez de lançar (ex.: {'error': ...} do CLU)
+    """
+
+    def __init__(self, name, breaker, bulkhead, is_failure=None, failed_result=None):
+        self.name = name
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+        self.is_failure = is_failure or (lambda error: True)
+        self.failed_result = failed_result
+
+    def enter(self, wait=True):
+        if not self.breaker.allow():
+            metrics.inc('dependency_rejected', {'dependency': self.name, 'reason': 'circuit_open'})
+            raise DependencyUnavailable(self.name, 'circuito aberto')
+        if not self.bulkhead.acquire(wait):
+            self.breaker.release()
+            metrics.inc('dependency_rejected', {'dependency': self.name, 'reason': 'bulkhead_full'})
+            raise DependencyUnavailable(self.name, 'limite de chamadas simultâneas')
+
+    def exit(self, result=None, error=None):
+        self.bulkhead.release()
+        if error is not None:
+            # Cancelamento (CancelledError, KeyboardInterrupt) não diz nada sobre a dependência
+            if isinstance(error, Exception) and self.is_failure(error):
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+        elif self.failed_result is not None and self.failed_result(result):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def call(self, fn, *args, **kwargs):
+        self.enter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.exit(error=e)
+            raise
+        self.exit(result)
+        return result
+
+    def try_call(self, fn, *args, **kwargs):
+        """call() sem esperar vaga no bulkhead, para chamadas opcionais (ex.: hedge)"""
+        self.enter(wait=False)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.exit(error=e)
+            raise
+        self.exit(result)
+        return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        """call() para corrotinas: o bulkhead não espera vaga (não bloqueia o event loop)"""
+        self.enter(wait=False)
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self.exit(error=e)
+            raise
+        self.exit(result)
+        return result
+
+    def snapshot(self):
+        return dict(self.breaker.snapshot(), bulkhead=self.bulkhead.snapshot())
+
+
+_guards = {}
+
+
+def guard(name, max_concurrent, is_failure=None, failed_result=None):
+    """Guard da dependência com os limites de azure_config (um por nome, por processo)"""
+    if name not in _guards:
+        _guards[name] = Guard(
+            name,
+            CircuitBreaker(name, azure_config.BREAKER_FAILURE_THRESHOLD, azure_config.BREAKER_RESET_TIMEOUT,
+                           azure_config.BREAKER_HALF_OPEN_PROBES),
+            Bulkhead(name, max_concurrent, azure_config.BULKHEAD_MAX_WAIT_MS / 1000),
+            is_failure=is_failure,
+            failed_result=failed_result
+        )
+    return _guards[name]
+
+
+def snapshot():
+    """Estado de cada dependência registrada: {nome: {state, ..., bulkhead}}"""
+    return {name: g.snapshot() for name, g in _guards.items()}
+
+
+def degraded():
+    """Nomes das dependências com o circuito aberto ou em teste"""
+    return [name for name, g in _guards.items() if g.breaker.state != CLOSED]
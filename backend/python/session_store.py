@@ -0,0 +1,322 @@
+"""
+Armazenamento de sessões (contexto da conversa por usuário)
+Sessões expiram por inatividade (idle TTL) e o total é limitado (LRU)
+
+Backends:
+- memory: dicionário no próprio processo (um único worker)
+- sqlite: arquivo compartilhado entre workers do mesmo host, com controle
+  de concorrência otimista pela coluna version
+"""
+import itertools
+import json
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from offers import OFFER_TYPES
+
+# Payloads maiores que isso são comprimidos com zlib
+COMPRESS_THRESHOLD = 512
+
+
+class SessionConflict(Exception):
+    """Outro worker gravou a sessão depois que ela foi lida"""
+
+
+def deep_sizeof(obj, _seen=None):
+    """Tamanho aproximado em bytes de um objeto e tudo que ele referencia"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, _seen) + deep_sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, _seen) for item in obj)
+    elif not isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        if hasattr(obj, '__dict__'):
+            size += deep_sizeof(vars(obj), _seen)
+        # Atributos em __slots__ (FlightOffer, HotelOffer) ficam fora do __dict__
+        for cls in type(obj).__mro__:
+            names = cls.__dict__.get('__slots__', ())
+            for name in (names,) if isinstance(names, str) else names:
+                if name not in ('__dict__', '__weakref__') and hasattr(obj, name):
+                    size += deep_sizeof(getattr(obj, name), _seen)
+    return size
+
+
+class SessionStore:
+    """Interface dos backends de sessão"""
+
+    def get(self, user_id):
+        """Retorna o contexto ou None se ausente/expirado"""
+        raise NotImplementedError
+
+    def put(self, user_id, context):
+        """Grava o contexto; pode lançar SessionConflict"""
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class InMemorySessionStore(SessionStore):
+    # memory_bytes(): média das sessões usadas mais recentemente x total,
+    # recalculada no máximo a cada MEMORY_REFRESH segundos
+    MEMORY_SAMPLE = 200
+    MEMORY_REFRESH = 30
+
+    def __init__(self, max_entries=10000, idle_ttl=1800):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()  # user_id -> (último acesso, contexto), ordem LRU
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+        self._memory_estimate = None  # (instante, bytes)
+
+    def get(self, user_id):
+        """Retorna o contexto (renovando o TTL) ou None se ausente/expirado"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(user_id)
+            if entry is None:
+                return None
+            last_access, context = entry
+            if now - last_access > self.idle_ttl:
+                del self._sessions[user_id]
+                self.expired += 1
+                return None
+            self._sessions[user_id] = (now, context)
+            self._sessions.move_to_end(user_id)
+            return context
+
+    def put(self, user_id, context):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[user_id] = (now, context)
+            self._sessions.move_to_end(user_id)
+            self._evict(now)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def _evict(self, now):
+        # Entradas mais antigas ficam no início: remove as expiradas e o excedente
+        while self._sessions:
+            user_id, (last_access, _) = next(iter(self._sessions.items()))
+            if now - last_access > self.idle_ttl:
+                self._sessions.popitem(last=False)
+                self.expired += 1
+            elif len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+            else:
+                break
+
+    def memory_bytes(self):
+        """Estimativa da memória ocupada pelos contextos (amostra, sem percorrer todas as sessões)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._memory_estimate is not None and now - self._memory_estimate[0] < self.MEMORY_REFRESH:
+                return self._memory_estimate[1]
+            total = len(self._sessions)
+            sample = [context for _, context in itertools.islice(reversed(self._sessions.values()), self.MEMORY_SAMPLE)]
+        sizes = []
+        for context in sample:
+            try:
+                sizes.append(deep_sizeof(context))
+            except RuntimeError:
+                pass  # contexto alterado por um turno durante a contagem
+        estimate = round(sum(sizes) / len(sizes) * total) if sizes else 0
+        with self._lock:
+            self._memory_estimate = (now, estimate)
+        return estimate
+
+    def stats(self):
+        with self._lock:
+            size = len(self._sessions)
+        return {
+            'backend': 'memory',
+            'sessions': size,
+            'max_entries': self.max_entries,
+            'idle_ttl': self.idle_ttl,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'memory_bytes': self.memory_bytes(),
+        }
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+def _encode_offer(obj):
+    # Ofertas viram {"~": tipo, "r": [campos]} no JSON
+    if type(obj) in OFFER_TYPES.values():
+        return {'~': obj.KIND, 'r': obj.to_row()}
+    raise TypeError(f'Objeto não serializável: {type(obj).__name__}')
+
+
+def _decode_offer(obj):
+    if '~' in obj and len(obj) == 2:
+        return OFFER_TYPES[obj['~']].from_row(obj['r'])
+    return obj
+
+
+def to_json(context):
+    """Contexto em JSON compacto (ofertas como linhas)"""
+    return json.dumps(context, separators=(',', ':'), ensure_ascii=False, default=_encode_offer)
+
+
+def from_json(payload):
+    return json.loads(payload, object_hook=_decode_offer)
+
+
+def serialize(context):
+    """JSON compacto, comprimido quando grande (1º byte indica o formato)"""
+    payload = to_json(context).encode('utf-8')
+    if len(payload) > COMPRESS_THRESHOLD:
+        return b'z' + zlib.compress(payload, 1)
+    return b'j' + payload
+
+
+def deserialize(blob):
+    blob = bytes(blob)
+    payload = zlib.decompress(blob[1:]) if blob[:1] == b'z' else blob[1:]
+    return from_json(payload)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Sessões num arquivo SQLite (modo WAL) compartilhado pelos workers do Gunicorn.
+    Cada contexto lido carrega '_version'; put só grava se a versão no banco
+    ainda for a mesma (senão lança SessionConflict)
+    """
+
+    def __init__(self, path, max_entries=10000, idle_ttl=1800, sweep_every=200):
+        self.path = path
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.conflicts = 0
+        self.expired = 0
+        self.evicted = 0
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'user_id TEXT PRIMARY KEY, version INTEGER NOT NULL, '
+            'last_access REAL NOT NULL, payload BLOB NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions (last_access)')
+
+    def _conn(self):
+        # Uma conexão por thread; autocommit (isolation_level=None)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id):
+        row = self._conn().execute(
+            'SELECT version, last_access, payload FROM sessions WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        version, last_access, payload = row
+        if time.time() - last_access > self.idle_ttl:
+            self._conn().execute('DELETE FROM sessions WHERE user_id = ? AND version = ?', (user_id, version))
+            self.expired += 1
+            return None
+        context = deserialize(payload)
+        context['_version'] = version
+        return context
+
+    def put(self, user_id, context):
+        version = context.pop('_version', None)
+        try:
+            payload = serialize(context)
+        finally:
+            if version is not None:
+                context['_version'] = version
+        now = time.time()
+        conn = self._conn()
+
+        if version is None:
+            # Sessão nova: falha se outro worker já criou
+            try:
+                conn.execute(
+                    'INSERT INTO sessions (user_id, version, last_access, payload) VALUES (?, 1, ?, ?)',
+                    (user_id, now, payload)
+                )
+            except sqlite3.IntegrityError:
+                self.conflicts += 1
+                raise SessionConflict(user_id)
+            context['_version'] = 1
+        else:
+            cursor = conn.execute(
+                'UPDATE sessions SET version = version + 1, last_access = ?, payload = ? '
+                'WHERE user_id = ? AND version = ?',
+                (now, payload, user_id, version)
+            )
+            if cursor.rowcount == 0:
+                self.conflicts += 1
+                raise SessionConflict(user_id)
+            context['_version'] = version + 1
+
+        self._maybe_sweep(now)
+
+    def delete(self, user_id):
+        self._conn().execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+
+    def _maybe_sweep(self, now):
+        """A cada sweep_every gravações remove sessões expiradas e o excedente (LRU)"""
+        with self._lock:
+            self._writes += 1
+            if self._writes % self.sweep_every:
+                return
+        conn = self._conn()
+        cursor = conn.execute('DELETE FROM sessions WHERE last_access < ?', (now - self.idle_ttl,))
+        self.expired += max(cursor.rowcount, 0)
+        cursor = conn.execute(
+            'DELETE FROM sessions WHERE user_id IN ('
+            'SELECT user_id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+        self.evicted += max(cursor.rowcount, 0)
+
+    def stats(self):
+        count, size = self._conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM sessions'
+        ).fetchone()
+        return {
+            'backend': 'sqlite',
+            'sessions': count,
+            'max_entries': self.max_entries,
+            'idle_ttl': self.idle_ttl,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'conflicts': self.conflicts,
+            'payload_bytes': size,
+        }
+
+
+def create_session_store(backend, max_entries, idle_ttl, sqlite_path=None):
+    """Cria o backend configurado em SESSION_BACKEND"""
+    if backend == 'sqlite':
+        print(f'[INFO] Sessões em SQLite compartilhado: {sqlite_path}', flush=True)
+        return SqliteSessionStore(sqlite_path, max_entries=max_entries, idle_ttl=idle_ttl)
+    return InMemorySessionStore(max_entries=max_entries, idle_ttl=idle_ttl)
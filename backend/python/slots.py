@@ -0,0 +1,228 @@
+"""
+Extração de slots da mensagem
+- Uma regex pré-compilada percorre o texto normalizado uma vez e devolve
+  trechos tipados (datas absolutas e relativas, quantidade de pessoas,
+  números, CPF e forma de pagamento); extract() monta os slots do bot
+- TurnSlots: slots de um turno calculados sob demanda e memoizados
+"""
+import re
+from datetime import date, timedelta
+import metrics
+
+WEEKDAYS = ('segunda', 'terca', 'quarta', 'quinta', 'sexta', 'sabado', 'domingo')
+
+# Ordem de prioridade quando a mensagem cita mais de uma forma de pagamento
+PAYMENT_TYPES = {
+    'credito': 'Cartão de Crédito',
+    'debito': 'Cartão de Débito',
+    'pix': 'PIX',
+    'boleto': 'Boleto',
+    'dinheiro': 'Dinheiro',
+}
+PAYMENT_PRIORITY = {label: i for i, label in enumerate(PAYMENT_TYPES.values())}
+
+# Dias a partir de hoje para as expressões fixas
+RELATIVE_DAYS = {'hoje': 0, 'amanha': 1, 'depois_amanha': 2, 'nweek': 7}
+
+# Alternativas testadas na ordem em cada posição. O lookahead inicial descarta
+# de cara as posições que não começam nenhum trecho (a maior parte do texto) e
+# os formatos numéricos ficam agrupados atrás de (?=\d): palavras não pagam por
+# eles. Entre os números, os mais específicos (data, CPF) vêm antes do solto
+SCANNER = re.compile(r'''
+    (?=[0-9abcdehnpqst])\b(?:
+    (?=\d)(?:
+        (?P<ymd>(?P<y1>\d{4})-(?P<m1>\d{1,2})-(?P<d1>\d{1,2}))
+      | (?P<dmy>(?P<d2>\d{1,2})(?P<sep>[/-])(?P<m2>\d{1,2})(?P=sep)(?P<y2>\d{4}))
+      | (?P<cpf>\d{3}\.?\d{3}\.?\d{3}-?\d{2}\b)
+      | (?P<para>(?<=\bpara\s)|(?<=\bsao\s))?(?P<num>\d+)(?P<unit>\ ?(?:pessoa|adulto|passageiro))?
+    )
+  | (?P<depois_amanha>depois\sde\samanha\b)
+  | (?P<amanha>amanha\b)
+  | (?P<hoje>hoje\b)
+  | (?:(?P<wmod>proxim[ao]|nest[ae]|est[ae]|n[ao])\s)?
+        (?P<wday>segunda|terca|quarta|quinta|sexta|sabado|domingo)(?P<feira>[-\ ]feira)?(?P<wnext>\sque\svem)?\b
+  | (?:daqui\sa|em)\s(?P<ndays>\d+)\sdias?\b
+  | (?P<nweek>(?:semana\sque\svem|proxima\ssemana)\b)
+  | (?P<pay>credito|debito|pix|boleto|dinheiro)
+    )''', re.VERBOSE)
+
+# Número colado à palavra de seleção ("voo3", "opcao2"): sem fronteira de
+# palavra o SCANNER não o vê; procurado só quando a mensagem não tem outro número
+GLUED_SELECTION = re.compile(r'(?:voo|opcao|hotel|numero)(\d+)\b')
+
+
+class Span:
+    """
+    Trecho reconhecido. kind: 'data' (AAAA-MM-DD), 'pessoas' (número seguido
+    de pessoas/adultos/passageiros), 'quantidade' (número após 'para'/'são'),
+    'numero', 'cpf' (000.000.000-00) ou 'pagamento'
+    """
+    __slots__ = ('kind', 'value', 'start', 'end')
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f'Span({self.kind!r}, {self.value!r}, {self.start}, {self.end})'
+
+
+def _weekday(match, today):
+    """Próxima ocorrência do dia da semana; None se a palavra não indica data"""
+    modifier = match.group('wmod')
+    upcoming = bool(match.group('wnext')) or (modifier or '').startswith('proxim')
+    if not (modifier or match.group('feira') or upcoming):
+        return None  # 'quinta' sozinho pode ser ordinal ("a quinta opção")
+    days = (WEEKDAYS.index(match.group('wday')) - today.weekday()) % 7
+    if days == 0 and upcoming:
+        days = 7
+    return today + timedelta(days=days)
+
+
+def _span(match, today):
+    # lastgroup = último grupo nomeado fechado: identifica a alternativa
+    kind = match.lastgroup
+    group = match.group
+    start, end = match.span()
+    if kind == 'num':
+        return Span('numero' if group('para') is None else 'quantidade', int(group('num')), start, end)
+    if kind == 'unit':
+        return Span('pessoas', int(group('num')), start, end)
+    if kind == 'dmy':
+        return Span('data', f"{group('y2')}-{group('m2').zfill(2)}-{group('d2').zfill(2)}", start, end)
+    if kind == 'ymd':
+        return Span('data', f"{group('y1')}-{group('m1').zfill(2)}-{group('d1').zfill(2)}", start, end)
+    if kind == 'cpf':
+        digits = re.sub(r'\D', '', group('cpf'))
+        return Span('cpf', f'{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}', start, end)
+    if kind == 'pay':
+        return Span('pagamento', PAYMENT_TYPES[group('pay')], start, end)
+
+    # Datas relativas
+    if kind in RELATIVE_DAYS:
+        day = today + timedelta(days=RELATIVE_DAYS[kind])
+    elif kind == 'ndays':
+        day = today + timedelta(days=int(group('ndays')))
+    else:
+        day = _weekday(match, today)
+    return Span('data', day.isoformat(), start, end) if day else None
+
+
+def scan(text_normalized, today=None):
+    """Trechos tipados do texto normalizado (sem acentos, minúsculo), em ordem"""
+    # Espaços repetidos atrapalhariam o lookbehind de 'para N'
+    text = ' '.join(text_normalized.split()) if '  ' in text_normalized else text_normalized
+    today = today or date.today()
+    spans = []
+    for match in SCANNER.finditer(text):
+        span = _span(match, today)
+        if span is not None:
+            spans.append(span)
+    return spans
+
+
+def extract(text_normalized, today=None):
+    """
+    Slots de datas, pessoas, seleção, CPF e pagamento a partir de scan():
+    - data_ida/checkin = 1ª data, data_volta/checkout = 2ª data
+    - pessoas: número com unidade ("2 adultos"), senão número após "para"
+    - selecao: primeiro número fora de datas/CPF, se entre 1 e 10 ("opção 2", "voo 3", "voo3")
+    """
+    info = {}
+    dates = []
+    pessoas = quantidade = selecao = None
+    payment = None
+    for span in scan(text_normalized, today):
+        kind = span.kind
+        if kind == 'data':
+            dates.append(span.value)
+        elif kind == 'cpf':
+            info.setdefault('cpf', span.value)
+        elif kind == 'pagamento':
+            if payment is None or PAYMENT_PRIORITY[span.value] < PAYMENT_PRIORITY[payment]:
+                payment = span.value
+        else:
+            if kind == 'pessoas' and pessoas is None:
+                pessoas = span.value
+            elif kind == 'quantidade' and quantidade is None:
+                quantidade = span.value
+            if selecao is None:
+                selecao = span.value if 1 <= span.value <= 10 else 0
+
+    if dates:
+        info['data_ida'] = info['checkin'] = dates[0]
+    if len(dates) >= 2:
+        info['data_volta'] = info['checkout'] = dates[1]
+    if pessoas is not None or quantidade is not None:
+        info['pessoas'] = pessoas if pessoas is not None else quantidade
+    if selecao is None:
+        glued = GLUED_SELECTION.search(text_normalized)
+        if glued:
+            selecao = int(glued.group(1))
+    if selecao and selecao <= 10:
+        info['selecao'] = selecao
+    if payment:
+        info['pagamento'] = payment
+    return info
+
+
+# Slots produzidos por extract() (uma única passada do scanner)
+SCANNED_SLOTS = ('data_ida', 'data_volta', 'checkin', 'checkout', 'pessoas', 'selecao', 'cpf', 'pagamento')
+
+
+class TurnSlots:
+    """
+    Slots de uma mensagem calculados sob demanda. extractors: slot -> função
+    (recebe o TurnSlots e devolve um dict com um ou mais slots); cada função
+    roda no máximo uma vez por turno, na primeira vez que um de seus slots é
+    pedido. Mesma interface de leitura de um dict (get, [], in)
+    """
+
+    def __init__(self, text, extractors, normalize):
+        self.text = text
+        self._extractors = extractors
+        self._normalize = normalize
+        self._normalized = None
+        self._results = {}  # função -> dict de slots
+
+    @property
+    def normalized(self):
+        if self._normalized is None:
+            self._normalized = self._normalize(self.text)
+        return self._normalized
+
+    def _run(self, extractor):
+        result = self._results.get(extractor)
+        if result is None:
+            metrics.inc('slot_extractions', {'extractor': extractor.__name__})
+            result = self._results[extractor] = extractor(self)
+        return result
+
+    def get(self, slot, default=None):
+        extractor = self._extractors.get(slot)
+        if extractor is None:
+            return default
+        value = self._run(extractor).get(slot)
+        return default if value is None else value
+
+    def __getitem__(self, slot):
+        value = self.get(slot)
+        if value is None:
+            raise KeyError(slot)
+        return value
+
+    def __contains__(self, slot):
+        return self.get(slot) is not None
+
+    def to_dict(self):
+        """Todos os slots encontrados (executa todas as extrações)"""
+        found = {}
+        for extractor in dict.fromkeys(self._extractors.values()):
+            found.update((slot, value) for slot, value in self._run(extractor).items() if value)
+        return found
+
+    def extracted(self):
+        """Nomes das extrações já executadas neste turno"""
+        return [extractor.__name__ for extractor in self._results]
@@ -1,9 +1,109 @@
 from azure.ai.textanalytics import TextAnalyticsClient
 from azure.core.credentials import AzureKeyCredential
+from concurrent.futures import Future
 import azure_config
+import metrics
+import resilience
+import atexit
+import queue
+import threading
+import time
+
+# Limite de documentos por chamada de análise de sentimento da API
+MAX_BATCH_DOCUMENTS = 10
+
+def _sentiment_result(response):
+    if response.is_error:
+        return None
+    return {
+        'sentiment': response.sentiment,
+        'scores': {
+            'positive': response.confidence_scores.positive,
+            'neutral': response.confidence_scores.neutral,
+            'negative': response.confidence_scores.negative
+        }
+    }
+
+class SentimentBatcher:
+    """
+    Agrupa textos de requisições concorrentes por alguns ms (ou até N documentos)
+    e faz uma única chamada analyze_sentiment. submit() devolve um Future
+    """
+
+    def __init__(self, client, batch_size, window_ms, guard):
+        self.client = client
+        self.guard = guard
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_DOCUMENTS))
+        self.window = window_ms / 1000
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {'documents': 0, 'calls': 0, 'failed': 0}
+        self._thread = threading.Thread(target=self._loop, name='sentiment-batcher', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, text):
+        future = Future()
+        self._queue.put((text[:500], future))  # Limitar tamanho
+        return future
+
+    def _loop(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._analyze(batch)
+
+    def _analyze(self, batch):
+        with self._stats_lock:
+            self.stats['documents'] += len(batch)
+            self.stats['calls'] += 1
+        try:
+            with metrics.timed('sentiment'):
+                responses = self.guard.call(self.client.analyze_sentiment, [text for text, _ in batch])
+            for (_, future), response in zip(batch, responses):
+                future.set_result(_sentiment_result(response))
+        except Exception as e:
+            with self._stats_lock:
+                self.stats['failed'] += len(batch)
+            print(f'[ERROR] Sentiment analysis failed: {str(e)[:100]}', flush=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    def close(self, timeout=2):
+        """Processa o que ainda está na fila e encerra a thread"""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def batch_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['pending'] = self._queue.qsize()
+        stats['batch_size'] = self.batch_size
+        stats['avg_documents_per_call'] = round(stats['documents'] / stats['calls'], 2) if stats['calls'] else 0.0
+        return stats
 
 class TextAnalytics:
     def __init__(self):
+        self.batcher = None
+        # Sem sentimento a mensagem é gravada mesmo assim: com o circuito aberto nem tenta
+        self.guard = resilience.guard('text_analytics', azure_config.BULKHEAD_TEXT_ANALYTICS)
         try:
             if not azure_config.TEXT_ANALYTICS_ENDPOINT or not azure_config.TEXT_ANALYTICS_KEY:
                 self.client = None
@@ -18,21 +118,36 @@ class TextAnalytics:
         except Exception as e:
             print(f'[ERROR] Text Analytics init failed: {str(e)}', flush=True)
             self.client = None
+            return
+
+        if azure_config.SENTIMENT_BATCH_SIZE > 1:
+            self.batcher = SentimentBatcher(
+                self.client,
+                azure_config.SENTIMENT_BATCH_SIZE,
+                azure_config.SENTIMENT_BATCH_WINDOW_MS,
+                self.guard
+            )
 
     def analyze_sentiment(self, text):
         if not self.client:
             return None
         
         try:
-            response = self.client.analyze_sentiment([text[:500]])[0]  # Limitar tamanho
-            return {
-                'sentiment': response.sentiment,
-                'scores': {
-                    'positive': response.confidence_scores.positive,
-                    'neutral': response.confidence_scores.neutral,
-                    'negative': response.confidence_scores.negative
-                }
-            }
+            response = self.guard.call(self.client.analyze_sentiment, [text[:500]])[0]  # Limitar tamanho
+            return _sentiment_result(response)
         except Exception as e:
             print(f'[ERROR] Sentiment analysis failed: {str(e)[:100]}', flush=True)
             return None
+
+    def submit(self, text):
+        """Future com o sentimento (resolvido pelo lote) ou None se não configurado"""
+        if not self.client:
+            return None
+        if self.batcher is None:
+            future = Future()
+            future.set_result(self.analyze_sentiment(text))
+            return future
+        return self.batcher.submit(text)
+
+    def stats(self):
+        return self.batcher.batch_stats() if self.batcher is not None else None
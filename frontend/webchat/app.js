@@ -1,5 +1,6 @@
 // Chat Application
 const API_URL = 'https://chatbotviagem-eva3g9gxe7edbxde.eastus2-01.azurewebsites.net/api/chat';
+const STREAM_URL = API_URL + '/stream';  // Mesma resposta, enviada em trechos (SSE)
 const messagesContainer = document.getElementById('chat-messages');
 const inputField = document.getElementById('chat-input');
 const sendBtn = document.getElementById('send-btn');
@@ -65,6 +66,60 @@ function addMessage(text, isUser = false) {
   
   // Scroll to bottom
   messagesContainer.scrollTop = messagesContainer.scrollHeight;
+  return content;
+}
+
+// Parse one Server-Sent Events block ("event: x\ndata: {...}")
+function parseEvent(block) {
+  let event = 'message';
+  let data = '';
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) data += line.slice(5).trim();
+  }
+  return { event, data: data ? JSON.parse(data) : {} };
+}
+
+// Read the streamed reply: chunks are shown as they arrive, 'done' has the full text
+async function readStream(response) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let streamed = '';
+  let content = null;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const { event, data } = parseEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+
+      if (event === 'chunk') {
+        if (!content) {
+          hideTyping();
+          content = addMessage('');
+        }
+        streamed += data.text;
+        content.innerHTML = parseMarkdown(streamed);
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+      } else if (event === 'done') {
+        hideTyping();
+        const text = data.response || data.text || 'Desculpe, não consegui processar sua mensagem.';
+        if (content) {
+          content.innerHTML = parseMarkdown(text);
+        } else {
+          addMessage(text);
+        }
+        return;
+      }
+    }
+  }
+  hideTyping();
+  if (!content) addMessage('Desculpe, não consegui processar sua mensagem.');
 }
 
 // Show typing indicator
@@ -107,12 +162,19 @@ async function sendMessage() {
   showTyping();
   
   try {
-    const response = await fetch(API_URL, {
+    const response = await fetch(STREAM_URL, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ userId, message: text })  // Backend espera 'message'
     });
     
+    const contentType = response.headers.get('Content-Type') || '';
+    if (response.body && contentType.startsWith('text/event-stream')) {
+      await readStream(response);
+      return;
+    }
+    
+    // Erros de validação continuam em JSON
     const data = await response.json();
     hideTyping();
     